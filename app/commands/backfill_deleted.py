@@ -0,0 +1,52 @@
+import asyncio
+import logging.config
+
+from app.helpers.db_utils import close_mongo_connection, connect_to_mongo, create_all_indexes, instance
+from app.helpers.logconf import log_configuration
+from app.models import auth, channel, message, section, server, star, task, user  # noqa: F401 (registers documents)
+
+logger = logging.getLogger(__name__)
+
+# non-partial indexes replaced by the `*_not_deleted` partial indexes defined in the models
+SUPERSEDED_INDEXES = {
+    "messages": ["channel_1_created_at_-1__id_-1"],
+    "server_members": ["server_1", "user_1"],
+    "channels": ["server_1"],
+}
+
+
+async def backfill_deleted_field():
+    for name, doc in instance._doc_lookup.items():
+        if doc.opts.abstract or "deleted" not in doc.schema.fields:
+            continue
+
+        result = await doc.collection.update_many({"deleted": {"$exists": False}}, {"$set": {"deleted": False}})
+        logger.info("backfilled 'deleted' field. [collection=%s, count=%d]", doc.collection.name, result.modified_count)
+
+
+async def drop_superseded_indexes():
+    for name, doc in instance._doc_lookup.items():
+        if doc.opts.abstract:
+            continue
+
+        collection = doc.collection
+        existing_indexes = await collection.index_information()
+        for index_name in SUPERSEDED_INDEXES.get(collection.name, []):
+            if index_name in existing_indexes:
+                await collection.drop_index(index_name)
+                logger.info("dropped index. [collection=%s, index=%s]", collection.name, index_name)
+
+
+async def main():
+    await connect_to_mongo()
+    try:
+        await backfill_deleted_field()
+        await create_all_indexes()
+        await drop_superseded_indexes()
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.config.dictConfig(log_configuration)
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+import asyncio
+import logging.config
+
+from app.helpers.cache_utils import close_redis_connection, connect_to_redis
+from app.helpers.db_utils import close_mongo_connection, connect_to_mongo
+from app.helpers.logconf import log_configuration
+from app.helpers.presence import add_user_channel
+from app.models.server import ServerMember
+from app.models.user import User
+from app.services.crud import get_items, iter_items
+
+logger = logging.getLogger(__name__)
+
+
+async def backfill_presence():
+    # rebuilds the redis presence index from the `online_channels` still tracked on user documents
+    user_count = 0
+    async for users in iter_items(
+        {"online_channels.0": {"$exists": True}}, result_obj=User, current_user=None, projection=["online_channels"]
+    ):
+        for user in users:
+            server_memberships = await get_items(
+                {"user": user.pk}, result_obj=ServerMember, current_user=user, limit=None, projection=["server"]
+            )
+            server_ids = [member.server.pk for member in server_memberships]
+            for channel_name in user.online_channels:
+                await add_user_channel(user.pk, channel_name=channel_name, server_ids=server_ids)
+            user_count += 1
+
+    logger.info("backfilled presence. [user_count=%d]", user_count)
+
+
+async def main():
+    await connect_to_mongo()
+    await connect_to_redis()
+    try:
+        await backfill_presence()
+    finally:
+        await close_redis_connection()
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.config.dictConfig(log_configuration)
+    asyncio.run(main())
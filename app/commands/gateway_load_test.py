@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import logging.config
+import statistics
+import time
+from typing import List
+
+import orjson
+from websockets.legacy.client import connect as websocket_connect
+
+from app.helpers.cache_utils import cache, close_redis_connection, connect_to_redis
+from app.helpers.db_utils import close_mongo_connection, connect_to_mongo
+from app.helpers.gateway import get_gateway_channel_name
+from app.helpers.jwt import generate_jwt_token
+from app.helpers.logconf import log_configuration
+from app.helpers.websockets import RedisPubSubTransport
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# run against a local stack (`docker compose up`, with WEBSOCKET_TRANSPORT=redis) to measure gateway fan-out:
+#   python -m app.commands.gateway_load_test --url ws://localhost:5001/websockets/gateway --connections 1000
+
+
+async def _create_load_test_users(count: int) -> List[User]:
+    users = [User(wallet_address=f"load-test-{index}", display_name=f"load test {index}") for index in range(count)]
+    for user in users:
+        await user.commit()
+        refresh_token = generate_jwt_token(data={"sub": str(user.pk)}, token_type="refresh")
+        await cache.client.sadd(f"refresh_tokens:{str(user.pk)}", refresh_token)
+    return users
+
+
+async def _receive_events(url: str, user: User, event_count: int, latencies: List[float]):
+    access_token = generate_jwt_token(data={"sub": str(user.pk)})
+    async with websocket_connect(url) as websocket:
+        await websocket.send(orjson.dumps({"event": "authenticate", "data": {"token": access_token}}).decode())
+        received = 0
+        while received < event_count:
+            message = orjson.loads(await websocket.recv())
+            if message["event"] != "LOAD_TEST":
+                continue
+            latencies.append((time.time() - message["data"]["sent_at"]) * 1000)
+            received += 1
+
+
+async def run_load_test(url: str, connection_count: int, event_count: int):
+    users = await _create_load_test_users(connection_count)
+    latencies: List[float] = []
+    try:
+        receivers = [asyncio.create_task(_receive_events(url, user, event_count, latencies)) for user in users]
+        await asyncio.sleep(2)  # let every connection subscribe
+
+        transport = RedisPubSubTransport()
+        channels = [get_gateway_channel_name(str(user.pk), "load-test") for user in users]
+        start_time = time.time()
+        for _ in range(event_count):
+            for index in range(0, len(channels), 90):
+                await transport.trigger(channels[index : index + 90], "LOAD_TEST", {"sent_at": time.time()})
+
+        await asyncio.wait_for(asyncio.gather(*receivers), timeout=60)
+        duration = time.time() - start_time
+    finally:
+        await User.collection.delete_many({"_id": {"$in": [user.pk for user in users]}})
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    logger.info(
+        "gateway load test finished. [connections=%d, events=%d, delivered=%d, duration_s=%.2f, p50_ms=%.2f, "
+        "p95_ms=%.2f, p99_ms=%.2f]",
+        connection_count,
+        event_count,
+        len(latencies),
+        duration,
+        quantiles[49],
+        quantiles[94],
+        quantiles[98],
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test the websocket gateway.")
+    parser.add_argument("--url", default="ws://localhost:5001/websockets/gateway")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--events", type=int, default=10)
+    args = parser.parse_args()
+
+    await connect_to_mongo()
+    await connect_to_redis()
+    try:
+        await run_load_test(args.url, connection_count=args.connections, event_count=args.events)
+    finally:
+        await close_redis_connection()
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.config.dictConfig(log_configuration)
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+import asyncio
+import logging.config
+from typing import List, Tuple
+
+from app.helpers.cache_utils import close_redis_connection, connect_to_redis
+from app.helpers.db_utils import close_mongo_connection, connect_to_mongo
+from app.helpers.logconf import log_configuration
+from app.helpers.presence import iter_presence_user_channels, remove_offline_server_users
+from app.helpers.websockets import close_pusher_connection, pusher_client
+from app.models.user import User
+from app.services.crud import get_item_by_id
+from app.services.webhooks import process_channel_vacated_event
+
+logger = logging.getLogger(__name__)
+
+PUSHER_CHANNEL_PREFIX = "private-"
+
+# presence is only cleared by pusher's vacated webhooks, a lost one leaves the user online for good. this replays
+# the ones pusher no longer has an occupied channel for, meant to run periodically:
+#   python -m app.commands.reconcile_presence
+
+
+async def reconcile_presence() -> int:
+    # snapshot presence before asking pusher, channels occupied after that are still checked one by one below
+    pusher_channels: List[Tuple[str, str]] = []
+    async for user_id, channel_names in iter_presence_user_channels():
+        pusher_channels.extend(
+            (user_id, channel_name) for channel_name in channel_names if channel_name.startswith(PUSHER_CHANNEL_PREFIX)
+        )
+
+    occupied_channels = (await pusher_client.channels_info(prefix_filter=PUSHER_CHANNEL_PREFIX)).get("channels", {})
+
+    vacated_count = 0
+    for user_id, channel_name in pusher_channels:
+        if channel_name in occupied_channels:
+            continue
+        # the user may have reconnected since the listing
+        if (await pusher_client.channel_info(channel_name)).get("occupied"):
+            continue
+
+        user = await get_item_by_id(id_=user_id, result_obj=User)
+        if not user:
+            continue
+        await process_channel_vacated_event(channel_name=channel_name, current_user=user)
+        vacated_count += 1
+
+    removed_count = await remove_offline_server_users()
+    logger.info("reconciled presence. [vacated_channels=%d, server_users_removed=%d]", vacated_count, removed_count)
+    return vacated_count
+
+
+async def main():
+    await connect_to_mongo()
+    await connect_to_redis()
+    try:
+        await reconcile_presence()
+    finally:
+        await close_pusher_connection()
+        await close_redis_connection()
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.config.dictConfig(log_configuration)
+    asyncio.run(main())
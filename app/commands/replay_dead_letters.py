@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import logging.config
+from typing import Any, Dict, Optional
+
+from app.helpers.cache_utils import close_redis_connection, connect_to_redis
+from app.helpers.dates import get_mongo_utc_date
+from app.helpers.db_utils import close_mongo_connection, connect_to_mongo
+from app.helpers.logconf import log_configuration
+from app.helpers.queue_utils import dispatch_serial_fs
+from app.helpers.task_queue import decode_tasks
+from app.helpers.websockets import close_pusher_connection
+from app.models.task import DeadLetterTask
+
+logger = logging.getLogger(__name__)
+
+# runs failed background tasks again, oldest first. tasks that fail again get a new dead letter entry:
+#   python -m app.commands.replay_dead_letters --task app.services.websockets:broadcast_message_event --limit 100
+
+
+async def replay_dead_letter_tasks(task_name: Optional[str] = None, limit: int = 100, dry_run: bool = False) -> int:
+    filters: Dict[str, Any] = {"replayed_at": None, "deleted": False}
+    if task_name:
+        filters["task"] = task_name
+
+    replayed = 0
+    async for dead_letter in DeadLetterTask.find(filters).sort("created_at", 1).limit(limit):
+        try:
+            fs = await decode_tasks(dead_letter.payload)
+        except Exception:
+            logger.exception("Problem decoding failed task, skipping it. [id=%s]", str(dead_letter.pk))
+            continue
+
+        if dry_run:
+            logger.info("Would replay task. [id=%s, task=%s]", str(dead_letter.pk), dead_letter.task)
+            continue
+
+        await dispatch_serial_fs(fs)
+        dead_letter.replayed_at = get_mongo_utc_date()
+        await dead_letter.commit()
+        replayed += 1
+
+    return replayed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay background tasks from the dead letter collection.")
+    parser.add_argument("--task", help="only replay this task, e.g. app.services.websockets:broadcast_message_event")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    await connect_to_mongo()
+    await connect_to_redis()
+    try:
+        replayed = await replay_dead_letter_tasks(task_name=args.task, limit=args.limit, dry_run=args.dry_run)
+        logger.info("Replayed failed tasks. [count=%d]", replayed)
+    finally:
+        await close_pusher_connection()
+        await close_redis_connection()
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.config.dictConfig(log_configuration)
+    asyncio.run(main())
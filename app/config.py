@@ -21,6 +21,18 @@ class Settings(BaseSettings):
     redis_username: Optional[str]
     redis_password: Optional[str]
 
+    slow_command_threshold_ms: int = 100
+
+    document_cache_enabled: bool = True
+    document_cache_local_max_size: int = 1024
+    document_cache_local_ttl_seconds: int = 5
+
+    ready_cache_enabled: bool = True
+    # presence isn't invalidated, so this bounds how stale statuses in a cached /ready payload can get
+    ready_cache_ttl_seconds: int = 300
+    # servers with more members only list online members and recent authors in /ready, 0 disables it
+    ready_lazy_members_threshold: int = 1000
+
     jwt_secret_key: str
     jwt_access_token_expire_minutes: Optional[int] = 60
     jwt_refresh_token_expire_minutes: Optional[int] = 10080
@@ -31,6 +43,27 @@ class Settings(BaseSettings):
     pusher_key: Optional[str]
     pusher_secret: Optional[str]
     pusher_cluster: Optional[str]
+    pusher_max_concurrent_requests: int = 20
+    pusher_trigger_retries: int = 2
+    # "pusher" or "redis" (the native gateway at /websockets/gateway)
+    websocket_transport: str = "pusher"
+    # at most one USER_TYPING broadcast per user and channel, and one presence broadcast per user, per window
+    typing_throttle_ms: int = 3000
+    presence_throttle_ms: int = 2000
+    # channels' last_message_at is written at most once per interval, 0 writes it on every message
+    channel_last_message_flush_ms: int = 1000
+
+    # "local" runs background tasks in the web process, "redis" queues them for `python -m app.worker`
+    bg_tasks_backend: str = "local"
+    bg_worker_concurrency: int = 50
+    # in-process executor: concurrent task batches, queued batches before the overflow policy kicks in ("block" makes
+    # the caller wait, "drop_oldest" drops the oldest queued batch), and the depth at which sheddable tasks are dropped
+    bg_tasks_max_concurrency: int = 100
+    bg_tasks_max_queue_size: int = 10000
+    bg_tasks_overflow_policy: str = "block"
+    bg_tasks_shed_queue_size: int = 1000
+    slow_bg_task_threshold_ms: int = 10000
+    bg_task_stats_log_interval_seconds: int = 60
 
     sentry_dsn: Optional[str]
 
@@ -10,6 +10,8 @@ from starlette.requests import Request
 from app.helpers.cache_utils import cache
 from app.helpers.connection import get_db
 from app.helpers.jwt import decode_jwt_token
+from app.helpers.pagination import decode_cursor
+from app.models.user import User
 from app.services.users import get_user_by_id
 
 oauth2_scheme = HTTPBearer()
@@ -17,23 +19,21 @@ oauth2_scheme = HTTPBearer()
 logger = logging.getLogger(__name__)
 
 
-async def get_current_user(
-    request: Request, token: HTTPAuthorizationCredentials = Depends(oauth2_scheme), db=Depends(get_db)
-):
+async def get_user_from_token(token: str) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate token",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = decode_jwt_token(token.credentials)
+        payload = decode_jwt_token(token)
         user_id: str = payload.get("sub")
         if not user_id:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     except Exception:
-        logger.exception("Problems decoding JWT. [jwt=%s]", token.credentials)
+        logger.exception("Problems decoding JWT. [jwt=%s]", token)
         raise credentials_exception
 
     user = await get_user_by_id(user_id=user_id)
@@ -45,6 +45,15 @@ async def get_current_user(
         logger.warning("Refresh tokens have all been revoked. [user_id=%s]", user_id)
         raise credentials_exception
 
+    return user
+
+
+async def get_current_user(
+    request: Request, token: HTTPAuthorizationCredentials = Depends(oauth2_scheme), db=Depends(get_db)
+):
+    user = await get_user_from_token(token.credentials)
+    user_id = str(user.pk)
+
     request.state.user_id = user_id
     request.state.auth_type = "bearer"
 
@@ -61,11 +70,13 @@ async def common_parameters(
     sort_by_field: str = "created_at",
     sort_by_direction: int = -1,
     sort: str = None,
+    cursor: Optional[str] = None,
 ):
-    present = [v for v in [before, after, around] if v is not None]
+    present = [v for v in [before, after, around, cursor] if v is not None]
     if len(present) > 1:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Only one of 'before', 'after' and 'around can be present."
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only one of 'before', 'after', 'around' and 'cursor' can be present.",
         )
 
     if sort:
@@ -76,6 +87,15 @@ async def common_parameters(
             sort_by_field = sort
             sort_by_direction = 1
 
+    page_cursor = None
+    if cursor:
+        try:
+            page_cursor = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+        sort_by_field = page_cursor.sort_by_field
+        sort_by_direction = page_cursor.sort_by_direction
+
     return {
         "before": before,
         "after": after,
@@ -83,4 +103,19 @@ async def common_parameters(
         "limit": limit,
         "sort_by_field": sort_by_field,
         "sort_by_direction": sort_by_direction,
+        "cursor": page_cursor,
     }
+
+
+async def id_page_parameters(limit: Optional[int] = Query(None, gt=0, le=1000), cursor: Optional[str] = None):
+    # opt-in cursor paging for listings ordered by _id, without either param the full listing is returned
+    page_cursor = None
+    if cursor:
+        try:
+            page_cursor = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+        if page_cursor.sort_by_field != "_id":
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+    return {"limit": limit, "cursor": page_cursor}
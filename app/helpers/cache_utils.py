@@ -1,6 +1,25 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import json_util
 from redis.asyncio.client import Redis
+from redis.exceptions import RedisError
 
 from app.config import get_settings
+from app.helpers.metrics import record_redis_command
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedRedis(Redis):
+    async def execute_command(self, *args, **options):
+        start_time = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            record_redis_command(str(args[0]), (time.perf_counter() - start_time) * 1000)
 
 
 class Cache:
@@ -10,9 +29,44 @@ class Cache:
 cache = Cache()
 
 
+class LocalCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._items.get(key)
+        if not item:
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._items.pop(key, None)
+            return None
+
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: int):
+        self._items[key] = (time.monotonic() + ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def delete(self, *keys: str):
+        for key in keys:
+            self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+
+local_cache = LocalCache(max_size=get_settings().document_cache_local_max_size)
+
+
 async def connect_to_redis(db=None):
     settings = get_settings()
-    redis = Redis(
+    redis = InstrumentedRedis(
         host=settings.redis_host,
         port=settings.redis_port,
         db=db or settings.redis_db,
@@ -30,4 +84,67 @@ async def connect_to_redis_testing():
 
 
 async def close_redis_connection():
+    local_cache.clear()
     await cache.client.close()
+
+
+def get_document_cache_ttl(result_obj) -> Optional[int]:
+    # models opt-in to the document cache by setting `cache_ttl` (in seconds) in their Meta class
+    settings = get_settings()
+    if not settings.document_cache_enabled:
+        return None
+    return getattr(result_obj.Meta, "cache_ttl", None)
+
+
+def _get_document_cache_key(result_obj, id_: Any) -> str:
+    return f"documents:{result_obj.opts.collection_name}:{str(id_)}"
+
+
+async def get_cached_document(result_obj, id_: Any) -> Optional[Dict[str, Any]]:
+    key = _get_document_cache_key(result_obj, id_)
+    cached_value = local_cache.get(key)
+    if cached_value is None and cache.client:
+        try:
+            cached_value = await cache.client.get(key)
+        except RedisError:
+            logger.warning("Problem reading cached document. [key=%s]", key)
+            return None
+
+        if cached_value is not None:
+            settings = get_settings()
+            local_ttl = min(get_document_cache_ttl(result_obj) or 0, settings.document_cache_local_ttl_seconds)
+            local_cache.set(key, cached_value, ttl=local_ttl)
+
+    if cached_value is None:
+        return None
+
+    return json_util.loads(cached_value)
+
+
+async def set_cached_document(result_obj, raw_document: Dict[str, Any], ttl: int):
+    settings = get_settings()
+    key = _get_document_cache_key(result_obj, raw_document["_id"])
+    value = json_util.dumps(raw_document)
+    local_cache.set(key, value, ttl=min(ttl, settings.document_cache_local_ttl_seconds))
+    if not cache.client:
+        return
+
+    try:
+        await cache.client.set(key, value, ex=ttl)
+    except RedisError:
+        logger.warning("Problem caching document. [key=%s]", key)
+
+
+async def invalidate_cached_documents(result_obj, ids: List[Any]):
+    if not ids or not get_document_cache_ttl(result_obj):
+        return
+
+    keys = [_get_document_cache_key(result_obj, id_) for id_ in ids]
+    local_cache.delete(*keys)
+    if not cache.client:
+        return
+
+    try:
+        await cache.client.delete(*keys)
+    except RedisError:
+        logger.exception("Problem invalidating cached documents. [keys=%s]", keys)
@@ -1,9 +1,22 @@
-from typing import List
+import asyncio
+import logging
+from asyncio import CancelledError, Task
+from datetime import datetime
+from typing import Dict, List, Optional
 
+from bson import ObjectId
+from pymongo import UpdateOne
+from sentry_sdk import capture_exception
+
+from app.config import get_settings
+from app.helpers.cache_utils import invalidate_cached_documents
+from app.helpers.dates import get_mongo_utc_date
 from app.models.channel import Channel
 from app.models.server import ServerMember
 from app.models.user import User
-from app.services.crud import get_item, get_items
+from app.services.crud import get_item, get_items, iter_items
+
+logger = logging.getLogger(__name__)
 
 
 async def is_user_in_channel(user: User, channel: Channel) -> bool:
@@ -12,6 +25,7 @@ async def is_user_in_channel(user: User, channel: Channel) -> bool:
         user_in_server = await get_item(
             filters={"server": channel.server.pk, "user": user.id},
             result_obj=ServerMember,
+            projection=["_id"],
         )
 
         if not user_in_server:
@@ -35,12 +49,103 @@ async def get_channel_users(channel: Channel) -> List[User]:
         for member in channel.members:
             user_ids.add(member.pk)
     elif channel.kind == "server":
-        members = await get_items(
-            filters={"server": channel.server.pk}, result_obj=ServerMember, current_user=None, limit=None
-        )
-        for member in members:
-            user_ids.add(member.user.pk)
+        async for members in iter_items(
+            filters={"server": channel.server.pk},
+            result_obj=ServerMember,
+            current_user=None,
+            projection=["user"],
+        ):
+            user_ids.update([member.user.pk for member in members])
 
-    users = await get_items(filters={"_id": {"$in": list(user_ids)}}, result_obj=User, current_user=None, limit=None)
+    users = await get_items(
+        filters={"_id": {"$in": list(user_ids)}},
+        result_obj=User,
+        current_user=None,
+        limit=None,
+        projection=["status", "online_channels"],
+    )
 
     return users
+
+
+async def set_channels_last_message_at(last_message_dates: Dict[ObjectId, datetime]):
+    if not last_message_dates:
+        return
+
+    # $max keeps whichever date is newer, so concurrent flushes from other processes can't move it backwards
+    updated_at = get_mongo_utc_date()
+    await Channel.collection.bulk_write(
+        [
+            UpdateOne(
+                {"_id": channel_id}, {"$max": {"last_message_at": last_message_at}, "$set": {"updated_at": updated_at}}
+            )
+            for channel_id, last_message_at in last_message_dates.items()
+        ],
+        ordered=False,
+    )
+
+    # /ready snapshots aren't invalidated, they read last_message_at live when they're served
+    await invalidate_cached_documents(Channel, list(last_message_dates))
+
+
+# keeps the newest message date of each channel in memory and writes them all at once every interval, so a busy
+# channel gets one write per interval instead of a read and a write per message
+class ChannelLastMessageWriter:
+    def __init__(self):
+        self._pending: Dict[ObjectId, datetime] = {}
+        self._flusher: Optional[Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _add_pending(self, channel_id: ObjectId, last_message_at: datetime):
+        pending_at = self._pending.get(channel_id)
+        if not pending_at or last_message_at > pending_at:
+            self._pending[channel_id] = last_message_at
+
+    async def record(self, channel_id: ObjectId, last_message_at: datetime):
+        flush_ms = get_settings().channel_last_message_flush_ms
+        if flush_ms <= 0:
+            await set_channels_last_message_at({channel_id: last_message_at})
+            return
+
+        self._add_pending(channel_id, last_message_at)
+        loop = asyncio.get_running_loop()
+        if self._flusher is None or self._flusher.done() or self._loop is not loop:
+            self._flusher = asyncio.create_task(self._run(flush_ms / 1000), name="ChannelLastMessageFlusher")
+            self._loop = loop
+
+    async def _run(self, interval: float):
+        while self._pending:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        try:
+            await set_channels_last_message_at(pending)
+        except Exception as e:
+            # kept for the next flush, newer dates recorded in the meantime win
+            logger.exception("Problem flushing channel last message dates. [count=%d]", len(pending))
+            capture_exception(e)
+            for channel_id, last_message_at in pending.items():
+                self._add_pending(channel_id, last_message_at)
+        except CancelledError:
+            for channel_id, last_message_at in pending.items():
+                self._add_pending(channel_id, last_message_at)
+            raise
+
+    async def stop(self):
+        if self._flusher and self._loop is asyncio.get_running_loop():
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+        await self.flush()
+
+
+channel_last_message_writer = ChannelLastMessageWriter()
+
+
+async def stop_channel_last_message_writer():
+    await channel_last_message_writer.stop()
@@ -7,6 +7,7 @@ from umongo.frameworks import MotorAsyncIOInstance
 
 from app.config import get_settings
 from app.helpers.connection import conn
+from app.helpers.metrics import command_stats_listener
 
 logger = logging.getLogger(__name__)
 
@@ -15,14 +16,14 @@ instance = MotorAsyncIOInstance()
 
 async def connect_to_mongo():
     settings = get_settings()
-    conn.client = AsyncIOMotorClient(settings.mongodb_url)
+    conn.client = AsyncIOMotorClient(settings.mongodb_url, event_listeners=[command_stats_listener])
     conn.database = conn.client[settings.mongodb_db]
     instance.set_db(conn.database)
 
 
 async def override_connect_to_mongo():
     settings = get_settings()
-    conn.client = AsyncIOMotorClient(settings.mongodb_url)
+    conn.client = AsyncIOMotorClient(settings.mongodb_url, event_listeners=[command_stats_listener])
     conn.database = conn.client[settings.mongodb_test_db]
     instance.set_db(conn.database)
 
@@ -39,7 +40,7 @@ async def create_all_indexes():
             collection = doc.collection  # type: Collection
             index_opts = {}
             if isinstance(index, list) and isinstance(index[-1], dict):
-                index_opts = index.pop(-1)
+                index, index_opts = index[:-1], index[-1]
 
             result = await collection.create_index(index, background=True, **index_opts)
             index_names.append(f"{name}.{result}")
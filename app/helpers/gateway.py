@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import DefaultDict, Dict, Optional
+
+from redis.asyncio.client import PubSub
+from redis.exceptions import RedisError
+from starlette import status
+from starlette.websockets import WebSocket
+
+from app.helpers.cache_utils import cache
+
+logger = logging.getLogger(__name__)
+
+# every worker subscribes to the topics of the users connected to it, so an event published once reaches the user's
+# sockets on whichever workers they're connected to
+GATEWAY_USER_TOPIC = "gateway:users:{user_id}"
+GATEWAY_CHANNEL_PREFIX = "ws"
+# a client with this many undelivered events, or one send taking this long, is disconnected
+GATEWAY_SEND_QUEUE_SIZE = 1000
+GATEWAY_SEND_TIMEOUT_SECONDS = 10
+
+
+def get_gateway_channel_name(user_id: str, connection_id: str) -> str:
+    # same `<prefix>-<user_id>-<suffix>` shape as pusher's private channels, so presence and webhook helpers work as is
+    return f"{GATEWAY_CHANNEL_PREFIX}-{user_id}-{connection_id}"
+
+
+class _GatewayConnection:
+    # each socket is written to by its own task, so a slow client only backs up its own queue
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=GATEWAY_SEND_QUEUE_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+        self.dropped = False
+
+
+class WebSocketGateway:
+    def __init__(self):
+        self._connections: DefaultDict[str, Dict[WebSocket, _GatewayConnection]] = defaultdict(dict)
+        self._pubsub: Optional[PubSub] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def connect(self, user_id: str, websocket: WebSocket):
+        is_first_connection = not self._connections[user_id]
+        connection = _GatewayConnection(websocket)
+        connection.sender = asyncio.create_task(self._send(user_id, connection), name="WebSocketGatewaySender")
+        self._connections[user_id][websocket] = connection
+        if not is_first_connection:
+            return
+
+        if self._pubsub is None:
+            self._pubsub = cache.client.pubsub()
+        await self._pubsub.subscribe(GATEWAY_USER_TOPIC.format(user_id=user_id))
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen(), name="WebSocketGatewayListener")
+
+    async def disconnect(self, user_id: str, websocket: WebSocket):
+        connections = self._connections.get(user_id, {})
+        connection = connections.pop(websocket, None)
+        if connection is None:
+            return
+        if connection.sender and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+        if connections:
+            return
+
+        self._connections.pop(user_id, None)
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(GATEWAY_USER_TOPIC.format(user_id=user_id))
+
+    async def _listen(self):
+        while self._pubsub is not None:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except RedisError:
+                logger.exception("Problem reading gateway messages.")
+                await asyncio.sleep(1)
+                continue
+
+            if message and message["type"] == "message":
+                user_id = message["channel"].split(":")[-1]
+                await self.send_to_user(user_id, message["data"])
+
+    async def send_to_user(self, user_id: str, payload: str):
+        for connection in list(self._connections.get(user_id, {}).values()):
+            if connection.dropped:
+                continue
+            try:
+                connection.queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                logger.warning("Gateway client too slow, dropping it. [user_id=%s]", user_id)
+                connection.dropped = True
+                if connection.sender:
+                    connection.sender.cancel()
+
+    async def _send(self, user_id: str, connection: _GatewayConnection):
+        try:
+            while True:
+                payload = await connection.queue.get()
+                await asyncio.wait_for(connection.websocket.send_text(payload), timeout=GATEWAY_SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            if not connection.dropped:
+                raise
+        except Exception:
+            logger.warning("Problem sending gateway message, dropping client. [user_id=%s]", user_id)
+
+        # the endpoint sees the close as a disconnect and clears the user's presence for this socket
+        await self.disconnect(user_id, connection.websocket)
+        try:
+            await asyncio.wait_for(
+                connection.websocket.close(code=status.WS_1011_INTERNAL_ERROR), timeout=GATEWAY_SEND_TIMEOUT_SECONDS
+            )
+        except Exception:
+            logger.debug("Problem closing dropped gateway client. [user_id=%s]", user_id)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            pubsub, self._pubsub = self._pubsub, None
+            await pubsub.close()
+        for connections in self._connections.values():
+            for connection in connections.values():
+                if connection.sender:
+                    connection.sender.cancel()
+        self._connections.clear()
+
+
+websocket_gateway = WebSocketGateway()
+
+
+async def close_websocket_gateway():
+    await websocket_gateway.close()
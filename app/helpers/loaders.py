@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import marshmallow
+from umongo import Reference
+from umongo.exceptions import NoneReferenceError
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceLoader:
+    def __init__(self):
+        self._futures: Dict[Tuple[str, Any], asyncio.Future] = {}
+        self._pending: Dict[str, Tuple[Any, List[Any]]] = {}
+        self._dispatch_scheduled = False
+        # the loop only keeps weak references to tasks, a dispatch that isn't held here could be collected mid-flight
+        self._dispatch_tasks: Set[asyncio.Task] = set()
+
+    def load(self, document_cls, pk) -> asyncio.Future:
+        collection_name = document_cls.opts.collection_name
+        future = self._futures.get((collection_name, pk))
+        if future:
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[(collection_name, pk)] = future
+        _, pending_ids = self._pending.setdefault(collection_name, (document_cls, []))
+        pending_ids.append(pk)
+
+        # wait for the current loop iteration to finish so all sibling loads get batched together
+        if not self._dispatch_scheduled:
+            self._dispatch_scheduled = True
+            loop.call_soon(self._start_dispatch)
+
+        return future
+
+    def _start_dispatch(self):
+        task = asyncio.create_task(self._dispatch())
+        self._dispatch_tasks.add(task)
+        task.add_done_callback(self._dispatch_tasks.discard)
+
+    async def _dispatch(self):
+        pending = self._pending
+        self._pending = {}
+        self._dispatch_scheduled = False
+
+        await asyncio.gather(
+            *[self._load_batch(document_cls, ids) for document_cls, ids in pending.values()],
+        )
+
+    async def _load_batch(self, document_cls, ids: List[Any]):
+        collection_name = document_cls.opts.collection_name
+        futures = [self._futures[(collection_name, pk)] for pk in ids]
+        try:
+            cursor = document_cls.collection.find({"_id": {"$in": ids}})
+            raw_documents = await cursor.to_list(length=None)
+            documents = {
+                raw_doc["_id"]: document_cls.build_from_mongo(raw_doc, use_cls=True) for raw_doc in raw_documents
+            }
+            logger.debug("loaded %d references. [collection=%s]", len(ids), collection_name)
+
+            for pk, future in zip(ids, futures):
+                document = documents.get(pk)
+                if document is None:
+                    self._futures.pop((collection_name, pk), None)
+                    error_message = Reference.error_messages["not_found"].format(document=document_cls.__name__)
+                    future.set_exception(marshmallow.ValidationError(error_message))
+                else:
+                    future.set_result(document)
+        except Exception as e:
+            # fail whatever is still pending and forget it, so later loads of the same pks query again
+            for pk, future in zip(ids, futures):
+                if not future.done():
+                    self._futures.pop((collection_name, pk), None)
+                    future.set_exception(e)
+
+
+_reference_loader_ctx_var: ContextVar[Optional[ReferenceLoader]] = ContextVar("reference_loader", default=None)
+
+
+def init_reference_loader() -> Token:
+    return _reference_loader_ctx_var.set(ReferenceLoader())
+
+
+def reset_reference_loader(token: Token):
+    _reference_loader_ctx_var.reset(token)
+
+
+async def fetch_reference(reference: Reference):
+    loader = _reference_loader_ctx_var.get()
+    if not loader or reference._document:
+        return await reference.fetch()
+
+    if reference.pk is None:
+        raise NoneReferenceError("Cannot retrieve a None Reference")
+
+    document = await loader.load(reference.document_cls, reference.pk)
+    reference._document = document
+    return document
+
+
+async def fetch_references(references: List[Reference]) -> List[Any]:
+    return await asyncio.gather(*[fetch_reference(reference) for reference in references])
@@ -0,0 +1,201 @@
+import logging
+import threading
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats:
+    def __init__(self):
+        # mongo commands are recorded from motor's executor threads
+        self._lock = threading.Lock()
+        self.db_calls = 0
+        self.db_ms = 0.0
+        self.redis_calls = 0
+        self.redis_ms = 0.0
+        self.pusher_calls = 0
+
+    def record_db_command(self, duration_ms: float):
+        with self._lock:
+            self.db_calls += 1
+            self.db_ms += duration_ms
+
+    def record_redis_command(self, duration_ms: float):
+        with self._lock:
+            self.redis_calls += 1
+            self.redis_ms += duration_ms
+
+    def record_pusher_call(self):
+        with self._lock:
+            self.pusher_calls += 1
+
+    def to_log_data(self) -> Dict[str, Any]:
+        return {
+            "db_calls": self.db_calls,
+            "db_ms": "{0:.2f}".format(self.db_ms),
+            "redis_calls": self.redis_calls,
+            "redis_ms": "{0:.2f}".format(self.redis_ms),
+            "pusher_calls": self.pusher_calls,
+        }
+
+
+_request_stats_ctx_var: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def init_request_stats() -> Token:
+    return _request_stats_ctx_var.set(RequestStats())
+
+
+def reset_request_stats(token: Token):
+    _request_stats_ctx_var.reset(token)
+
+
+def get_request_stats() -> Optional[RequestStats]:
+    return _request_stats_ctx_var.get()
+
+
+def is_slow_command(duration_ms: float) -> bool:
+    threshold = get_settings().slow_command_threshold_ms
+    return bool(threshold) and duration_ms >= threshold
+
+
+def record_redis_command(command_name: str, duration_ms: float):
+    stats = _request_stats_ctx_var.get()
+    if stats:
+        stats.record_redis_command(duration_ms)
+
+    if is_slow_command(duration_ms):
+        logger.warning("Slow redis command. [command=%s, duration_ms=%.2f]", command_name, duration_ms)
+
+
+def record_pusher_call():
+    stats = _request_stats_ctx_var.get()
+    if stats:
+        stats.record_pusher_call()
+
+
+class BackgroundTaskStats:
+    # in-process background task queue. wait times are aggregated between snapshots
+    def __init__(self):
+        self.queue_depth = 0
+        self.running = 0
+        self.dropped = 0
+        self.shed = 0
+        self._wait_count = 0
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+        # task name -> [runs, total ms, max ms]
+        self._runtimes: Dict[str, List[float]] = {}
+
+    def record_queue_depth(self, queue_depth: int):
+        self.queue_depth = queue_depth
+
+    def record_running(self, running: int):
+        self.running = running
+
+    def record_runtime(self, task_name: str, duration_ms: float):
+        runtime = self._runtimes.setdefault(task_name, [0, 0.0, 0.0])
+        runtime[0] += 1
+        runtime[1] += duration_ms
+        runtime[2] = max(runtime[2], duration_ms)
+
+    def get_task_runtimes(self) -> List[Dict[str, Any]]:
+        # busiest first, by total time spent
+        return [
+            {"task": task_name, "runs": int(runs), "total_ms": round(total_ms, 2), "max_ms": round(max_ms, 2)}
+            for task_name, (runs, total_ms, max_ms) in sorted(
+                self._runtimes.items(), key=lambda item: item[1][1], reverse=True
+            )
+        ]
+
+    def record_wait(self, wait_ms: float):
+        self._wait_count += 1
+        self._wait_ms_total += wait_ms
+        self._wait_ms_max = max(self._wait_ms_max, wait_ms)
+
+    def record_dropped(self):
+        self.dropped += 1
+
+    def record_shed(self):
+        self.shed += 1
+
+    def to_log_data(self) -> Dict[str, Any]:
+        wait_ms_avg = self._wait_ms_total / self._wait_count if self._wait_count else 0.0
+        data = {
+            "bg_queue_depth": self.queue_depth,
+            "bg_running": self.running,
+            "bg_wait_ms_avg": "{0:.2f}".format(wait_ms_avg),
+            "bg_wait_ms_max": "{0:.2f}".format(self._wait_ms_max),
+            "bg_dropped": self.dropped,
+            "bg_shed": self.shed,
+        }
+        self._wait_count = 0
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+        return data
+
+
+bg_task_stats = BackgroundTaskStats()
+
+
+def get_filter_shape(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: get_filter_shape(item) for key, item in value.items()}
+    if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+        return [get_filter_shape(item) for item in value]
+    return 1
+
+
+def get_command_filter(command_name: str, command: dict) -> Optional[dict]:
+    if command_name == "find":
+        return command.get("filter")
+    if command_name in ["count", "distinct", "findAndModify"]:
+        return command.get("query")
+    if command_name == "update" and command.get("updates"):
+        return command["updates"][0].get("q")
+    if command_name == "delete" and command.get("deletes"):
+        return command["deletes"][0].get("q")
+    if command_name == "aggregate":
+        for stage in command.get("pipeline", []):
+            if "$match" in stage:
+                return stage["$match"]
+    return None
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    def __init__(self):
+        self._started_commands: Dict[Tuple[Any, int], dict] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self._started_commands[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._record(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._record(event)
+
+    def _record(self, event):
+        command = self._started_commands.pop((event.connection_id, event.request_id), None) or {}
+        duration_ms = event.duration_micros / 1000
+
+        stats = _request_stats_ctx_var.get()
+        if stats:
+            stats.record_db_command(duration_ms)
+
+        if is_slow_command(duration_ms):
+            logger.warning(
+                "Slow mongo command. [command=%s, collection=%s, duration_ms=%.2f, filter=%s]",
+                event.command_name,
+                command.get(event.command_name),
+                duration_ms,
+                get_filter_shape(get_command_filter(event.command_name, command)),
+            )
+
+
+command_stats_listener = CommandStatsListener()
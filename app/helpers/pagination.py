@@ -0,0 +1,107 @@
+import base64
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import bson
+from bson import ObjectId
+from bson.errors import BSONError
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+PREV_CURSOR_HEADER = "X-Prev-Cursor"
+
+
+class PageCursor(NamedTuple):
+    sort_by_field: str
+    sort_by_direction: int
+    value: Any
+    id: ObjectId
+    # reverse cursors page back towards the start of the listing
+    reverse: bool = False
+
+
+def encode_cursor(cursor: PageCursor) -> str:
+    data = bson.encode(
+        {
+            "f": cursor.sort_by_field,
+            "d": cursor.sort_by_direction,
+            "v": cursor.value,
+            "i": cursor.id,
+            "r": cursor.reverse,
+        }
+    )
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> PageCursor:
+    try:
+        data = bson.decode(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        cursor = PageCursor(
+            sort_by_field=data["f"],
+            sort_by_direction=data["d"],
+            value=data["v"],
+            id=data["i"],
+            reverse=data["r"],
+        )
+    except (BSONError, KeyError, TypeError, ValueError):
+        raise ValueError("invalid cursor")
+
+    if (
+        not isinstance(cursor.sort_by_field, str)
+        or cursor.sort_by_field.startswith("$")
+        or cursor.sort_by_direction not in (1, -1)
+        or not isinstance(cursor.id, ObjectId)
+    ):
+        raise ValueError("invalid cursor")
+
+    return cursor
+
+
+def get_cursor_sort(cursor: PageCursor) -> List[Tuple[str, int]]:
+    direction = -cursor.sort_by_direction if cursor.reverse else cursor.sort_by_direction
+    if cursor.sort_by_field == "_id":
+        return [("_id", direction)]
+    return [(cursor.sort_by_field, direction), ("_id", direction)]
+
+
+def get_cursor_filter(cursor: PageCursor) -> dict:
+    direction = -cursor.sort_by_direction if cursor.reverse else cursor.sort_by_direction
+    operator = "$gt" if direction == 1 else "$lt"
+    if cursor.sort_by_field == "_id":
+        return {"_id": {operator: cursor.id}}
+
+    # the inclusive range on the sort field bounds the index scan, the $or only breaks ties on _id
+    return {
+        cursor.sort_by_field: {f"{operator}e": cursor.value},
+        "$or": [{cursor.sort_by_field: {operator: cursor.value}}, {"_id": {operator: cursor.id}}],
+    }
+
+
+def get_page_cursors(
+    items: List[dict],
+    sort_by_field: str,
+    sort_by_direction: int,
+    limit: Optional[int],
+    cursor: Optional[PageCursor] = None,
+    paginated: bool = False,
+) -> Dict[str, str]:
+    if not items:
+        return {}
+
+    full_page = limit is not None and len(items) >= limit
+    if cursor and cursor.reverse:
+        has_next, has_prev = True, full_page
+    else:
+        has_next, has_prev = full_page, paginated or cursor is not None
+
+    cursors = {}
+    if has_next:
+        last_item = items[-1]
+        next_cursor = PageCursor(sort_by_field, sort_by_direction, last_item.get(sort_by_field), last_item["_id"])
+        cursors[NEXT_CURSOR_HEADER] = encode_cursor(next_cursor)
+    if has_prev:
+        first_item = items[0]
+        prev_cursor = PageCursor(
+            sort_by_field, sort_by_direction, first_item.get(sort_by_field), first_item["_id"], reverse=True
+        )
+        cursors[PREV_CURSOR_HEADER] = encode_cursor(prev_cursor)
+
+    return cursors
@@ -12,6 +12,7 @@ async def user_belongs_to_server(user: User, server_id: str):
         filters={"server": ObjectId(server_id), "user": user.id},
         result_obj=ServerMember,
         current_user=user,
+        projection=["_id"],
     )
 
     return server_member is not None
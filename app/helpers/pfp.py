@@ -3,7 +3,11 @@ import re
 from re import Pattern
 from typing import Optional, Tuple
 
+import aiohttp
+
 from app.helpers import cloudflare
+from app.helpers.ready_cache import invalidate_profile_ready_snapshots
+from app.helpers.task_queue import register_bg_task
 from app.services.crud import update_item
 
 logger = logging.getLogger(__name__)
@@ -40,6 +44,7 @@ async def extract_contract_and_token_from_string(pfp_string: str) -> Tuple[Optio
     return await _extract_contract_and_token_from_string(pfp_string, regex_patt)
 
 
+@register_bg_task(max_concurrency=5, max_attempts=3, retry_on=(aiohttp.ClientError,))
 async def upload_pfp_url_and_update_profile(input_str: str, image_url: str, profile, metadata: dict):
     cf_image = await cloudflare.upload_image_url(image_url, metadata=metadata)
     cf_id = cf_image.get("id")
@@ -48,4 +53,5 @@ async def upload_pfp_url_and_update_profile(input_str: str, image_url: str, prof
     if profile_pfp and profile_pfp.get("input", "") == input_str:
         profile_pfp["cf_id"] = cf_id
         await update_item(item=profile, data={"pfp": profile_pfp})
+        await invalidate_profile_ready_snapshots(profile)
         logger.info(f"PFP for profile {profile.pk} uploaded to cloudflare successfully with id: {cf_id}")
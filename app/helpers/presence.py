@@ -0,0 +1,119 @@
+import logging
+from typing import AsyncIterator, Dict, Iterable, List, Set, Tuple, Union
+
+from bson import ObjectId
+
+from app.helpers.cache_utils import cache
+
+logger = logging.getLogger(__name__)
+
+# user -> pusher channels the user is connected on, server -> users with at least one connected pusher channel
+PRESENCE_USER_CHANNELS_KEY = "presence:users:{user_id}"
+PRESENCE_SERVER_USERS_KEY = "presence:servers:{server_id}"
+
+# the checks and writes below run as scripts, so a connect or disconnect landing in between can't leave a connected
+# user out of their servers' sets, or a disconnected one in them
+_REMOVE_USER_CHANNEL_SCRIPT = """
+redis.call("SREM", KEYS[1], ARGV[1])
+local remaining = redis.call("SCARD", KEYS[1])
+if remaining == 0 then
+    for i = 2, #KEYS do
+        redis.call("SREM", KEYS[i], ARGV[2])
+    end
+end
+return remaining
+"""
+_ADD_SERVER_USER_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    redis.call("SADD", KEYS[2], ARGV[1])
+end
+"""
+_REMOVE_OFFLINE_SERVER_USERS_SCRIPT = """
+local removed = 0
+for i = 2, #KEYS do
+    if redis.call("EXISTS", KEYS[i]) == 0 then
+        removed = removed + redis.call("SREM", KEYS[1], ARGV[i - 1])
+    end
+end
+return removed
+"""
+
+
+def _get_user_channels_keys(user_ids: Iterable[Union[str, ObjectId]]) -> List[str]:
+    return [PRESENCE_USER_CHANNELS_KEY.format(user_id=str(user_id)) for user_id in user_ids]
+
+
+def _get_server_users_keys(server_ids: Iterable[Union[str, ObjectId]]) -> List[str]:
+    return [PRESENCE_SERVER_USERS_KEY.format(server_id=str(server_id)) for server_id in server_ids]
+
+
+async def add_user_channel(user_id: Union[str, ObjectId], channel_name: str, server_ids: Iterable[ObjectId]):
+    pipe = cache.client.pipeline(transaction=True)
+    pipe.sadd(PRESENCE_USER_CHANNELS_KEY.format(user_id=str(user_id)), channel_name)
+    for key in _get_server_users_keys(server_ids):
+        pipe.sadd(key, str(user_id))
+    await pipe.execute()
+
+
+async def remove_user_channel(user_id: Union[str, ObjectId], channel_name: str, server_ids: Iterable[ObjectId]) -> bool:
+    keys = [PRESENCE_USER_CHANNELS_KEY.format(user_id=str(user_id)), *_get_server_users_keys(server_ids)]
+    remaining_channels = await cache.client.register_script(_REMOVE_USER_CHANNEL_SCRIPT)(
+        keys=keys, args=[channel_name, str(user_id)]
+    )
+    return bool(remaining_channels)
+
+
+async def add_server_user(server_id: Union[str, ObjectId], user_id: Union[str, ObjectId]):
+    # only tracked while the user is connected, the next connect registers every server they belong to
+    keys = [
+        PRESENCE_USER_CHANNELS_KEY.format(user_id=str(user_id)),
+        PRESENCE_SERVER_USERS_KEY.format(server_id=str(server_id)),
+    ]
+    await cache.client.register_script(_ADD_SERVER_USER_SCRIPT)(keys=keys, args=[str(user_id)])
+
+
+async def iter_presence_user_channels() -> AsyncIterator[Tuple[str, Set[str]]]:
+    async for key in cache.client.scan_iter(match=PRESENCE_USER_CHANNELS_KEY.format(user_id="*")):
+        yield key.split(":")[-1], set(await cache.client.smembers(key))
+
+
+async def remove_offline_server_users() -> int:
+    # drops server presence left behind by users whose channels are all gone
+    removed = 0
+    async for key in cache.client.scan_iter(match=PRESENCE_SERVER_USERS_KEY.format(server_id="*")):
+        user_ids = list(await cache.client.smembers(key))
+        if user_ids:
+            removed += await cache.client.register_script(_REMOVE_OFFLINE_SERVER_USERS_SCRIPT)(
+                keys=[key, *_get_user_channels_keys(user_ids)], args=user_ids
+            )
+    return removed
+
+
+async def get_servers_online_user_ids(server_ids: Iterable[Union[str, ObjectId]]) -> Set[ObjectId]:
+    keys = _get_server_users_keys(server_ids)
+    if not keys:
+        return set()
+    return {ObjectId(user_id) for user_id in await cache.client.sunion(keys)}
+
+
+async def get_users_online_channels(user_ids: Iterable[Union[str, ObjectId]]) -> Set[str]:
+    keys = _get_user_channels_keys(user_ids)
+    if not keys:
+        return set()
+    return {str(channel_name) for channel_name in await cache.client.sunion(keys)}
+
+
+async def get_online_channels_by_user(user_ids: Iterable[Union[str, ObjectId]]) -> Dict[str, Set[str]]:
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not user_ids:
+        return {}
+
+    pipe = cache.client.pipeline(transaction=False)
+    for key in _get_user_channels_keys(user_ids):
+        pipe.smembers(key)
+    results = await pipe.execute()
+    return {user_id: set(channels) for user_id, channels in zip(user_ids, results)}
+
+
+async def get_servers_online_user_channels(server_ids: Iterable[Union[str, ObjectId]]) -> Set[str]:
+    return await get_users_online_channels(await get_servers_online_user_ids(server_ids))
@@ -1,19 +1,122 @@
 import asyncio
 import itertools
 import logging
+import random
+import time
 from asyncio import CancelledError, Task
-from typing import Any, Callable, Dict, List, Tuple
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Set, Tuple
 
 from sentry_sdk import capture_exception
 
+from app.config import get_settings
+from app.helpers.loaders import init_reference_loader
+from app.helpers.metrics import bg_task_stats
+from app.helpers.task_queue import PartialTaskError, encode_tasks, enqueue_tasks, get_task_name, get_task_options
+from app.models.task import DeadLetterTask
+
 logger = logging.getLogger(__name__)
 
-_bg_task_name_counter = itertools.count(1).__next__
+_bg_task_name_counter = itertools.count(1)
 MAX_SHUTDOWN_WAIT_SECONDS = 5
 
+# every running background task, removed by a done callback, so accounting never scans the loop's tasks
+_running_bg_tasks: Set[Task] = set()
+
+
+def _get_bg_task_name() -> str:
+    return f"BackgroundTask-{next(_bg_task_name_counter)}"
+
+
+def _on_bg_task_done(task: Task):
+    _running_bg_tasks.discard(task)
+    bg_task_stats.record_running(len(_running_bg_tasks))
+
+
+def _create_bg_task(coro: Coroutine) -> Task:
+    task = asyncio.create_task(coro, name=_get_bg_task_name())
+    _running_bg_tasks.add(task)
+    bg_task_stats.record_running(len(_running_bg_tasks))
+    task.add_done_callback(_on_bg_task_done)
+    return task
+
+
+def get_running_bg_tasks_count() -> int:
+    return len(_running_bg_tasks)
+
 
-async def _get_bg_task_name():
-    return f"BackgroundTask-{_bg_task_name_counter}"
+_task_semaphores: Dict[str, asyncio.Semaphore] = {}
+_task_semaphores_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_task_semaphore(method: Callable, limit: int) -> asyncio.Semaphore:
+    global _task_semaphores_loop
+    loop = asyncio.get_running_loop()
+    if _task_semaphores_loop is not loop:
+        _task_semaphores.clear()
+        _task_semaphores_loop = loop
+    return _task_semaphores.setdefault(get_task_name(method), asyncio.Semaphore(limit))
+
+
+async def _run_timed(method: Callable, args: Tuple[Any, ...], kwargs: Dict[Any, Any]):
+    start_time = time.perf_counter()
+    try:
+        return await method(*args, **kwargs)
+    finally:
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        task_name = get_task_name(method)
+        bg_task_stats.record_runtime(task_name, duration_ms)
+        if duration_ms >= get_settings().slow_bg_task_threshold_ms:
+            logger.warning("Slow background task. [task=%s, duration_ms=%.2f]", task_name, duration_ms)
+
+
+async def _run_limited(method: Callable, args: Tuple[Any, ...], kwargs: Dict[Any, Any]):
+    limit = get_task_options(method).max_concurrency
+    if not limit:
+        return await _run_timed(method, args, kwargs)
+
+    async with _get_task_semaphore(method, limit):
+        return await _run_timed(method, args, kwargs)
+
+
+async def _dead_letter_task(
+    method: Callable, args: Tuple[Any, ...], kwargs: Dict[Any, Any], error: Exception, attempts: int
+):
+    fs = error.remaining if isinstance(error, PartialTaskError) else [(method, args, kwargs)]
+    if not fs:
+        return
+
+    task_name = get_task_name(fs[0][0])
+    try:
+        payload = encode_tasks(fs).decode()
+    except (TypeError, ValueError):
+        logger.warning("Failed task can't be stored for replay. [task=%s]", task_name)
+        return
+
+    try:
+        await DeadLetterTask(task=task_name, payload=payload, error=repr(error), attempts=attempts).commit()
+    except Exception:
+        logger.exception("Problem storing failed task. [task=%s]", task_name)
+
+
+async def _run_with_retries(method: Callable, args: Tuple[Any, ...], kwargs: Dict[Any, Any]):
+    options = get_task_options(method)
+    attempt = 1
+    while True:
+        try:
+            return await _run_limited(method, args, kwargs)
+        except Exception as e:
+            if attempt >= options.max_attempts or not isinstance(e, options.retry_on):
+                if options.dead_letter and isinstance(e, (PartialTaskError, options.retry_on)):
+                    await _dead_letter_task(method, args, kwargs, error=e, attempts=attempt)
+                raise
+
+            delay = options.retry_backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.warning(
+                "Retrying background task. [task=%s, attempt=%d, delay_s=%.2f]", get_task_name(method), attempt, delay
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
 
 
 async def _build_coro_from_function_tuple(f: Tuple[Any, ...]):
@@ -22,42 +125,54 @@ async def _build_coro_from_function_tuple(f: Tuple[Any, ...]):
         method, args = f
     else:
         method, args, kwargs = f
-    return method(*args, **kwargs)
-
+    return _run_with_retries(method, args, kwargs)
 
-async def _get_running_bg_tasks():
-    return [task for task in asyncio.all_tasks() if task.get_name().startswith("BackgroundTask")]
 
+_bg_task_stats_reporter: Optional[Task] = None
 
-async def stop_background_tasks():
-    if not await _get_running_bg_tasks():
-        return
 
-    wait_time = 0
+async def _report_bg_task_stats(interval: float):
     while True:
-        running_bg_tasks = await _get_running_bg_tasks()
-        if not running_bg_tasks:
-            break
+        await asyncio.sleep(interval)
+        log_line_data = bg_task_stats.to_log_data()
+        logger.info("bg-task-stats %s", " ".join([f"{key}={value}" for key, value in sorted(log_line_data.items())]))
 
-        await asyncio.sleep(0.1)
-        wait_time += 0.1
 
-        if wait_time > MAX_SHUTDOWN_WAIT_SECONDS:
-            break
+async def _stop_bg_task_stats_reporter():
+    global _bg_task_stats_reporter
+    if _bg_task_stats_reporter and _bg_task_stats_reporter.get_loop() is asyncio.get_running_loop():
+        _bg_task_stats_reporter.cancel()
+        await asyncio.gather(_bg_task_stats_reporter, return_exceptions=True)
+    _bg_task_stats_reporter = None
 
-    running_bg_tasks = await _get_running_bg_tasks()
-    if not running_bg_tasks:
-        return
 
-    [task.cancel() for task in running_bg_tasks]
-    logger.info(f"Cancelling {len(running_bg_tasks)} outstanding tasks")
-    try:
-        await asyncio.gather(*running_bg_tasks)
-    except CancelledError:
-        pass
-    except Exception as e:
-        logger.error(f"problem waiting for tasks to cancel: {e}")
-        raise e
+async def start_bg_task_stats_reporter():
+    # process wide, so they're logged on their own interval instead of on whichever request's canonical line is next
+    global _bg_task_stats_reporter
+    await _stop_bg_task_stats_reporter()
+    interval = get_settings().bg_task_stats_log_interval_seconds
+    if interval > 0:
+        _bg_task_stats_reporter = asyncio.create_task(_report_bg_task_stats(interval), name="BackgroundTaskStats")
+
+
+async def stop_background_tasks():
+    loop = asyncio.get_running_loop()
+    await _stop_bg_task_stats_reporter()
+    deadline = loop.time() + MAX_SHUTDOWN_WAIT_SECONDS
+    await bg_task_executor.drain(timeout=MAX_SHUTDOWN_WAIT_SECONDS)
+
+    running_bg_tasks = {task for task in _running_bg_tasks if task.get_loop() is loop}
+    if running_bg_tasks:
+        _, pending = await asyncio.wait(running_bg_tasks, timeout=max(deadline - loop.time(), 0))
+        if pending:
+            logger.info("Cancelling outstanding tasks. [count=%d]", len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    runtimes = bg_task_stats.get_task_runtimes()[:10]
+    if runtimes:
+        logger.info("Background task runtimes. [runtimes=%s]", runtimes)
 
 
 async def handle_results(results, tasks: List[Task]):
@@ -71,16 +186,19 @@ async def handle_results(results, tasks: List[Task]):
 
 
 async def dispatch_concurrent_fs(fs: List[tuple[Callable, tuple[Any, ...], dict]]):
+    # each dispatch runs in its own task, so this doesn't leak into the request's reference loader
+    init_reference_loader()
     coros = [await _build_coro_from_function_tuple(f) for f in fs]
-    tasks = [asyncio.create_task(coro, name=await _get_bg_task_name()) for coro in coros]
+    tasks = [_create_bg_task(coro) for coro in coros]
     results = await asyncio.gather(*tasks, return_exceptions=True)
     await handle_results(results, tasks)
 
 
 async def dispatch_serial_fs(fs: List[tuple[Callable, tuple[Any, ...], dict]]):
+    init_reference_loader()
     for f in fs:
         coro = await _build_coro_from_function_tuple(f)
-        task = asyncio.create_task(coro, name=await _get_bg_task_name())
+        task = _create_bg_task(coro)
         try:
             await task
         except CancelledError:
@@ -92,12 +210,149 @@ async def dispatch_serial_fs(fs: List[tuple[Callable, tuple[Any, ...], dict]]):
             break
 
 
+def _use_task_stream() -> bool:
+    # "redis" hands tasks to `python -m app.worker`, "local" runs them on the web worker's loop
+    return get_settings().bg_tasks_backend == "redis"
+
+
+# set in executor workers, so tasks queueing more tasks never wait on a queue only they can empty
+_in_bg_task_ctx_var: ContextVar[bool] = ContextVar("in_bg_task", default=False)
+
+
+# batches of tasks with a `max_concurrency` of their own go to a lane with that many workers, so tasks waiting on
+# their type's limit never hold one of the shared workers
+_SHARED_LANE = ""
+
+
+def _get_task_lane(method: Callable) -> str:
+    return get_task_name(method) if get_task_options(method).max_concurrency else _SHARED_LANE
+
+
+class BackgroundTaskExecutor:
+    def __init__(self):
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: List[Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_queue(self, lane: str, worker_count: int) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._queues = {}
+            self._workers = []
+            self._loop = loop
+
+        if lane not in self._queues:
+            queue: asyncio.Queue = asyncio.Queue(maxsize=get_settings().bg_tasks_max_queue_size)
+            self._workers.extend(
+                [
+                    asyncio.create_task(self._work(queue), name=f"TaskExecutorWorker-{lane or 'shared'}-{index}")
+                    for index in range(worker_count)
+                ]
+            )
+            self._queues[lane] = queue
+        return self._queues[lane]
+
+    async def _work(self, queue: asyncio.Queue):
+        _in_bg_task_ctx_var.set(True)
+        while True:
+            fs, concurrent, queued_at = await queue.get()
+            bg_task_stats.record_wait((time.perf_counter() - queued_at) * 1000)
+            bg_task_stats.record_queue_depth(queue.qsize())
+            try:
+                if concurrent:
+                    await dispatch_concurrent_fs(fs)
+                else:
+                    await dispatch_serial_fs(fs)
+            except Exception as e:
+                logger.exception("Problem running background tasks.")
+                capture_exception(e)
+            finally:
+                queue.task_done()
+
+    async def submit(self, fs: List[tuple[Callable, tuple[Any, ...], dict]], concurrent: bool = True):
+        if not concurrent:
+            # serial batches stay together, in the lane of their first limited task
+            lane = next((lane for lane in map(_get_task_lane, [f[0] for f in fs]) if lane), _SHARED_LANE)
+            await self._submit_to_lane(lane, fs, concurrent=False)
+            return
+
+        lanes: Dict[str, List[tuple[Callable, tuple[Any, ...], dict]]] = {}
+        for f in fs:
+            lanes.setdefault(_get_task_lane(f[0]), []).append(f)
+        for lane, lane_fs in lanes.items():
+            await self._submit_to_lane(lane, lane_fs, concurrent=True)
+
+    async def _submit_to_lane(self, lane: str, fs: List[tuple[Callable, tuple[Any, ...], dict]], concurrent: bool):
+        settings = get_settings()
+        worker_count = settings.bg_tasks_max_concurrency
+        if lane:
+            worker_count = next(get_task_options(f[0]).max_concurrency for f in fs if get_task_name(f[0]) == lane)
+        queue = self._get_queue(lane, worker_count)
+        task_names = [get_task_name(f[0]) for f in fs]
+
+        if queue.qsize() >= settings.bg_tasks_shed_queue_size and all(get_task_options(f[0]).sheddable for f in fs):
+            bg_task_stats.record_shed()
+            logger.debug("Shedding background task. [tasks=%s, queue_depth=%d]", task_names, queue.qsize())
+            return
+
+        item = (fs, concurrent, time.perf_counter())
+        if queue.full():
+            if settings.bg_tasks_overflow_policy == "block" and not _in_bg_task_ctx_var.get():
+                # backpressure: the request queueing the task waits for room
+                await queue.put(item)
+                bg_task_stats.record_queue_depth(queue.qsize())
+                return
+
+            dropped_fs, _, _ = queue.get_nowait()
+            queue.task_done()
+            bg_task_stats.record_dropped()
+            logger.warning(
+                "Background task queue full, dropping oldest tasks. [tasks=%s]",
+                [get_task_name(f[0]) for f in dropped_fs],
+            )
+
+        queue.put_nowait(item)
+        bg_task_stats.record_queue_depth(queue.qsize())
+
+    async def drain(self, timeout: float):
+        if not self._queues or self._loop is not asyncio.get_running_loop():
+            return
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*[queue.join() for queue in self._queues.values()]), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Background task queue not drained in time. [queue_depth=%d]",
+                sum(queue.qsize() for queue in self._queues.values()),
+            )
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queues = {}
+        self._workers = []
+
+
+bg_task_executor = BackgroundTaskExecutor()
+
+
 async def queue_bg_task(f: Callable, *args: Any, **kwargs: Any):
-    asyncio.create_task(dispatch_concurrent_fs([(f, args, kwargs)]))
+    if _use_task_stream() and await enqueue_tasks([(f, args, kwargs)]):
+        return
+    await bg_task_executor.submit([(f, args, kwargs)])
 
 
 async def queue_bg_tasks(fs: List[tuple[Callable, tuple[Any, ...], dict]], concurrent=True):
-    if not concurrent:
-        asyncio.create_task(dispatch_serial_fs(fs))
-    else:
-        asyncio.create_task(dispatch_concurrent_fs(fs))
+    if _use_task_stream() and await enqueue_tasks(fs, concurrent=concurrent):
+        return
+    await bg_task_executor.submit(fs, concurrent=concurrent)
+
+
+async def _queue_bg_task_later(delay: float, f: Callable, args: Tuple[Any, ...], kwargs: Dict[Any, Any]):
+    await asyncio.sleep(delay)
+    await queue_bg_task(f, *args, **kwargs)
+
+
+def schedule_bg_task(delay: float, f: Callable, *args: Any, **kwargs: Any):
+    # queued once the delay is over, nothing holds an executor worker while it waits
+    _create_bg_task(_queue_bg_task_later(delay, f, args, kwargs))
@@ -0,0 +1,113 @@
+import logging
+from typing import Iterable, List, Optional, Union
+
+from bson import ObjectId
+from redis.exceptions import RedisError
+
+from app.config import get_settings
+from app.helpers.cache_utils import cache
+from app.models.channel import Channel
+from app.models.server import ServerMember
+from app.models.user import User
+from app.services.crud import get_items
+
+logger = logging.getLogger(__name__)
+
+# snapshots are never deleted on writes. every write bumps the version of the servers/users it touches instead, and a
+# snapshot is only served while the versions it was built with are still current.
+READY_SNAPSHOT_KEY = "ready:{user_id}"
+READY_SERVER_VERSION_KEY = "ready_versions:servers:{server_id}"
+READY_USER_VERSION_KEY = "ready_versions:users:{user_id}"
+
+
+def _get_version_keys(user_id: str, server_ids: Iterable[str]) -> List[str]:
+    user_key = READY_USER_VERSION_KEY.format(user_id=user_id)
+    return [user_key] + [READY_SERVER_VERSION_KEY.format(server_id=server_id) for server_id in server_ids]
+
+
+async def get_ready_versions(user_id: str, server_ids: List[str]) -> Optional[List[str]]:
+    if not get_settings().ready_cache_enabled:
+        return None
+
+    try:
+        versions = await cache.client.mget(_get_version_keys(user_id, server_ids))
+    except RedisError:
+        logger.exception("Problem reading /ready versions. [user_id=%s]", user_id)
+        return None
+
+    return [version or "" for version in versions]
+
+
+async def get_ready_snapshot(user_id: str) -> Optional[str]:
+    if not get_settings().ready_cache_enabled:
+        return None
+
+    try:
+        snapshot = await cache.client.hgetall(READY_SNAPSHOT_KEY.format(user_id=user_id))
+        if not snapshot:
+            return None
+
+        server_ids = snapshot["servers"].split(",") if snapshot["servers"] else []
+        versions = await get_ready_versions(user_id, server_ids)
+    except (RedisError, KeyError):
+        logger.exception("Problem reading /ready snapshot. [user_id=%s]", user_id)
+        return None
+
+    if versions is None or ",".join(versions) != snapshot["versions"]:
+        return None
+
+    return snapshot["payload"]
+
+
+async def set_ready_snapshot(user_id: str, payload: bytes, server_ids: List[str], versions: List[str]):
+    key = READY_SNAPSHOT_KEY.format(user_id=user_id)
+    mapping = {"payload": payload, "servers": ",".join(server_ids), "versions": ",".join(versions)}
+    try:
+        pipe = cache.client.pipeline(transaction=True)
+        pipe.delete(key).hset(key, mapping=mapping).expire(key, get_settings().ready_cache_ttl_seconds)
+        await pipe.execute()
+    except RedisError:
+        logger.exception("Problem storing /ready snapshot. [user_id=%s]", user_id)
+
+
+async def invalidate_ready_snapshots(
+    server_ids: Optional[Iterable[Union[str, ObjectId]]] = None,
+    user_ids: Optional[Iterable[Union[str, ObjectId]]] = None,
+):
+    keys = [READY_SERVER_VERSION_KEY.format(server_id=str(server_id)) for server_id in server_ids or []]
+    keys.extend([READY_USER_VERSION_KEY.format(user_id=str(user_id)) for user_id in user_ids or []])
+    if not keys:
+        return
+
+    try:
+        pipe = cache.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(key)
+        await pipe.execute()
+    except RedisError:
+        logger.exception("Problem invalidating /ready snapshots. [keys=%s]", keys)
+
+
+async def invalidate_channel_ready_snapshots(channel: Channel):
+    if channel.kind == "server":
+        await invalidate_ready_snapshots(server_ids=[channel.server.pk])
+    elif channel.kind == "dm":
+        await invalidate_ready_snapshots(user_ids=[member.pk for member in channel.members])
+
+
+async def invalidate_profile_ready_snapshots(profile: Union[User, ServerMember]):
+    if isinstance(profile, ServerMember):
+        await invalidate_ready_snapshots(server_ids=[profile.server.pk])
+        return
+
+    memberships = await get_items(
+        {"user": profile.pk}, result_obj=ServerMember, current_user=profile, limit=None, projection=["server"]
+    )
+    dm_channels = await get_items(
+        {"members": profile.pk}, result_obj=Channel, current_user=profile, limit=None, projection=["members"]
+    )
+    user_ids = {profile.pk}
+    for channel in dm_channels:
+        user_ids.update([member.pk for member in channel.members])
+
+    await invalidate_ready_snapshots(server_ids=[member.server.pk for member in memberships], user_ids=user_ids)
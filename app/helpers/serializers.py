@@ -0,0 +1,89 @@
+import datetime as dt
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Tuple, Type
+
+import marshmallow as ma
+from bson import ObjectId
+from pydantic import BaseModel
+from umongo import fields
+
+# (output field name, mongo key, umongo missing value, dump function)
+FieldSerializer = Tuple[str, Optional[str], Any, Callable[[Any], Any]]
+
+
+def _dump_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(key): _dump_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_dump_value(item) for item in value]
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def _dump_object_id(value: Any) -> Any:
+    if value is None:
+        return None
+    return str(value)
+
+
+def _dump_aware_datetime(value: Any) -> Any:
+    if value is None:
+        return None
+    return value.replace(tzinfo=dt.timezone.utc).isoformat()
+
+
+def _get_field_dumper(field: Optional[ma.fields.Field], schema_type: Any) -> Callable[[Any], Any]:
+    if isinstance(field, (fields.ObjectIdField, fields.ReferenceField)):
+        return _dump_object_id
+    if isinstance(field, fields.AwareDateTimeField):
+        return _dump_aware_datetime
+    if isinstance(field, fields.EmbeddedField) and isinstance(schema_type, type) and issubclass(schema_type, BaseModel):
+        field_serializers = _get_field_serializers(schema_type, field.embedded_document_cls)
+        return lambda value: None if value is None else _serialize(value, field_serializers)
+    if isinstance(field, fields.ListField):
+        inner_dumper = _get_field_dumper(field.inner, schema_type)
+        return lambda value: None if value is None else [inner_dumper(item) for item in value]
+    return _dump_value
+
+
+@lru_cache(maxsize=None)
+def _get_field_serializers(schema: Type[BaseModel], document_cls) -> List[FieldSerializer]:
+    field_serializers: List[FieldSerializer] = []
+    document_fields = document_cls.schema.fields
+    for name, schema_field in schema.__fields__.items():
+        field = document_fields.get(name)
+        if field is None:
+            field_serializers.append((schema_field.alias, None, schema_field.default, _dump_value))
+            continue
+
+        mongo_key = field.attribute or name
+        missing = None if field.missing is ma.missing else field.missing
+        dumper = _get_field_dumper(field, schema_field.type_)
+        field_serializers.append((schema_field.alias, mongo_key, missing, dumper))
+
+    return field_serializers
+
+
+def _serialize(raw: dict, field_serializers: List[FieldSerializer]) -> dict:
+    serialized = {}
+    for name, mongo_key, missing, dumper in field_serializers:
+        if mongo_key is not None and mongo_key in raw:
+            value = raw[mongo_key]
+        else:
+            value = missing() if callable(missing) else missing
+        serialized[name] = dumper(value)
+    return serialized
+
+
+def get_schema_projection(schema: Type[BaseModel], document_cls) -> List[str]:
+    return [mongo_key for _, mongo_key, _, _ in _get_field_serializers(schema, document_cls) if mongo_key]
+
+
+def serialize_raw_documents(raw_documents: List[dict], schema: Type[BaseModel], document_cls) -> List[dict]:
+    # produces the same output as validating the loaded umongo documents with `schema` (orm_mode) and running them
+    # through fastapi's jsonable_encoder, without building either of them.
+    field_serializers = _get_field_serializers(schema, document_cls)
+    return [_serialize(raw, field_serializers) for raw in raw_documents]
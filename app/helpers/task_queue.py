@@ -0,0 +1,203 @@
+import importlib
+import logging
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+
+import orjson
+from bson import ObjectId
+from redis.exceptions import RedisError, ResponseError
+from umongo import Reference
+from umongo.frameworks.motor_asyncio import MotorAsyncIODocument
+
+from app.helpers.cache_utils import cache
+from app.helpers.db_utils import instance
+
+logger = logging.getLogger(__name__)
+
+TASK_STREAM_KEY = "bg_tasks"
+TASK_CONSUMER_GROUP = "bg_task_workers"
+TASK_STREAM_MAX_LENGTH = 100_000
+
+
+class BackgroundTaskOptions(NamedTuple):
+    # how many run at once in a process, None for no limit of its own
+    max_concurrency: Optional[int] = None
+    # low value tasks that get dropped first when the in-process queue backs up
+    sheddable: bool = False
+    # attempts before the task gives up. only `retry_on` errors are retried, and only those (or a PartialTaskError)
+    # go to the dead letter collection, other errors would fail the same way on a replay
+    max_attempts: int = 1
+    retry_on: Tuple[Type[Exception], ...] = ()
+    retry_backoff_seconds: float = 0.5
+    dead_letter: bool = True
+
+
+class PartialTaskError(Exception):
+    # raised by a task that only partly went through. `remaining` is what goes to the dead letter collection instead
+    # of the whole task, so a replay doesn't redo the parts that already succeeded
+    def __init__(self, message: str, remaining: List[Tuple[Callable, Tuple[Any, ...], dict]]):
+        super().__init__(message)
+        self.remaining = remaining
+
+
+# only functions registered here can be run from the stream, the worker doesn't import arbitrary callables
+_registered_tasks: Dict[str, Callable] = {}
+_task_options: Dict[str, BackgroundTaskOptions] = {}
+
+
+def _get_import_path(obj: Any) -> str:
+    return f"{obj.__module__}:{obj.__qualname__}"
+
+
+def get_task_name(f: Callable) -> str:
+    return _get_import_path(f)
+
+
+def register_bg_task(f: Optional[Callable] = None, **options: Any):
+    def decorator(func: Callable) -> Callable:
+        task_name = get_task_name(func)
+        _registered_tasks[task_name] = func
+        _task_options[task_name] = BackgroundTaskOptions(**options)
+        return func
+
+    return decorator(f) if f else decorator
+
+
+def get_task_options(f: Callable) -> BackgroundTaskOptions:
+    return _task_options.get(get_task_name(f), BackgroundTaskOptions())
+
+
+def get_registered_task(task_name: str) -> Callable:
+    module_name = task_name.split(":")[0]
+    importlib.import_module(module_name)
+    try:
+        return _registered_tasks[task_name]
+    except KeyError:
+        raise ValueError(f"unregistered task: {task_name}")
+
+
+def _encode_value(value: Any) -> Any:
+    # documents are sent by id and loaded again by the worker, the helpers they're passed to accept either form
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    elif isinstance(value, MotorAsyncIODocument):
+        return {"__type__": "document", "name": type(value).__name__, "id": str(value.pk)}
+    elif isinstance(value, Reference):
+        return {"__type__": "objectid", "value": str(value.pk)}
+    elif isinstance(value, ObjectId):
+        return {"__type__": "objectid", "value": str(value)}
+    elif isinstance(value, datetime):
+        return {"__type__": "datetime", "value": value.isoformat()}
+    elif isinstance(value, Enum):
+        return {"__type__": "enum", "name": _get_import_path(type(value)), "value": value.value}
+    elif isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError("only string keys are supported")
+        return {key: _encode_value(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_encode_value(item) for item in value]
+
+    raise TypeError(f"unsupported task argument type: {type(value)}")
+
+
+async def _decode_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [await _decode_value(item) for item in value]
+    elif not isinstance(value, dict):
+        return value
+
+    value_type = value.get("__type__")
+    if value_type == "document":
+        document_cls = instance.retrieve_document(value["name"])
+        document = await document_cls.find_one({"_id": ObjectId(value["id"])})
+        if not document:
+            raise ValueError(f"missing task document. [name={value['name']}, id={value['id']}]")
+        return document
+    elif value_type == "objectid":
+        return ObjectId(value["value"])
+    elif value_type == "datetime":
+        return datetime.fromisoformat(value["value"])
+    elif value_type == "enum":
+        module_name, class_name = value["name"].split(":")
+        enum_cls = getattr(importlib.import_module(module_name), class_name)
+        if not issubclass(enum_cls, Enum):
+            raise ValueError(f"not an enum: {value['name']}")
+        return enum_cls(value["value"])
+
+    return {key: await _decode_value(item) for key, item in value.items()}
+
+
+def encode_tasks(fs: List[Tuple[Callable, Tuple[Any, ...], dict]]) -> bytes:
+    tasks = []
+    for f in fs:
+        method, args = f[0], f[1]
+        kwargs = f[2] if len(f) == 3 else {}
+        task_name = get_task_name(method)
+        if task_name not in _registered_tasks:
+            raise ValueError(f"unregistered task: {task_name}")
+        tasks.append([task_name, _encode_value(args), _encode_value(kwargs)])
+    return orjson.dumps(tasks)
+
+
+async def decode_tasks(data: str) -> List[Tuple[Callable, Tuple[Any, ...], dict]]:
+    tasks = []
+    for task_name, args, kwargs in orjson.loads(data):
+        tasks.append((get_registered_task(task_name), tuple(await _decode_value(args)), await _decode_value(kwargs)))
+    return tasks
+
+
+async def enqueue_tasks(fs: List[Tuple[Callable, Tuple[Any, ...], dict]], concurrent: bool = True) -> bool:
+    try:
+        data = encode_tasks(fs)
+    except (TypeError, ValueError):
+        logger.warning("Task can't be queued, running it in process. [tasks=%s]", [get_task_name(f[0]) for f in fs])
+        return False
+
+    try:
+        await cache.client.xadd(
+            TASK_STREAM_KEY,
+            {"tasks": data, "concurrent": int(concurrent)},
+            maxlen=TASK_STREAM_MAX_LENGTH,
+            approximate=True,
+        )
+    except RedisError:
+        logger.exception("Problem queueing task, running it in process.")
+        return False
+
+    return True
+
+
+async def create_consumer_group():
+    try:
+        await cache.client.xgroup_create(TASK_STREAM_KEY, TASK_CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def read_tasks(consumer_name: str, count: int, block_ms: int) -> List[Tuple[str, dict]]:
+    response = await cache.client.xreadgroup(
+        TASK_CONSUMER_GROUP, consumer_name, {TASK_STREAM_KEY: ">"}, count=count, block=block_ms
+    )
+    if not response:
+        return []
+    _, entries = response[0]
+    return entries
+
+
+async def claim_stale_tasks(consumer_name: str, min_idle_ms: int, count: int) -> List[Tuple[str, dict]]:
+    # entries of workers that died before acking them. XAUTOCLAIM would do this in one call, but needs redis 6.2
+    pending = await cache.client.xpending_range(TASK_STREAM_KEY, TASK_CONSUMER_GROUP, min="-", max="+", count=count)
+    stale_ids = [entry["message_id"] for entry in pending if entry["time_since_delivered"] >= min_idle_ms]
+    if not stale_ids:
+        return []
+    entries = await cache.client.xclaim(TASK_STREAM_KEY, TASK_CONSUMER_GROUP, consumer_name, min_idle_ms, stale_ids)
+    return [(entry_id, fields) for entry_id, fields in entries if fields]
+
+
+async def ack_task(entry_id: str):
+    pipe = cache.client.pipeline(transaction=False)
+    pipe.xack(TASK_STREAM_KEY, TASK_CONSUMER_GROUP, entry_id)
+    pipe.xdel(TASK_STREAM_KEY, entry_id)
+    await pipe.execute()
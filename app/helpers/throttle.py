@@ -0,0 +1,25 @@
+import logging
+
+from redis.exceptions import RedisError
+
+from app.helpers.cache_utils import cache
+
+logger = logging.getLogger(__name__)
+
+TYPING_THROTTLE_KEY = "throttle:typing:{user_id}:{channel_id}"
+PRESENCE_THROTTLE_KEY = "throttle:presence:{user_id}"
+PRESENCE_PENDING_STATUS_KEY = "throttle:presence:{user_id}:pending"
+PRESENCE_SENT_STATUS_KEY = "throttle:presence:{user_id}:sent"
+PRESENCE_SENT_STATUS_TTL_SECONDS = 60 * 60 * 24
+
+
+async def acquire_throttle(key: str, window_ms: int) -> bool:
+    # the first caller in a window gets the key, everyone else is throttled until it expires
+    if window_ms <= 0:
+        return True
+
+    try:
+        return bool(await cache.client.set(key, 1, nx=True, px=window_ms))
+    except RedisError:
+        logger.exception("Problem acquiring throttle, letting the event through. [key=%s]", key)
+        return True
@@ -1,11 +1,89 @@
+import asyncio
 import os
+from typing import Dict, List, Optional
 
+import aiohttp
+import orjson
 import pusher
 from dotenv import load_dotenv
-from pusher.aiohttp import AsyncIOBackend
+from fastapi.encoders import jsonable_encoder
+from pusher.errors import PusherBadStatus
+from pusher.http import process_response
+
+from app.config import get_settings
+from app.helpers.cache_utils import cache
+from app.helpers.gateway import GATEWAY_USER_TOPIC
 
 load_dotenv()
 
+
+class PusherSessionPool:
+    # pusher's AsyncIOBackend opens (and tears down) a new session per request. this keeps a single keep-alive
+    # session per event loop instead.
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(limit=get_settings().pusher_max_concurrent_requests)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._loop = loop
+        return self._session
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        # shared by every broadcast on the loop, so pusher_max_concurrent_requests is a limit for the whole process
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(get_settings().pusher_max_concurrent_requests)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+
+class PusherServerError(PusherBadStatus):
+    # 5xx and 429 responses, the only statuses the same request can succeed on later. pusher raises a plain
+    # PusherBadStatus for these and for the 4xx ones it doesn't have its own error for (404, 413, ...)
+    def __init__(self, status: int, body: str):
+        super().__init__("%s: %s" % (status, body))
+        self.status = status
+
+
+class PooledAsyncIOBackend:
+    def __init__(self, client, session_pool: PusherSessionPool):
+        self.client = client
+        self.session_pool = session_pool
+
+    async def send_request(self, request):
+        response = None
+        try:
+            response = await self.session_pool.get_session().request(
+                request.method,
+                "%s%s" % (request.base_url, request.path),
+                params=request.query_params,
+                data=request.body,
+                headers=request.headers,
+                timeout=aiohttp.ClientTimeout(total=self.client.timeout),
+            )
+            body = await response.text("utf-8")
+            if response.status >= 500 or response.status == 429:
+                raise PusherServerError(response.status, body)
+            return process_response(response.status, body)
+        finally:
+            if response is not None:
+                response.release()
+
+
+pusher_session_pool = PusherSessionPool()
+
 # TODO: this kind of breaks away from FastAPI's default way of initializing 3rd party clients using dependencies,
 #  but I couldn't find a straightforward way to initialize this once, and not per request. The startup events felt
 #  more hacky than anything else, but might be worth another look.
@@ -14,6 +92,62 @@ pusher_client = pusher.Pusher(
     key=os.getenv("PUSHER_KEY"),
     secret=os.getenv("PUSHER_SECRET"),
     cluster=os.getenv("PUSHER_CLUSTER", "eu"),
-    backend=AsyncIOBackend,
+    backend=PooledAsyncIOBackend,
+    session_pool=pusher_session_pool,
     ssl=True,
 )
+
+
+async def close_pusher_connection():
+    await pusher_session_pool.close()
+
+
+class BroadcastTransport:
+    async def trigger(self, channels: List[str], event_name: str, data: dict):
+        raise NotImplementedError
+
+    async def trigger_batch(self, events: List[dict]):
+        # each event is a {"channel", "name", "data"} dict, so every recipient can get its own payload
+        raise NotImplementedError
+
+
+class PusherTransport(BroadcastTransport):
+    async def trigger(self, channels: List[str], event_name: str, data: dict):
+        await pusher_client.trigger(channels, event_name, data)
+
+    async def trigger_batch(self, events: List[dict]):
+        # pusher encodes the data in place, which would break retries
+        await pusher_client.trigger_batch([dict(event) for event in events])
+
+
+class RedisPubSubTransport(BroadcastTransport):
+    async def trigger(self, channels: List[str], event_name: str, data: dict):
+        # channels are presence channel names (`<prefix>-<user_id>-...`), the gateway delivers per user
+        user_ids = {channel.split("-")[1] for channel in channels}
+        payload = orjson.dumps(jsonable_encoder({"event": event_name, "data": data})).decode()
+        pipe = cache.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.publish(GATEWAY_USER_TOPIC.format(user_id=user_id), payload)
+        await pipe.execute()
+
+    async def trigger_batch(self, events: List[dict]):
+        published = set()
+        pipe = cache.client.pipeline(transaction=False)
+        for event in events:
+            user_id = event["channel"].split("-")[1]
+            payload = orjson.dumps(jsonable_encoder({"event": event["name"], "data": event["data"]})).decode()
+            if (user_id, payload) in published:
+                continue
+            published.add((user_id, payload))
+            pipe.publish(GATEWAY_USER_TOPIC.format(user_id=user_id), payload)
+        await pipe.execute()
+
+
+BROADCAST_TRANSPORTS: Dict[str, BroadcastTransport] = {
+    "pusher": PusherTransport(),
+    "redis": RedisPubSubTransport(),
+}
+
+
+def get_broadcast_transport() -> BroadcastTransport:
+    return BROADCAST_TRANSPORTS[get_settings().websocket_transport]
@@ -13,9 +13,13 @@ from starlette.middleware.httpsredirect import HTTPSRedirectMiddleware
 from app.config import get_settings
 from app.exceptions import assertion_exception_handler, marshmallow_validation_error_handler, type_error_handler
 from app.helpers.cache_utils import close_redis_connection, connect_to_redis, connect_to_redis_testing
+from app.helpers.channels import stop_channel_last_message_writer
 from app.helpers.db_utils import close_mongo_connection, connect_to_mongo, create_all_indexes, override_connect_to_mongo
+from app.helpers.gateway import close_websocket_gateway
 from app.helpers.logconf import log_configuration
-from app.helpers.queue_utils import stop_background_tasks
+from app.helpers.pagination import NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER
+from app.helpers.queue_utils import start_bg_task_stats_reporter, stop_background_tasks
+from app.helpers.websockets import close_pusher_connection
 from app.middlewares import add_canonical_log_line, profile_request
 from app.routers import (
     auth,
@@ -47,9 +51,13 @@ def get_application(testing=False):
         app_.add_event_handler("startup", create_all_indexes)
         app_.add_event_handler("startup", connect_to_redis)
 
+    app_.add_event_handler("startup", start_bg_task_stats_reporter)
     app_.add_event_handler("shutdown", stop_background_tasks)
+    app_.add_event_handler("shutdown", stop_channel_last_message_writer)
+    app_.add_event_handler("shutdown", close_websocket_gateway)
     app_.add_event_handler("shutdown", close_mongo_connection)
     app_.add_event_handler("shutdown", close_redis_connection)
+    app_.add_event_handler("shutdown", close_pusher_connection)
 
     origins = ["*"]  # TODO: change this later
 
@@ -59,6 +67,7 @@ def get_application(testing=False):
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER],
     )
 
     settings = get_settings()
@@ -2,10 +2,15 @@ import logging
 import time
 import uuid
 from contextvars import ContextVar
+from typing import AsyncIterator, Optional
 
 import arrow
 from pyinstrument import Profiler
 from starlette.requests import Request
+from starlette.responses import Response
+
+from app.helpers.loaders import init_reference_loader, reset_reference_loader
+from app.helpers.metrics import RequestStats, get_request_stats, init_request_stats, reset_request_stats
 
 logger = logging.getLogger(__name__)
 
@@ -31,17 +36,7 @@ async def profile_request(request: Request, call_next):
     return response
 
 
-async def add_canonical_log_line(request: Request, call_next):
-    start_time = time.time()
-
-    # heroku has their own request id. use that if available
-    request_id = request.headers.get("X-Request-ID") or uuid.uuid4()
-    request_id = _request_id_ctx_var.set(str(request_id))
-    request.state.request_id = request_id
-
-    logger.info("%s %s", request.method, request.url.path)
-
-    response = await call_next(request)
+def _log_canonical_line(request: Request, response: Response, start_time: float, stats: Optional[RequestStats]):
     process_time = (time.time() - start_time) * 1000
     formatted_process_time = "{0:.2f}".format(process_time)
 
@@ -52,6 +47,9 @@ async def add_canonical_log_line(request: Request, call_next):
         "http_status": response.status_code,
     }
 
+    if stats:
+        log_line_data.update(stats.to_log_data())
+
     try:
         log_line_data["user_id"] = request.state.user_id
     except AttributeError:
@@ -67,5 +65,40 @@ async def add_canonical_log_line(request: Request, call_next):
     log_line = " ".join([f"{key}={value}" for key, value in sorted_dict.items()])
     logger.info("canonical-log %s", log_line)
 
-    _request_id_ctx_var.reset(request_id)
+
+async def add_canonical_log_line(request: Request, call_next):
+    start_time = time.time()
+
+    # heroku has their own request id. use that if available
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4()
+    request_id_token = _request_id_ctx_var.set(str(request_id))
+    request.state.request_id = request_id_token
+    reference_loader = init_reference_loader()
+    request_stats = init_request_stats()
+
+    logger.info("%s %s", request.method, request.url.path)
+
+    response = await call_next(request)
+    stats = get_request_stats()
+
+    reset_request_stats(request_stats)
+    reset_reference_loader(reference_loader)
+    _request_id_ctx_var.reset(request_id_token)
+
+    # the body (e.g. the ndjson /ready stream) is still being produced here, so the line is logged once it's sent
+    # and its db/redis calls are counted too
+    body_iterator = response.body_iterator
+
+    async def log_after_body() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            token = _request_id_ctx_var.set(str(request_id))
+            try:
+                _log_canonical_line(request, response, start_time=start_time, stats=stats)
+            finally:
+                _request_id_ctx_var.reset(token)
+
+    response.body_iterator = log_after_body()
     return response
@@ -2,15 +2,17 @@ from typing import List
 
 from umongo import Document, MixinDocument, Reference, fields
 
+from app.helpers.cache_utils import invalidate_cached_documents
 from app.helpers.dates import get_mongo_utc_date
 from app.helpers.db_utils import instance
+from app.helpers.loaders import fetch_references
 
 
 @instance.register
 class DatetimeMixin(MixinDocument):
     created_at = fields.AwareDateTimeField(default=get_mongo_utc_date)
 
-    # TODO: add default updated_at + trigger on each update
+    # set by APIDocument's pre_insert/pre_update hooks and by crud's raw updates
     updated_at = fields.AwareDateTimeField()
 
 
@@ -24,6 +26,7 @@ class APIDocument(Document, DatetimeMixin):
         if not expand_fields and not exclude_fields:
             return dumped_obj
 
+        expand_references = {}
         for field, value in self.items():
             if exclude_fields and field in exclude_fields:
                 dumped_obj.pop(field, None)
@@ -31,10 +34,25 @@ class APIDocument(Document, DatetimeMixin):
 
             if expand_fields and field in expand_fields:
                 if isinstance(value, Reference):
-                    value = await value.fetch()
-                    dumped_obj[field] = value.dump()
+                    expand_references[field] = value
+
+        expanded_values = await fetch_references(list(expand_references.values()))
+        for field, value in zip(expand_references.keys(), expanded_values):
+            dumped_obj[field] = value.dump()
 
         return dumped_obj
 
+    def pre_insert(self):
+        self.updated_at = self.created_at
+
+    def pre_update(self):
+        self.updated_at = get_mongo_utc_date()
+
+    async def post_update(self, ret):
+        await invalidate_cached_documents(type(self), [self.pk])
+
+    async def post_delete(self, ret):
+        await invalidate_cached_documents(type(self), [self.pk])
+
     class Meta:
         abstract = True
@@ -1,5 +1,5 @@
 from marshmallow import ValidationError
-from pymongo import ASCENDING
+from pymongo import ASCENDING, DESCENDING
 from umongo import fields, validate
 
 from app.helpers.db_utils import instance
@@ -23,6 +23,7 @@ class Channel(APIDocument):
     name = fields.StrField()
 
     def pre_insert(self):
+        APIDocument.pre_insert(self)
         if self.kind == "dm":
             if not hasattr(self, "members"):
                 raise ValidationError("missing 'members' field")
@@ -39,7 +40,17 @@ class Channel(APIDocument):
 
     class Meta:
         collection_name = "channels"
-        indexes = ["server"]
+        cache_ttl = 60
+        indexes = [
+            [
+                ("server", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+                {"name": "server_1_created_at_-1__id_-1_not_deleted", "partialFilterExpression": {"deleted": False}},
+            ],
+            [("server", ASCENDING), ("updated_at", ASCENDING)],
+            [("members", ASCENDING), ("updated_at", ASCENDING)],
+        ]
 
 
 @instance.register
@@ -48,10 +59,13 @@ class ChannelReadState(APIDocument):
     channel = fields.ReferenceField("Channel")
     last_read_at = fields.AwareDateTimeField()
     mention_count = fields.IntField(default=0)
+    # messages already counted in mention_count, so a retried mention task doesn't count them twice
+    counted_mentions = fields.ListField(fields.ObjectIdField(), default=[])
 
     class Meta:
         collection_name = "channels_read_states"
         indexes = [
             "user",
             [("user", ASCENDING), ("channel", ASCENDING), {"unique": True}],
+            [("user", ASCENDING), ("updated_at", ASCENDING)],
         ]
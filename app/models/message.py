@@ -32,5 +32,10 @@ class Message(APIDocument):
     class Meta:
         collection_name = "messages"
         indexes = [
-            (("channel", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)),
+            [
+                ("channel", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+                {"name": "channel_1_created_at_-1__id_-1_not_deleted", "partialFilterExpression": {"deleted": False}},
+            ],
         ]
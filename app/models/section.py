@@ -1,3 +1,4 @@
+from pymongo import ASCENDING
 from umongo import fields
 
 from app.helpers.db_utils import instance
@@ -14,4 +15,4 @@ class Section(APIDocument):
 
     class Meta:
         collection_name = "sections"
-        indexes = ["server"]
+        indexes = ["server", [("server", ASCENDING), ("updated_at", ASCENDING)]]
@@ -1,4 +1,5 @@
 from marshmallow import ValidationError
+from pymongo import ASCENDING
 from umongo import fields, validate
 
 from app.helpers.dates import get_mongo_utc_date
@@ -21,6 +22,7 @@ class Server(APIDocument):
 
     class Meta:
         collection_name = "servers"
+        cache_ttl = 300
 
 
 @instance.register
@@ -35,7 +37,21 @@ class ServerMember(APIDocument):
 
     class Meta:
         collection_name = "server_members"
-        indexes = ["server", "user"]
+        indexes = [
+            [
+                ("server", ASCENDING),
+                ("_id", ASCENDING),
+                {"name": "server_1__id_1_not_deleted", "partialFilterExpression": {"deleted": False}},
+            ],
+            [
+                ("user", ASCENDING),
+                ("joined_at", ASCENDING),
+                ("_id", ASCENDING),
+                {"name": "user_1_joined_at_1__id_1_not_deleted", "partialFilterExpression": {"deleted": False}},
+            ],
+            [("server", ASCENDING), ("updated_at", ASCENDING)],
+            [("user", ASCENDING), ("updated_at", ASCENDING)],
+        ]
 
 
 @instance.register
@@ -49,6 +65,7 @@ class ServerJoinRule(APIDocument):
     allowlist_addresses = fields.ListField(fields.StrField)
 
     def pre_insert(self):
+        APIDocument.pre_insert(self)
         if self.type == "guild_xyz":
             if not hasattr(self, "guild_xyz_id"):
                 raise ValidationError("missing 'guild_xyz_id' field")
@@ -0,0 +1,21 @@
+from pymongo import ASCENDING
+from umongo import fields
+
+from app.helpers.db_utils import instance
+from app.models.base import APIDocument
+
+
+@instance.register
+class DeadLetterTask(APIDocument):
+    # background tasks that failed every attempt, kept for `python -m app.commands.replay_dead_letters`
+    task = fields.StrField(required=True)
+    # the task encoded like task stream entries, documents are stored by id
+    payload = fields.StrField(required=True)
+    error = fields.StrField()
+    attempts = fields.IntField()
+
+    replayed_at = fields.AwareDateTimeField()
+
+    class Meta:
+        collection_name = "dead_letter_tasks"
+        indexes = [[("replayed_at", ASCENDING), ("task", ASCENDING), ("created_at", ASCENDING)]]
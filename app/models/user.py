@@ -16,4 +16,5 @@ class User(APIDocument):
 
     class Meta:
         collection_name = "users"
-        indexes = ["wallet_address"]
+        cache_ttl = 60
+        indexes = ["wallet_address", "updated_at"]
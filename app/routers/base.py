@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends
+import http
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 
 from app.dependencies import get_current_user
 from app.models.user import User
-from app.services.base import get_connection_ready_data
+from app.services.base import get_connection_ready_delta, get_connection_ready_payload, get_connection_ready_stream
 
 router = APIRouter()
 
@@ -13,5 +17,18 @@ def get_index():
 
 
 @router.get("/ready", include_in_schema=False)
-async def get_connection_ready(current_user: User = Depends(get_current_user)):
-    return await get_connection_ready_data(current_user=current_user)
+async def get_connection_ready(
+    since: Optional[str] = None, stream: bool = False, current_user: User = Depends(get_current_user)
+):
+    if stream:
+        if since:
+            raise HTTPException(status_code=http.HTTPStatus.BAD_REQUEST, detail="since can't be streamed")
+        return StreamingResponse(
+            get_connection_ready_stream(current_user=current_user), media_type="application/x-ndjson"
+        )
+
+    if since:
+        return await get_connection_ready_delta(current_user=current_user, since_token=since)
+
+    payload = await get_connection_ready_payload(current_user=current_user)
+    return Response(content=payload, media_type="application/json")
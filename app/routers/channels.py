@@ -3,8 +3,12 @@ from datetime import datetime
 from typing import List, Optional, Union
 
 from fastapi import APIRouter, Body, Depends
+from fastapi.responses import ORJSONResponse
 
 from app.dependencies import common_parameters, get_current_user
+from app.helpers.pagination import get_page_cursors
+from app.helpers.serializers import serialize_raw_documents
+from app.models.message import Message
 from app.models.user import User
 from app.schemas.channels import (
     ChannelBulkReadStateCreateSchema,
@@ -22,7 +26,7 @@ from app.services.channels import (
     mark_channel_as_read,
     update_channel,
 )
-from app.services.messages import get_message, get_messages
+from app.services.messages import get_message, get_raw_messages
 
 router = APIRouter()
 
@@ -46,8 +50,21 @@ async def get_list_messages(
     common_params: dict = Depends(common_parameters),
     current_user: User = Depends(get_current_user),
 ):
-    messages = await get_messages(channel_id, current_user=current_user, **common_params)
-    return messages
+    messages = await get_raw_messages(channel_id, current_user=current_user, **common_params)
+
+    # "after" pages are returned in ascending order
+    page_messages = messages[::-1] if common_params["after"] else messages
+    cursor_headers = get_page_cursors(
+        page_messages,
+        sort_by_field=common_params["sort_by_field"],
+        sort_by_direction=common_params["sort_by_direction"],
+        limit=common_params["limit"],
+        cursor=common_params["cursor"],
+        paginated=any(common_params[param] for param in ["before", "after", "around"]),
+    )
+    return ORJSONResponse(
+        serialize_raw_documents(messages, schema=MessageSchema, document_cls=Message), headers=cursor_headers
+    )
 
 
 @router.get("/{channel_id}/messages/{message_id}", response_description="Get message", response_model=MessageSchema)
@@ -2,9 +2,13 @@ import http
 from typing import List
 
 from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from starlette import status
 
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, id_page_parameters
+from app.helpers.pagination import get_page_cursors
+from app.helpers.serializers import serialize_raw_documents
+from app.models.server import Server, ServerMember
 from app.models.user import User
 from app.schemas.channels import ServerChannelSchema
 from app.schemas.sections import SectionCreateSchema, SectionSchema
@@ -14,7 +18,9 @@ from app.services.sections import create_section, get_sections, update_server_se
 from app.services.servers import (
     create_server,
     get_server_members,
+    get_server_members_page,
     get_servers,
+    get_servers_page,
     is_eligible_to_join_server,
     join_server,
     update_server,
@@ -22,10 +28,26 @@ from app.services.servers import (
 
 router = APIRouter()
 
+SERVERS_PAGE_SIZE = 100
+SERVER_MEMBERS_PAGE_SIZE = 100
+
 
 @router.get("", summary="List servers", response_model=List[ServerSchema])
-async def get_list_servers(current_user: User = Depends(get_current_user)):
-    return await get_servers(current_user=current_user)
+async def get_list_servers(
+    page_params: dict = Depends(id_page_parameters), current_user: User = Depends(get_current_user)
+):
+    if page_params["limit"] is None and page_params["cursor"] is None:
+        return await get_servers(current_user=current_user)
+
+    limit = page_params["limit"] or SERVERS_PAGE_SIZE
+    servers = await get_servers_page(current_user=current_user, limit=limit, cursor=page_params["cursor"])
+    cursor_headers = get_page_cursors(
+        servers, sort_by_field="_id", sort_by_direction=1, limit=limit, cursor=page_params["cursor"]
+    )
+    serialized_servers = serialize_raw_documents(servers, schema=ServerSchema, document_cls=Server)
+    for serialized_server, server in zip(serialized_servers, servers):
+        serialized_server["member_count"] = server["member_count"]
+    return ORJSONResponse(serialized_servers, headers=cursor_headers)
 
 
 @router.post(
@@ -41,8 +63,22 @@ async def post_create_server(server: ServerCreateSchema = Body(...), current_use
     response_model=List[ServerMemberSchema],
     status_code=http.HTTPStatus.OK,
 )
-async def get_list_server_members(server_id, current_user: User = Depends(get_current_user)):
-    return await get_server_members(server_id, current_user=current_user)
+async def get_list_server_members(
+    server_id, page_params: dict = Depends(id_page_parameters), current_user: User = Depends(get_current_user)
+):
+    if page_params["limit"] is None and page_params["cursor"] is None:
+        return await get_server_members(server_id, current_user=current_user)
+
+    limit = page_params["limit"] or SERVER_MEMBERS_PAGE_SIZE
+    members = await get_server_members_page(
+        server_id, current_user=current_user, limit=limit, cursor=page_params["cursor"]
+    )
+    cursor_headers = get_page_cursors(
+        members, sort_by_field="_id", sort_by_direction=1, limit=limit, cursor=page_params["cursor"]
+    )
+    return ORJSONResponse(
+        serialize_raw_documents(members, schema=ServerMemberSchema, document_cls=ServerMember), headers=cursor_headers
+    )
 
 
 @router.post(
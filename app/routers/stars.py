@@ -2,14 +2,20 @@ import http
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
 
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, id_page_parameters
+from app.helpers.pagination import get_page_cursors
+from app.helpers.serializers import serialize_raw_documents
+from app.models.star import Star
 from app.models.user import User
 from app.schemas.stars import StarCreateSchema, StarSchema
-from app.services.stars import create_star, delete_star, get_stars
+from app.services.stars import create_star, delete_star, get_stars, get_stars_page
 
 router = APIRouter()
 
+STARS_PAGE_SIZE = 100
+
 
 @router.post(
     "",
@@ -23,9 +29,21 @@ async def post_create_star(star: StarCreateSchema, current_user: User = Depends(
 
 @router.get("", summary="List all user's stars", response_model=List[StarSchema], status_code=http.HTTPStatus.OK)
 async def get_fetch_stars(
-    star_type: Optional[str] = Query(None, alias="type"), current_user: User = Depends(get_current_user)
+    star_type: Optional[str] = Query(None, alias="type"),
+    page_params: dict = Depends(id_page_parameters),
+    current_user: User = Depends(get_current_user),
 ):
-    return await get_stars(current_user=current_user, stars_type=star_type)
+    if page_params["limit"] is None and page_params["cursor"] is None:
+        return await get_stars(current_user=current_user, stars_type=star_type)
+
+    limit = page_params["limit"] or STARS_PAGE_SIZE
+    stars = await get_stars_page(
+        current_user=current_user, limit=limit, cursor=page_params["cursor"], stars_type=star_type
+    )
+    cursor_headers = get_page_cursors(
+        stars, sort_by_field="_id", sort_by_direction=1, limit=limit, cursor=page_params["cursor"]
+    )
+    return ORJSONResponse(serialize_raw_documents(stars, schema=StarSchema, document_cls=Star), headers=cursor_headers)
 
 
 @router.delete("/{star_id}", summary="Remove star", status_code=http.HTTPStatus.NO_CONTENT)
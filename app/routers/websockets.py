@@ -1,13 +1,27 @@
+import asyncio
+import json
+import logging
+import uuid
 from typing import Optional
 
-from fastapi import APIRouter, Depends, Form
+from fastapi import APIRouter, Depends, Form, HTTPException, WebSocket, WebSocketDisconnect, status
 
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, get_user_from_token
+from app.helpers.gateway import get_gateway_channel_name, websocket_gateway
 from app.helpers.websockets import pusher_client
 from app.models.user import User
+from app.services.webhooks import (
+    handle_pusher_client_event,
+    process_channel_occupied_event,
+    process_channel_vacated_event,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+GATEWAY_AUTH_TIMEOUT_SECONDS = 5
+
 
 @router.post("/auth", include_in_schema=False)
 async def post_websocket_authentication(
@@ -24,3 +38,53 @@ async def post_websocket_authentication(
         raise Exception(f"problem establishing connection: unexpected channel name {channel_name}")
     auth = pusher_client.authenticate(channel=channel_name, socket_id=socket_id)
     return auth
+
+
+async def authenticate_gateway_websocket(websocket: WebSocket) -> Optional[User]:
+    # the access token comes in the first frame, {"event": "authenticate", "data": {"token": ...}}. browsers can't
+    # set headers on websocket requests, and a query string token would end up in access logs
+    try:
+        message = await asyncio.wait_for(websocket.receive_text(), timeout=GATEWAY_AUTH_TIMEOUT_SECONDS)
+        auth_event = json.loads(message)
+        if auth_event["event"] != "authenticate":
+            return None
+        return await get_user_from_token(auth_event["data"]["token"])
+    except (asyncio.TimeoutError, ValueError, KeyError, TypeError, HTTPException):
+        return None
+
+
+@router.websocket("/gateway")
+async def websocket_gateway_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        current_user = await authenticate_gateway_websocket(websocket)
+    except WebSocketDisconnect:
+        return
+    if not current_user:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    user_id = str(current_user.pk)
+    channel_name = get_gateway_channel_name(user_id, uuid.uuid4().hex)
+    await websocket_gateway.connect(user_id, websocket)
+    await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+    try:
+        while True:
+            # client events use the same names and payloads as pusher client events
+            message = await websocket.receive_text()
+            try:
+                client_event = json.loads(message)
+                await handle_pusher_client_event(
+                    {
+                        "channel": channel_name,
+                        "event": client_event["event"],
+                        "data": json.dumps(client_event.get("data", {})),
+                    }
+                )
+            except Exception:
+                logger.exception("Problem handling gateway client event. [user_id=%s]", user_id)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await websocket_gateway.disconnect(user_id, websocket)
+        await process_channel_vacated_event(channel_name=channel_name, current_user=current_user)
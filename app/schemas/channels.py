@@ -67,6 +67,7 @@ class ChannelReadStateCreateSchema(APIBaseCreateSchema):
     channel: str
     last_read_at: datetime
     mention_count: Optional[int] = 0
+    counted_mentions: List[str] = []
 
 
 class ChannelUpdateSchema(APIBaseUpdateSchema):
@@ -1,88 +1,473 @@
+import asyncio
+import base64
+import http
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, DefaultDict, Dict, Iterable, List, Optional, Set, Tuple, Type, Union
+
+import orjson
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from redis.exceptions import RedisError
+
+from app.config import get_settings
+from app.helpers.dates import get_mongo_utc_date
+from app.helpers.presence import get_online_channels_by_user, get_servers_online_user_ids
+from app.helpers.ready_cache import get_ready_snapshot, get_ready_versions, set_ready_snapshot
+from app.models.channel import Channel, ChannelReadState
+from app.models.message import Message
 from app.models.section import Section
+from app.models.server import Server, ServerMember
 from app.models.user import User
-from app.services.channels import get_dm_channels, get_server_channels
-from app.services.crud import get_items
-from app.services.servers import get_server_members, get_user_servers
+from app.services.channels import get_dm_channels
+from app.services.crud import APIDocumentType, count_items_by_field, get_items, iter_items
 from app.services.users import get_user_read_states
 
+logger = logging.getLogger(__name__)
 
-async def get_connection_ready_data(current_user: User) -> dict:
-    data = {"user": current_user.dump(), "servers": []}
-    servers = await get_user_servers(current_user=current_user)
-    common_user_ids = set()
-
-    for server in servers:
-        server_data = {"id": str(server.id), "name": server.name, "owner": str(server.owner.pk)}
-        channels = await get_server_channels(server_id=str(server.id), current_user=current_user)
-        members = await get_server_members(server_id=str(server.id), current_user=current_user)
-        sections = await get_items(
-            filters={"server": server.pk},
+READY_VERSION_CLOCK_SKEW_SECONDS = 5
+READY_STREAM_SERVER_BATCH_SIZE = 10
+READY_LAZY_MEMBERS_RECENT_MESSAGES = 100
+
+
+async def _get_servers_members(
+    server_ids: List[ObjectId], current_user: User, filters: Optional[dict] = None
+) -> DefaultDict[ObjectId, List[ServerMember]]:
+    members: DefaultDict[ObjectId, List[ServerMember]] = defaultdict(list)
+    if not server_ids:
+        return members
+
+    async for server_members in iter_items(
+        {"server": {"$in": server_ids}, **(filters or {})}, result_obj=ServerMember, current_user=current_user
+    ):
+        for member in server_members:
+            members[member.server.pk].append(member)
+    return members
+
+
+async def _get_recent_author_ids(channel_ids: List[ObjectId], current_user: User) -> Set[ObjectId]:
+    if not channel_ids:
+        return set()
+
+    messages = await get_items(
+        {"channel": {"$in": channel_ids}},
+        result_obj=Message,
+        current_user=current_user,
+        limit=READY_LAZY_MEMBERS_RECENT_MESSAGES,
+        projection=["author"],
+    )
+    return {message.author.pk for message in messages if message.author}
+
+
+async def _get_online_user_ids(server_ids: List[ObjectId]) -> Set[ObjectId]:
+    try:
+        return await get_servers_online_user_ids(server_ids)
+    except RedisError:
+        logger.exception("Problem reading presence. [server_ids=%s]", server_ids)
+        return set()
+
+
+async def _get_lazy_servers_members(
+    server_ids: List[ObjectId], channels_by_server: DefaultDict[ObjectId, List[Channel]], current_user: User
+) -> DefaultDict[ObjectId, List[ServerMember]]:
+    if not server_ids:
+        return defaultdict(list)
+
+    online_user_ids, *recent_author_ids = await asyncio.gather(
+        _get_online_user_ids(server_ids),
+        *[
+            _get_recent_author_ids([channel.pk for channel in channels_by_server[server_id]], current_user=current_user)
+            for server_id in server_ids
+        ],
+    )
+    user_ids = {current_user.pk, *online_user_ids}.union(*recent_author_ids)
+    return await _get_servers_members(server_ids, current_user=current_user, filters={"user": {"$in": list(user_ids)}})
+
+
+def _group_by_server(items: List[Any]) -> DefaultDict[ObjectId, List[Any]]:
+    grouped_items: DefaultDict[ObjectId, List[Any]] = defaultdict(list)
+    for item in items:
+        grouped_items[item.server.pk].append(item)
+    return grouped_items
+
+
+async def _overlay_live_ready_data(snapshot: str, current_user: User) -> bytes:
+    # presence and last_message_at change too often to be part of the snapshot versions, they're read live instead
+    data = orjson.loads(snapshot)
+    server_channels = [channel for server in data["servers"] for channel in server["channels"]]
+    channel_ids = [ObjectId(channel["id"]) for channel in server_channels + data["dms"]]
+    channel_list = await get_items(
+        {"_id": {"$in": channel_ids}},
+        result_obj=Channel,
+        current_user=current_user,
+        limit=None,
+        projection=["last_message_at"],
+    )
+    last_message_dates = {
+        str(channel.pk): channel.last_message_at.isoformat() for channel in channel_list if channel.last_message_at
+    }
+    for channel in server_channels + data["dms"]:
+        if channel["id"] in last_message_dates:
+            channel["last_message_at"] = last_message_dates[channel["id"]]
+
+    try:
+        online_channels_by_user = await get_online_channels_by_user([user["id"] for user in data["users"]])
+    except RedisError:
+        logger.exception("Problem reading presence, serving /ready snapshot statuses. [user_id=%s]", current_user.pk)
+    else:
+        for user in data["users"]:
+            user["status"] = "online" if online_channels_by_user.get(user["id"]) else "offline"
+
+    return orjson.dumps(data)
+
+
+async def get_connection_ready_payload(current_user: User) -> Union[bytes, str]:
+    user_id = str(current_user.pk)
+    snapshot = await get_ready_snapshot(user_id)
+    if snapshot is not None:
+        return await _overlay_live_ready_data(snapshot, current_user=current_user)
+
+    # versions are read before building the payload, so any write that lands while it's being built invalidates it
+    server_memberships = await get_items(
+        {"user": current_user.pk}, result_obj=ServerMember, current_user=current_user, limit=None, projection=["server"]
+    )
+    server_ids = sorted({str(member.server.pk) for member in server_memberships})
+    versions = await get_ready_versions(user_id, server_ids)
+
+    data = await get_connection_ready_data(current_user=current_user)
+    payload = orjson.dumps(jsonable_encoder(data))
+
+    if versions is not None:
+        await set_ready_snapshot(user_id, payload, server_ids=server_ids, versions=versions)
+
+    return payload
+
+
+def _encode_ready_version(version: datetime) -> str:
+    millis = str(int(version.timestamp() * 1000))
+    return base64.urlsafe_b64encode(millis.encode()).decode().rstrip("=")
+
+
+def _decode_ready_version(token: str) -> datetime:
+    try:
+        millis = int(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode())
+        return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        raise HTTPException(status_code=http.HTTPStatus.BAD_REQUEST, detail="invalid version token")
+
+
+def _get_ready_version() -> datetime:
+    # writes are stamped with app server clocks, so the token trails them by a margin. replaying a few seconds of
+    # changes is harmless, missing them is not.
+    return get_mongo_utc_date() - timedelta(seconds=READY_VERSION_CLOCK_SKEW_SECONDS)
+
+
+def _dump_server(server: Server) -> dict:
+    return {"id": str(server.id), "name": server.name, "owner": str(server.owner.pk)}
+
+
+def _dump_member(member: ServerMember) -> dict:
+    return {
+        "id": str(member.id),
+        "user": str(member.user.pk),
+        "server": str(member.server.pk),
+        "display_name": member.display_name,
+        "joined_at": member.joined_at,
+        "pfp": member.pfp,
+    }
+
+
+def _dump_server_channel(channel: Channel) -> dict:
+    return {
+        "id": str(channel.id),
+        "last_message_at": channel.last_message_at.isoformat() if channel.last_message_at else None,
+        "name": channel.name,
+    }
+
+
+def _dump_user(user: User) -> dict:
+    return {
+        "id": str(user.pk),
+        "display_name": user.display_name,
+        "pfp": user.pfp,
+        "wallet_address": user.wallet_address,
+        "status": user.status,
+    }
+
+
+def _dump_read_state(read_state: ChannelReadState) -> dict:
+    return {
+        "channel": str(read_state.channel.pk),
+        "last_read_at": read_state.last_read_at.isoformat(),
+        "mention_count": read_state.mention_count,
+    }
+
+
+async def _get_users_data(user_ids: Iterable[ObjectId], current_user: User) -> List[dict]:
+    user_list = await get_items(
+        filters={"_id": {"$in": list(user_ids)}},
+        result_obj=User,
+        current_user=current_user,
+        limit=None,
+        projection=["display_name", "pfp", "wallet_address", "status"],
+    )
+    return [_dump_user(user) for user in user_list]
+
+
+async def _get_servers_data(server_ids: List[ObjectId], current_user: User) -> Tuple[List[dict], Set[ObjectId]]:
+    server_list, channel_list, section_list, member_counts = await asyncio.gather(
+        get_items(
+            filters={"_id": {"$in": server_ids}},
+            result_obj=Server,
+            current_user=current_user,
+            limit=None,
+            projection=["name", "owner"],
+        ),
+        get_items(filters={"server": {"$in": server_ids}}, result_obj=Channel, current_user=current_user, limit=None),
+        get_items(
+            filters={"server": {"$in": server_ids}},
             result_obj=Section,
             current_user=current_user,
             sort_by_field="position",
             sort_by_direction=1,
-        )
+        ),
+        count_items_by_field(filters={"server": {"$in": server_ids}}, result_obj=ServerMember, group_by_field="server"),
+    )
+    servers = {server.pk: server for server in server_list}
+    channels_by_server = _group_by_server(channel_list)
+    sections_by_server = _group_by_server(section_list)
+
+    # large servers only ship the members a client is likely to render, the rest are paged from /servers/{id}/members
+    threshold = get_settings().ready_lazy_members_threshold
+    lazy_server_ids = [
+        server_id for server_id in server_ids if threshold and member_counts.get(server_id, 0) > threshold
+    ]
+    eager_server_ids = [server_id for server_id in server_ids if server_id not in lazy_server_ids]
+    members_by_server, lazy_members_by_server = await asyncio.gather(
+        _get_servers_members(eager_server_ids, current_user=current_user),
+        _get_lazy_servers_members(lazy_server_ids, channels_by_server=channels_by_server, current_user=current_user),
+    )
+    members_by_server.update(lazy_members_by_server)
+    member_user_ids = set()
+
+    servers_data = []
+    for server_id in server_ids:
+        server = servers.get(server_id)
+        if not server:
+            continue
 
         member_list = []
-        for member in members:
-            common_user_ids.add(member.user.pk)
-            member_dict = {
-                "id": str(member.id),
-                "user": str(member.user.pk),
-                "server": str(member.server.pk),
-                "display_name": member.display_name,
-                "joined_at": member.joined_at,
-                "pfp": member.pfp,
-            }
-            member_list.append(member_dict)
+        for member in members_by_server[server_id]:
+            member_user_ids.add(member.user.pk)
+            member_list.append(_dump_member(member))
 
+        server_data = _dump_server(server)
         server_data.update(
             {
-                "channels": [
-                    {
-                        "id": str(channel.id),
-                        "last_message_at": channel.last_message_at.isoformat() if channel.last_message_at else None,
-                        "name": channel.name,
-                    }
-                    for channel in channels
-                ],
+                "channels": [_dump_server_channel(channel) for channel in channels_by_server[server_id]],
                 "members": member_list,
-                "sections": [section.dump() for section in sections],
+                "member_count": member_counts.get(server_id, 0),
+                "lazy_members": server_id in lazy_server_ids,
+                "sections": [section.dump() for section in sections_by_server[server_id]],
             }
         )
+        servers_data.append(server_data)
+
+    return servers_data, member_user_ids
+
+
+async def get_connection_ready_data(current_user: User) -> dict:
+    data: Dict[str, Any] = {"version": _encode_ready_version(_get_ready_version()), "user": current_user.dump()}
+
+    # memberships already prove access to each server, so no per-server permission checks are needed
+    server_memberships, dm_channel_list, read_states = await asyncio.gather(
+        get_items(
+            {"user": current_user.pk},
+            result_obj=ServerMember,
+            current_user=current_user,
+            limit=None,
+            sort_by_field="joined_at",
+            sort_by_direction=1,
+            projection=["server"],
+        ),
+        get_dm_channels(current_user=current_user, limit=None),
+        get_user_read_states(current_user=current_user),
+    )
+    server_ids = list(dict.fromkeys([member.server.pk for member in server_memberships]))
 
-        data["servers"].append(server_data)
+    data["servers"], common_user_ids = await _get_servers_data(server_ids, current_user=current_user)
 
     dm_channels = []
-    for channel in await get_dm_channels(current_user=current_user, limit=None):
+    for channel in dm_channel_list:
         common_user_ids.update(map(lambda m: m.pk, channel.members))
         dm_channels.append(channel.dump())
 
     data["dms"] = dm_channels
+    data["users"] = await _get_users_data(common_user_ids, current_user=current_user)
+    data["read_states"] = [_dump_read_state(read_state) for read_state in read_states]
 
-    user_list = await get_items(
-        filters={"_id": {"$in": list(common_user_ids)}}, result_obj=User, current_user=current_user, limit=None
+    return data
+
+
+async def iter_connection_ready_chunks(current_user: User) -> AsyncIterator[dict]:
+    # same data as get_connection_ready_data, but servers are loaded and emitted a batch at a time so the client can
+    # start rendering before the whole graph is built
+    yield {"type": "version", "data": _encode_ready_version(_get_ready_version())}
+    yield {"type": "user", "data": current_user.dump()}
+
+    server_memberships, dm_channel_list, read_states = await asyncio.gather(
+        get_items(
+            {"user": current_user.pk},
+            result_obj=ServerMember,
+            current_user=current_user,
+            limit=None,
+            sort_by_field="joined_at",
+            sort_by_direction=1,
+            projection=["server"],
+        ),
+        get_dm_channels(current_user=current_user, limit=None),
+        get_user_read_states(current_user=current_user),
     )
+    server_ids = list(dict.fromkeys([member.server.pk for member in server_memberships]))
 
-    data["users"] = [
-        {
-            "id": str(user.pk),
-            "display_name": user.display_name,
-            "pfp": user.pfp,
-            "wallet_address": user.wallet_address,
-            "status": user.status,
-        }
-        for user in user_list
-    ]
+    common_user_ids: Set[ObjectId] = set()
+    for index in range(0, len(server_ids), READY_STREAM_SERVER_BATCH_SIZE):
+        batch_server_ids = server_ids[index : index + READY_STREAM_SERVER_BATCH_SIZE]
+        servers_data, member_user_ids = await _get_servers_data(batch_server_ids, current_user=current_user)
+        common_user_ids.update(member_user_ids)
+        for server_data in servers_data:
+            yield {"type": "server", "data": server_data}
 
-    read_states = await get_user_read_states(current_user=current_user)
-    data["read_states"] = [
-        {
-            "channel": str(read_state.channel.pk),
-            "last_read_at": read_state.last_read_at.isoformat(),
-            "mention_count": read_state.mention_count,
-        }
-        for read_state in read_states
-    ]
+    dm_channels = []
+    for channel in dm_channel_list:
+        common_user_ids.update(map(lambda m: m.pk, channel.members))
+        dm_channels.append(channel.dump())
+    yield {"type": "dms", "data": dm_channels}
 
-    return data
+    async for user_list in iter_items(
+        {"_id": {"$in": list(common_user_ids)}},
+        result_obj=User,
+        current_user=current_user,
+        projection=["display_name", "pfp", "wallet_address", "status"],
+    ):
+        yield {"type": "users", "data": [_dump_user(user) for user in user_list]}
+
+    yield {"type": "read_states", "data": [_dump_read_state(read_state) for read_state in read_states]}
+
+
+async def get_connection_ready_stream(current_user: User) -> AsyncIterator[bytes]:
+    async for chunk in iter_connection_ready_chunks(current_user=current_user):
+        yield orjson.dumps(jsonable_encoder(chunk)) + b"\n"
+
+
+async def _get_changed_items(filters: dict, result_obj: Type[APIDocumentType], current_user: User, **kwargs):
+    return await get_items(
+        filters, result_obj=result_obj, current_user=current_user, limit=None, include_deleted=True, **kwargs
+    )
+
+
+async def get_connection_ready_delta(current_user: User, since_token: str) -> dict:
+    since = _decode_ready_version(since_token)
+    version = _get_ready_version()
+    changed_filter = {"updated_at": {"$gte": since}}
+
+    server_memberships, changed_memberships, dm_channel_list, read_states = await asyncio.gather(
+        get_items(
+            {"user": current_user.pk},
+            result_obj=ServerMember,
+            current_user=current_user,
+            limit=None,
+            projection=["server", "created_at"],
+        ),
+        _get_changed_items(
+            {"user": current_user.pk, **changed_filter},
+            result_obj=ServerMember,
+            current_user=current_user,
+            projection=["server", "deleted"],
+        ),
+        _get_changed_items(
+            {"members": current_user.pk, **changed_filter}, result_obj=Channel, current_user=current_user
+        ),
+        _get_changed_items(
+            {"user": current_user.pk, **changed_filter}, result_obj=ChannelReadState, current_user=current_user
+        ),
+    )
+
+    # servers joined after `since` are sent whole, the rest only carry what changed in them
+    server_ids = list(dict.fromkeys([member.server.pk for member in server_memberships]))
+    new_server_ids = list(
+        dict.fromkeys([member.server.pk for member in server_memberships if member.created_at >= since])
+    )
+    known_server_ids = [server_id for server_id in server_ids if server_id not in new_server_ids]
+    left_server_ids = {member.server.pk for member in changed_memberships if member.deleted} - set(server_ids)
+
+    changed_known_filter: Dict[str, Any] = {"server": {"$in": known_server_ids}, **changed_filter}
+    (
+        (new_servers_data, user_ids),
+        server_list,
+        channel_list,
+        member_list,
+        section_list,
+        changed_user_list,
+    ) = await asyncio.gather(
+        _get_servers_data(new_server_ids, current_user=current_user),
+        _get_changed_items(
+            {"_id": {"$in": known_server_ids}, **changed_filter},
+            result_obj=Server,
+            current_user=current_user,
+            projection=["name", "owner", "deleted"],
+        ),
+        _get_changed_items(changed_known_filter, result_obj=Channel, current_user=current_user),
+        _get_changed_items(changed_known_filter, result_obj=ServerMember, current_user=current_user),
+        _get_changed_items(changed_known_filter, result_obj=Section, current_user=current_user),
+        get_items(changed_filter, result_obj=User, current_user=current_user, limit=None, projection=["_id"]),
+    )
+
+    # users that changed are only sent if they share a server or a dm with the current user. presence writes don't
+    # touch updated_at, so the changed users are few enough to filter here
+    changed_user_ids = [user.pk for user in changed_user_list]
+    common_members, dm_members = await asyncio.gather(
+        get_items(
+            {"user": {"$in": changed_user_ids}, "server": {"$in": server_ids}},
+            result_obj=ServerMember,
+            current_user=current_user,
+            limit=None,
+            projection=["user"],
+        ),
+        get_items(
+            {"members": current_user.pk, "kind": "dm"},
+            result_obj=Channel,
+            current_user=current_user,
+            limit=None,
+            projection=["members"],
+        ),
+    )
+    visible_user_ids = {member.user.pk for member in common_members}
+    for channel in dm_members:
+        visible_user_ids.update([member.pk for member in channel.members])
+
+    user_ids.update(set(changed_user_ids) & visible_user_ids)
+    user_ids.update([member.user.pk for member in member_list if not member.deleted])
+    for channel in dm_channel_list:
+        user_ids.update([member.pk for member in channel.members])
+
+    server_updates = [{**_dump_server(server), "deleted": server.deleted} for server in server_list]
+    server_updates.extend([{"id": str(server_id), "deleted": True} for server_id in left_server_ids])
+
+    return {
+        "version": _encode_ready_version(version),
+        "user": current_user.dump(),
+        "servers": new_servers_data,
+        "server_updates": server_updates,
+        "channels": [
+            {**_dump_server_channel(channel), "server": str(channel.server.pk), "deleted": channel.deleted}
+            for channel in channel_list
+        ],
+        "members": [{**_dump_member(member), "deleted": member.deleted} for member in member_list],
+        "sections": [{**section.dump(), "deleted": section.deleted} for section in section_list],
+        "dms": [{**channel.dump(), "deleted": channel.deleted} for channel in dm_channel_list],
+        "users": await _get_users_data(user_ids, current_user=current_user),
+        "read_states": [_dump_read_state(read_state) for read_state in read_states],
+    }
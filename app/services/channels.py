@@ -4,10 +4,16 @@ from typing import List, Optional, Union
 
 from bson import ObjectId
 from fastapi import HTTPException
+from pymongo.errors import ConnectionFailure
 from starlette import status
 
+from app.config import get_settings
+from app.helpers.channels import channel_last_message_writer
 from app.helpers.permissions import user_belongs_to_server
 from app.helpers.queue_utils import queue_bg_task
+from app.helpers.ready_cache import invalidate_channel_ready_snapshots, invalidate_ready_snapshots
+from app.helpers.task_queue import register_bg_task
+from app.helpers.throttle import TYPING_THROTTLE_KEY, acquire_throttle
 from app.helpers.ws_events import WebSocketServerEvent
 from app.models.base import APIDocument
 from app.models.channel import Channel, ChannelReadState
@@ -30,7 +36,7 @@ from app.services.crud import (
     get_items,
     update_item,
 )
-from app.services.websockets import broadcast_channel_event
+from app.services.websockets import broadcast_channel_event, broadcast_user_typing_event
 
 
 async def create_dm_channel(channel_model: DMChannelCreateSchema, current_user: User) -> Union[Channel, APIDocument]:
@@ -50,7 +56,9 @@ async def create_dm_channel(channel_model: DMChannelCreateSchema, current_user:
         # TODO: return 200 status code
         return existing_dm_channels[0]
 
-    return await create_item(channel_model, result_obj=Channel, current_user=current_user, user_field="owner")
+    channel = await create_item(channel_model, result_obj=Channel, current_user=current_user, user_field="owner")
+    await invalidate_channel_ready_snapshots(channel)
+    return channel
 
 
 async def create_server_channel(
@@ -63,7 +71,9 @@ async def create_server_channel(
             detail="Only owner can create channels",
         )
 
-    return await create_item(channel_model, result_obj=Channel, current_user=current_user, user_field="owner")
+    channel = await create_item(channel_model, result_obj=Channel, current_user=current_user, user_field="owner")
+    await invalidate_channel_ready_snapshots(channel)
+    return channel
 
 
 async def create_channel(
@@ -108,13 +118,14 @@ async def delete_channel(channel_id, current_user: User):
     else:
         raise Exception(f"unexpected kind of channel: {channel.kind}")
 
-    return await delete_item(item=channel)
+    deleted_channel = await delete_item(item=channel)
+    await invalidate_channel_ready_snapshots(channel)
+    return deleted_channel
 
 
+@register_bg_task(max_attempts=3, retry_on=(ConnectionFailure,))
 async def update_channel_last_message(channel_id, message: Union[Message, APIDocument], current_user: User):
-    channel = await get_item_by_id(id_=channel_id, result_obj=Channel, current_user=current_user)
-    if not channel.last_message_at or message.created_at > channel.last_message_at:
-        await update_item(item=channel, data={"last_message_at": message.created_at}, current_user=current_user)
+    await channel_last_message_writer.record(ObjectId(channel_id), message.created_at)
 
 
 async def bulk_mark_channels_as_read(ack_data: ChannelBulkReadStateCreateSchema, current_user: User):
@@ -133,7 +144,7 @@ async def update_channels_read_state(channel_ids: List[str], current_user: User,
 
     for channel_id in channel_ids:
         # TODO: check if any mentions present after last_read_at. if so, change mention_count below
-        update_data = {"$set": {"last_read_at": last_read_at, "mention_count": 0}}
+        update_data = {"$set": {"last_read_at": last_read_at, "mention_count": 0, "counted_mentions": []}}
         updated_item = await find_and_update_item(
             filters={"user": current_user.pk, "channel": ObjectId(channel_id)},
             data=update_data,
@@ -144,10 +155,12 @@ async def update_channels_read_state(channel_ids: List[str], current_user: User,
             read_state_model = ChannelReadStateCreateSchema(channel=channel_id, last_read_at=last_read_at)
             await create_item(read_state_model, result_obj=ChannelReadState, current_user=current_user)
 
+    await invalidate_ready_snapshots(user_ids=[current_user.pk])
+
 
 async def create_typing_indicator(channel_id: str, current_user: User) -> None:
     channel = await get_item_by_id(id_=channel_id, result_obj=Channel)
-    notify = False
+    is_member = False
 
     if channel.kind == "server":
         user_member = await get_item(
@@ -155,18 +168,24 @@ async def create_typing_indicator(channel_id: str, current_user: User) -> None:
             result_obj=ServerMember,
             current_user=current_user,
         )
-        notify = True if user_member else False
+        is_member = True if user_member else False
     elif channel.kind == "dm":
-        notify = current_user in channel.members
-
-    if notify:
-        await queue_bg_task(
-            broadcast_channel_event,
-            channel_id,
-            str(current_user.id),
-            WebSocketServerEvent.USER_TYPING,
-            {"user": await current_user.to_dict(exclude_fields=["pfp"])},
-        )
+        is_member = current_user in channel.members
+
+    if not is_member:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Missing permissions")
+
+    # clients post on every keystroke, the indicator only needs refreshing once per window
+    throttle_key = TYPING_THROTTLE_KEY.format(user_id=str(current_user.pk), channel_id=channel_id)
+    if not await acquire_throttle(throttle_key, get_settings().typing_throttle_ms):
+        return
+
+    await queue_bg_task(
+        broadcast_user_typing_event,
+        channel,
+        current_user,
+        {"user": await current_user.to_dict(exclude_fields=["pfp"])},
+    )
 
 
 async def update_channel(channel_id: str, update_data: ChannelUpdateSchema, current_user: User):
@@ -185,11 +204,12 @@ async def update_channel(channel_id: str, update_data: ChannelUpdateSchema, curr
         raise Exception(f"unknown channel kind: {channel.kind}")
 
     updated_item = await update_item(item=channel, data=data)
+    await invalidate_channel_ready_snapshots(channel)
 
     await queue_bg_task(
         broadcast_channel_event,
-        channel_id,
-        str(current_user.id),
+        updated_item,
+        current_user,
         WebSocketServerEvent.CHANNEL_UPDATE,
         {"channel": channel_id},
     )
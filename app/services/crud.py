@@ -1,5 +1,5 @@
 import logging
-from typing import List, Optional, Sequence, Type, TypeVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Type, TypeVar
 
 from bson import ObjectId
 from bson.errors import InvalidId
@@ -7,6 +7,14 @@ from pymongo import ReturnDocument
 from pymongo.results import InsertManyResult, UpdateResult
 from umongo import Reference
 
+from app.helpers.cache_utils import (
+    get_cached_document,
+    get_document_cache_ttl,
+    invalidate_cached_documents,
+    set_cached_document,
+)
+from app.helpers.dates import get_mongo_utc_date
+from app.helpers.pagination import PageCursor, get_cursor_filter, get_cursor_sort
 from app.models.base import APIDocument
 from app.models.user import User
 from app.schemas.base import APIBaseCreateSchema
@@ -15,6 +23,12 @@ logger = logging.getLogger(__name__)
 
 APIDocumentType = TypeVar("APIDocumentType", bound=APIDocument)
 
+ITER_ITEMS_BATCH_SIZE = 500
+
+# all documents are stored with an explicit `deleted` field (see app.commands.backfill_deleted) so this equality
+# filter can be served by the partial indexes defined on the models
+NOT_DELETED_FILTER = {"deleted": False}
+
 
 async def create_item(
     item: APIBaseCreateSchema,
@@ -41,6 +55,7 @@ async def create_items(
         db_object = result_obj(**item.dict())
         if user_field:
             db_object[user_field] = current_user
+        db_object.pre_insert()
         await db_object.io_validate()
         db_objects.append(db_object)
 
@@ -54,7 +69,10 @@ async def create_items(
 
 
 async def get_item_by_id(
-    id_: str, result_obj: Type[APIDocumentType], current_user: Optional[User] = None
+    id_: str,
+    result_obj: Type[APIDocumentType],
+    current_user: Optional[User] = None,
+    projection: Optional[List[str]] = None,
 ) -> APIDocumentType:
     if type(id_) == str:
         try:
@@ -67,28 +85,74 @@ async def get_item_by_id(
         id_ = id_.pk
     else:
         raise Exception(f"unexpected id type: {type(id_)}")
-    item = await result_obj.find_one({"_id": id_})
+    if projection:
+        return await result_obj.find_one({"_id": id_}, _get_projection(projection))
+
+    item = await _find_one_by_id(id_=id_, result_obj=result_obj)
     return item
 
 
-async def get_items(
+async def get_raw_item_by_id(id_: str, result_obj: Type[APIDocumentType]) -> Optional[dict]:
+    return await _find_raw_one_by_id(id_=ObjectId(id_), result_obj=result_obj)
+
+
+def _get_projection(projection: Optional[List[str]]) -> Optional[dict]:
+    # documents loaded with a projection only have the projected fields (and `_id`) set, the rest get their
+    # default values. never commit them back.
+    if not projection:
+        return None
+    return {field: 1 for field in projection}
+
+
+async def _find_raw_one_by_id(id_: ObjectId, result_obj: Type[APIDocumentType]) -> Optional[dict]:
+    cache_ttl = get_document_cache_ttl(result_obj)
+    if not cache_ttl:
+        return await result_obj.collection.find_one({"_id": id_})
+
+    raw_item = await get_cached_document(result_obj, id_)
+    if raw_item is None:
+        raw_item = await result_obj.collection.find_one({"_id": id_})
+        if raw_item is None:
+            return None
+        await set_cached_document(result_obj, raw_item, ttl=cache_ttl)
+
+    return raw_item
+
+
+async def _find_one_by_id(id_: ObjectId, result_obj: Type[APIDocumentType]):
+    raw_item = await _find_raw_one_by_id(id_=id_, result_obj=result_obj)
+    if raw_item is None:
+        return None
+
+    return result_obj.build_from_mongo(raw_item, use_cls=True)
+
+
+def find_items(
     filters: dict,
     result_obj: Type[APIDocumentType],
-    current_user: Optional[User],
     sort_by_field: str = "created_at",
     sort_by_direction: int = -1,
     before: str = None,
     after: str = None,
     limit: int = None,
-) -> List[APIDocumentType]:
+    projection: Optional[List[str]] = None,
+    raw: bool = False,
+    cursor: Optional[PageCursor] = None,
+    include_deleted: bool = False,
+):
+    # always break ties on _id so pages are stable across requests
     sort_filters = [(sort_by_field, sort_by_direction)]
-    deleted_filter = {"$or": [{"deleted": {"$exists": False}}, {"deleted": False}]}
-    filters.update(deleted_filter)
+    if sort_by_field != "_id":
+        sort_filters.append(("_id", sort_by_direction))
+    if not include_deleted:
+        filters.update(NOT_DELETED_FILTER)
 
-    if before:
+    if cursor:
+        filters.update(get_cursor_filter(cursor))
+        sort_filters = get_cursor_sort(cursor)
+    elif before:
         before_filter = {"_id": {"$lt": ObjectId(before)}}
         filters.update(before_filter)
-        sort_filters.append(("_id", sort_by_direction))
     elif after:
         after_filter = {"_id": {"$gt": ObjectId(after)}}
         filters.update(after_filter)
@@ -97,22 +161,135 @@ async def get_items(
     else:
         pass
 
-    item_query = result_obj.find(filters).sort(sort_filters)
+    # raw queries skip umongo entirely and return the stored BSON dicts
+    collection = result_obj.collection if raw else result_obj
+    item_query = collection.find(filters, _get_projection(projection)).sort(sort_filters)
     if limit:
         item_query.limit(limit)
 
+    return item_query
+
+
+async def get_items(
+    filters: dict,
+    result_obj: Type[APIDocumentType],
+    current_user: Optional[User],
+    sort_by_field: str = "created_at",
+    sort_by_direction: int = -1,
+    before: str = None,
+    after: str = None,
+    limit: int = None,
+    projection: Optional[List[str]] = None,
+    cursor: Optional[PageCursor] = None,
+    include_deleted: bool = False,
+) -> List[APIDocumentType]:
+    item_query = find_items(
+        filters=filters,
+        result_obj=result_obj,
+        sort_by_field=sort_by_field,
+        sort_by_direction=sort_by_direction,
+        before=before,
+        after=after,
+        limit=limit,
+        projection=projection,
+        cursor=cursor,
+        include_deleted=include_deleted,
+    )
+
+    items = await item_query.to_list(length=limit)
+    if cursor and cursor.reverse:
+        items.reverse()
+
+    return items
+
+
+async def get_raw_items(
+    filters: dict,
+    result_obj: Type[APIDocumentType],
+    current_user: Optional[User],
+    sort_by_field: str = "created_at",
+    sort_by_direction: int = -1,
+    before: str = None,
+    after: str = None,
+    limit: int = None,
+    projection: Optional[List[str]] = None,
+    cursor: Optional[PageCursor] = None,
+) -> List[dict]:
+    item_query = find_items(
+        filters=filters,
+        result_obj=result_obj,
+        sort_by_field=sort_by_field,
+        sort_by_direction=sort_by_direction,
+        before=before,
+        after=after,
+        limit=limit,
+        projection=projection,
+        raw=True,
+        cursor=cursor,
+    )
+
     items = await item_query.to_list(length=limit)
+    if cursor and cursor.reverse:
+        items.reverse()
 
     return items
 
 
+async def count_items_by_field(
+    filters: dict, result_obj: Type[APIDocumentType], group_by_field: str, current_user: Optional[User] = None
+) -> Dict[Any, int]:
+    pipeline = [
+        {"$match": {**filters, **NOT_DELETED_FILTER}},
+        {"$group": {"_id": f"${group_by_field}", "count": {"$sum": 1}}},
+    ]
+    results = await result_obj.collection.aggregate(pipeline).to_list(length=None)
+    return {result["_id"]: result["count"] for result in results}
+
+
+async def iter_items(
+    filters: dict,
+    result_obj: Type[APIDocumentType],
+    current_user: Optional[User],
+    sort_by_field: str = "_id",
+    sort_by_direction: int = 1,
+    projection: Optional[List[str]] = None,
+    batch_size: int = ITER_ITEMS_BATCH_SIZE,
+) -> AsyncIterator[List[APIDocumentType]]:
+    item_query = find_items(
+        filters=filters,
+        result_obj=result_obj,
+        sort_by_field=sort_by_field,
+        sort_by_direction=sort_by_direction,
+        projection=projection,
+    )
+    item_query.batch_size(batch_size)
+
+    items = []
+    async for item in item_query:
+        items.append(item)
+        if len(items) >= batch_size:
+            yield items
+            items = []
+
+    if items:
+        yield items
+
+
 async def get_item(
-    filters: dict, result_obj: Type[APIDocumentType], current_user: Optional[User] = None
+    filters: dict,
+    result_obj: Type[APIDocumentType],
+    current_user: Optional[User] = None,
+    projection: Optional[List[str]] = None,
 ) -> APIDocumentType:
-    deleted_filter = {"$or": [{"deleted": {"$exists": False}}, {"deleted": False}]}
-    filters.update(deleted_filter)
+    if not projection and list(filters.keys()) == ["_id"] and isinstance(filters["_id"], ObjectId):
+        item = await _find_one_by_id(id_=filters["_id"], result_obj=result_obj)
+        if item and item.deleted:
+            item = None
+        return item
+
+    filters.update(NOT_DELETED_FILTER)
 
-    item = await result_obj.find_one(filters)
+    item = await result_obj.find_one(filters, _get_projection(projection))
     return item
 
 
@@ -128,10 +305,17 @@ async def update_item(item: APIDocumentType, data: dict, current_user: Optional[
     return item
 
 
-async def find_and_update_item(filters: dict, data: dict, result_obj: Type[APIDocumentType]) -> APIDocumentType:
+async def find_and_update_item(
+    filters: dict, data: dict, result_obj: Type[APIDocumentType], touch: bool = True
+) -> APIDocumentType:
+    # untouched writes (presence) keep updated_at, so they don't show up as changes in /ready deltas
+    if touch:
+        data = {**data, "$set": {**data.get("$set", {}), "updated_at": get_mongo_utc_date()}}
     updated_item = await result_obj.collection.find_one_and_update(
         filter=filters, update=data, return_document=ReturnDocument.AFTER
     )
+    if updated_item:
+        await invalidate_cached_documents(result_obj, [updated_item["_id"]])
     return updated_item
 
 
@@ -140,8 +324,14 @@ async def delete_item(item: APIDocumentType) -> APIDocumentType:
 
 
 async def delete_items(filters: dict, result_obj: Type[APIDocumentType], current_user: Optional[User] = None):
+    filters = {**filters, **NOT_DELETED_FILTER}
+    deleted_ids = []
+    if get_document_cache_ttl(result_obj):
+        deleted_ids = await result_obj.collection.distinct("_id", filters)
+
     updated_result = await result_obj.collection.update_many(
-        filter=filters, update={"$set": {"deleted": True}}
+        filter=filters, update={"$set": {"deleted": True, "updated_at": get_mongo_utc_date()}}
     )  # type: UpdateResult
+    await invalidate_cached_documents(result_obj, deleted_ids)
 
     logger.info("%d objects deleted. [object_type=%s", updated_result.modified_count, result_obj.__name__)
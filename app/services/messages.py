@@ -1,23 +1,32 @@
 import http
 import logging
 from datetime import datetime, timezone
-from typing import List, Union
+from typing import Dict, List, Tuple, Union
 from urllib.parse import urlparse
 
+import requests
 from bson import ObjectId
 from fastapi import HTTPException
+from pymongo.errors import ConnectionFailure
 
-from app.helpers.channels import get_channel_online_users, get_channel_users, is_user_in_channel
+from app.helpers.channels import (
+    channel_last_message_writer,
+    get_channel_online_users,
+    get_channel_users,
+    is_user_in_channel,
+)
 from app.helpers.message_utils import blockify_content, get_message_mentions, stringify_blocks
 from app.helpers.queue_utils import queue_bg_task, queue_bg_tasks
+from app.helpers.ready_cache import invalidate_ready_snapshots
+from app.helpers.serializers import get_schema_projection
+from app.helpers.task_queue import register_bg_task
 from app.helpers.ws_events import WebSocketServerEvent
 from app.models.base import APIDocument
 from app.models.channel import Channel, ChannelReadState
 from app.models.message import Message, MessageReaction
 from app.models.user import User
 from app.schemas.channels import ChannelReadStateCreateSchema
-from app.schemas.messages import MessageCreateSchema, MessageUpdateSchema
-from app.services.channels import update_channel_last_message
+from app.schemas.messages import MessageCreateSchema, MessageSchema, MessageUpdateSchema
 from app.services.crud import (
     create_item,
     delete_item,
@@ -25,11 +34,13 @@ from app.services.crud import (
     get_item,
     get_item_by_id,
     get_items,
+    get_raw_item_by_id,
+    get_raw_items,
     update_item,
 )
 from app.services.integrations import get_gif_by_url
 from app.services.users import get_user_by_id
-from app.services.websockets import broadcast_current_user_event, broadcast_message_event, broadcast_users_event
+from app.services.websockets import broadcast_current_user_event, broadcast_message_event, broadcast_per_user_event
 
 logger = logging.getLogger(__name__)
 
@@ -44,19 +55,27 @@ async def create_message(message_model: MessageCreateSchema, current_user: User)
 
     message = await create_item(item=message_model, result_obj=Message, current_user=current_user, user_field="author")
 
+    # coalesced in memory and flushed on an interval, so it doesn't need a background task of its own
+    await channel_last_message_writer.record(message.channel.pk, message.created_at)
+
+    # the background tasks get the documents loaded here instead of refetching them by id
+    channel = await message.channel.fetch()
     bg_tasks = [
-        (broadcast_message_event, (str(message.id), str(current_user.id), WebSocketServerEvent.MESSAGE_CREATE)),
-        (update_channel_last_message, (message.channel, message, current_user)),
+        (
+            broadcast_message_event,
+            (message, current_user, WebSocketServerEvent.MESSAGE_CREATE),
+            {"channel": channel},
+        ),
         (
             broadcast_current_user_event,
             (
-                str(current_user.id),
+                current_user,
                 WebSocketServerEvent.CHANNEL_READ,
-                {"channel": (await message.channel.fetch()).dump(), "read_at": message.created_at.isoformat()},
+                {"channel": channel.dump(), "read_at": message.created_at.isoformat()},
             ),
         ),
-        (post_process_message_creation, (str(message.id), str(current_user.id))),
-        (process_message_mentions, (str(message.id), str(current_user.id))),
+        (post_process_message_creation, (message, current_user)),
+        (process_message_mentions, (message, current_user, channel)),
     ]
 
     # mypy has some issues with changing Callable signatures so we have to exclude that type check:
@@ -85,9 +104,7 @@ async def update_message(message_id: str, update_data: MessageUpdateSchema, curr
 
     updated_item = await update_item(item=message, data=data)
 
-    await queue_bg_task(
-        broadcast_message_event, str(message.id), str(current_user.id), WebSocketServerEvent.MESSAGE_UPDATE
-    )
+    await queue_bg_task(broadcast_message_event, updated_item, current_user, WebSocketServerEvent.MESSAGE_UPDATE)
 
     return updated_item
 
@@ -103,14 +120,12 @@ async def delete_message(message_id: str, current_user: User):
     if not can_delete:
         raise HTTPException(status_code=http.HTTPStatus.FORBIDDEN)
 
-    await queue_bg_task(
-        broadcast_message_event, str(message.id), str(current_user.id), WebSocketServerEvent.MESSAGE_REMOVE
-    )
+    await queue_bg_task(broadcast_message_event, message, current_user, WebSocketServerEvent.MESSAGE_REMOVE)
 
     await delete_item(item=message)
 
 
-async def get_messages(channel_id: str, current_user: User, **common_params) -> List[Message]:
+async def _get_messages_filters(channel_id: str, current_user: User) -> dict:
     channel = await get_item_by_id(id_=channel_id, result_obj=Channel, current_user=current_user)
 
     filters = {}
@@ -122,6 +137,12 @@ async def get_messages(channel_id: str, current_user: User, **common_params) ->
             raise HTTPException(status_code=http.HTTPStatus.FORBIDDEN)
         filters = {"channel": channel.id}
 
+    return filters
+
+
+async def get_messages(channel_id: str, current_user: User, **common_params) -> List[Message]:
+    filters = await _get_messages_filters(channel_id, current_user=current_user)
+
     around_id = common_params.pop("around", None)
     if around_id:
         return await _get_around_messages(
@@ -132,11 +153,29 @@ async def get_messages(channel_id: str, current_user: User, **common_params) ->
     return messages
 
 
-async def _get_around_messages(
-    around_message_id: str, filters: dict, current_user: User, **common_params
-) -> List[Message]:
-    around_message = await get_item_by_id(id_=around_message_id, result_obj=Message, current_user=current_user)
+async def get_raw_messages(channel_id: str, current_user: User, **common_params) -> List[dict]:
+    filters = await _get_messages_filters(channel_id, current_user=current_user)
+    projection = get_schema_projection(MessageSchema, Message)
+    sort_by_field = common_params.get("sort_by_field")
+    if sort_by_field and sort_by_field not in projection:
+        projection = projection + [sort_by_field]
+
+    around_id = common_params.pop("around", None)
+    if around_id:
+        return await _get_raw_around_messages(
+            around_message_id=around_id,
+            filters=filters,
+            current_user=current_user,
+            projection=projection,
+            **common_params,
+        )
+
+    return await get_raw_items(
+        filters=filters, result_obj=Message, current_user=current_user, projection=projection, **common_params
+    )
+
 
+def _get_around_params(around_message_id: str, **common_params) -> Tuple[dict, dict]:
     limit = common_params.get("limit", 50)
     before_count = limit // 2
     after_count = limit // 2
@@ -144,15 +183,39 @@ async def _get_around_messages(
         after_count -= 1
 
     before_params = {**common_params, "limit": before_count, "before": around_message_id}
-    before_messages = await get_items(filters=filters, result_obj=Message, current_user=current_user, **before_params)
-
     after_params = {**common_params, "limit": after_count, "after": around_message_id}
+    return before_params, after_params
+
+
+async def _get_around_messages(
+    around_message_id: str, filters: dict, current_user: User, **common_params
+) -> List[Message]:
+    around_message = await get_item_by_id(id_=around_message_id, result_obj=Message, current_user=current_user)
+    before_params, after_params = _get_around_params(around_message_id, **common_params)
+
+    before_messages = await get_items(filters=filters, result_obj=Message, current_user=current_user, **before_params)
     after_messages = await get_items(filters=filters, result_obj=Message, current_user=current_user, **after_params)
 
     messages = after_messages[::-1] + [around_message] + before_messages
     return messages
 
 
+async def _get_raw_around_messages(
+    around_message_id: str, filters: dict, current_user: User, **common_params
+) -> List[dict]:
+    around_message = await get_raw_item_by_id(id_=around_message_id, result_obj=Message)
+    before_params, after_params = _get_around_params(around_message_id, **common_params)
+
+    before_messages = await get_raw_items(
+        filters=filters, result_obj=Message, current_user=current_user, **before_params
+    )
+    after_messages = await get_raw_items(filters=filters, result_obj=Message, current_user=current_user, **after_params)
+
+    around_messages = [around_message] if around_message else []
+    messages = after_messages[::-1] + around_messages + before_messages
+    return messages
+
+
 async def get_message(channel_id: str, message_id: str, current_user: User) -> Message:
     channel = await get_item_by_id(id_=channel_id, result_obj=Channel, current_user=current_user)
 
@@ -202,8 +265,8 @@ async def add_reaction_to_message(message_id, reaction_emoji: str, current_user:
         await message.commit()
         await queue_bg_task(
             broadcast_message_event,
-            str(message.id),
-            str(current_user.id),
+            message,
+            current_user,
             WebSocketServerEvent.MESSAGE_REACTION_ADD,
             {"reaction": reaction.dump(), "user": str(current_user.id)},
         )
@@ -243,8 +306,8 @@ async def remove_reaction_from_message(message_id, reaction_emoji: str, current_
         await message.commit()
         await queue_bg_task(
             broadcast_message_event,
-            str(message.id),
-            str(current_user.id),
+            message,
+            current_user,
             WebSocketServerEvent.MESSAGE_REACTION_REMOVE,
             {"reaction": reaction.dump(), "user": str(current_user.id)},
         )
@@ -252,9 +315,8 @@ async def remove_reaction_from_message(message_id, reaction_emoji: str, current_
     return message
 
 
-async def post_process_message_creation(message_id: str, user_id: str):
-    user = await get_user_by_id(user_id=user_id)
-    message = await get_item_by_id(id_=message_id, result_obj=Message, current_user=user)
+@register_bg_task(max_attempts=3, retry_on=(ConnectionFailure, requests.ConnectionError, requests.Timeout))
+async def post_process_message_creation(message: Union[Message, APIDocument], current_user: User):
     data = {}
 
     # If a gif, embed it
@@ -269,13 +331,11 @@ async def post_process_message_creation(message_id: str, user_id: str):
     if not data:
         return
 
-    await update_item(item=message, data=data, current_user=user)
+    await update_item(item=message, data=data, current_user=current_user)
 
 
-async def process_message_mentions(message_id: str, user_id: str):
-    current_user = await get_user_by_id(user_id=user_id)
-    message = await get_item_by_id(id_=message_id, result_obj=Message, current_user=current_user)
-    channel = await message.channel.fetch()
+@register_bg_task(max_concurrency=20, max_attempts=3, retry_on=(ConnectionFailure,))
+async def process_message_mentions(message: Union[Message, APIDocument], current_user: User, channel: Channel):
     mentions = await get_message_mentions(message)
     if not mentions:
         return
@@ -305,31 +365,49 @@ async def process_message_mentions(message_id: str, user_id: str):
         logger.debug("no users to notify")
         return
 
+    mention_counts: Dict[ObjectId, int] = {}
     for user in users_to_notify:
         user_in_channel = await is_user_in_channel(user=user, channel=channel)
         if not user_in_channel:
             continue
 
+        # guarded on the message id, a retry or replay of this task only counts users it hasn't counted yet
         read_state = await find_and_update_item(
-            filters={"user": user.pk, "channel": channel.pk},
-            data={"$inc": {"mention_count": 1}},
+            filters={"user": user.pk, "channel": channel.pk, "counted_mentions": {"$ne": message.pk}},
+            data={"$inc": {"mention_count": 1}, "$push": {"counted_mentions": message.pk}},
             result_obj=ChannelReadState,
         )
+        if read_state:
+            mention_counts[user.pk] = read_state["mention_count"]
+            continue
+
+        counted_read_state = await get_item(
+            filters={"user": user.pk, "channel": channel.pk}, result_obj=ChannelReadState, current_user=user
+        )
+        if counted_read_state:
+            mention_counts[user.pk] = counted_read_state.mention_count
+            continue
 
-        if not read_state:
-            read_state_model = ChannelReadStateCreateSchema(
-                channel=str(channel.id),
-                last_read_at=datetime.fromtimestamp(0, tz=timezone.utc),
-                mention_count=1,
-            )
-            await create_item(read_state_model, result_obj=ChannelReadState, current_user=user)
+        read_state_model = ChannelReadStateCreateSchema(
+            channel=str(channel.id),
+            last_read_at=datetime.fromtimestamp(0, tz=timezone.utc),
+            mention_count=1,
+            counted_mentions=[str(message.pk)],
+        )
+        await create_item(read_state_model, result_obj=ChannelReadState, current_user=user)
+        mention_counts[user.pk] = 1
 
         # TODO: Create mention activity entry
 
-    await broadcast_users_event(
-        users=users_to_notify,
+    await invalidate_ready_snapshots(user_ids=[user.pk for user in users_to_notify])
+
+    message_data = message.dump()
+    await broadcast_per_user_event(
         event=WebSocketServerEvent.NOTIFY_USER_MENTION,
-        custom_data={"message": message.dump()},
+        users_data=[
+            (user, {"message": message_data, "mention_count": mention_counts.get(user.pk)})
+            for user in {user.pk: user for user in users_to_notify}.values()
+        ],
     )
 
     # TODO: Broadcast push notifications
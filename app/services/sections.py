@@ -5,6 +5,7 @@ from fastapi import HTTPException
 from starlette import status
 
 from app.helpers.queue_utils import queue_bg_task
+from app.helpers.ready_cache import invalidate_ready_snapshots
 from app.helpers.ws_events import WebSocketServerEvent
 from app.models.section import Section
 from app.models.server import Server
@@ -34,11 +35,12 @@ async def create_section(server_id: str, section_model: SectionCreateSchema, cur
     # TODO: verify channels belong to server?
 
     section = await create_item(section_model, result_obj=Section, current_user=current_user, user_field=None)
+    await invalidate_ready_snapshots(server_ids=[server.pk])
 
     await queue_bg_task(
         broadcast_server_event,
-        server_id,
-        str(current_user.id),
+        server,
+        current_user,
         WebSocketServerEvent.SERVER_SECTION_CREATE,
         {"server": server_id, "section": await section.to_dict()},
     )
@@ -58,11 +60,12 @@ async def update_section(section_id: str, update_data: SectionUpdateSchema, curr
     # TODO: verify channels belong to server?
 
     updated_section = await update_item(section, data=data, current_user=current_user)
+    await invalidate_ready_snapshots(server_ids=[server.pk])
 
     await queue_bg_task(
         broadcast_server_event,
-        str(server.pk),
-        str(current_user.id),
+        server,
+        current_user,
         WebSocketServerEvent.SERVER_SECTION_UPDATE,
         {"server": str(server.pk), "section": await updated_section.to_dict()},
     )
@@ -85,10 +88,12 @@ async def update_server_sections(server_id: str, sections: List[SectionCreateSch
         new_section = await create_item(section_model, result_obj=Section, current_user=current_user, user_field=None)
         final_sections.append(new_section)
 
+    await invalidate_ready_snapshots(server_ids=[server.pk])
+
     await queue_bg_task(
         broadcast_server_event,
-        server_id,
-        str(current_user.id),
+        server,
+        current_user,
         WebSocketServerEvent.SERVER_SECTIONS_UPDATE,
         {"server": server_id, "sections": [await section.to_dict() for section in final_sections]},
     )
@@ -104,10 +109,12 @@ async def delete_section(section_id: str, current_user: User):
 
     await queue_bg_task(
         broadcast_server_event,
-        str(server.pk),
-        str(current_user.id),
+        server,
+        current_user,
         WebSocketServerEvent.SERVER_SECTION_DELETE,
         {"server": str(server.pk), "section": await section.to_dict()},
     )
 
-    return await delete_item(item=section)
+    deleted_section = await delete_item(item=section)
+    await invalidate_ready_snapshots(server_ids=[server.pk])
+    return deleted_section
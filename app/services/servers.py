@@ -1,12 +1,19 @@
-from typing import List, Union
+import logging
+from typing import AsyncIterator, List, Optional, Union
 
 from bson import ObjectId
 from fastapi import HTTPException
+from redis.exceptions import RedisError
 from starlette import status
 
 from app.helpers.guild_xyz import is_user_eligible_for_guild
+from app.helpers.loaders import fetch_references
+from app.helpers.pagination import PageCursor
 from app.helpers.permissions import user_belongs_to_server
+from app.helpers.presence import add_server_user
 from app.helpers.queue_utils import queue_bg_task
+from app.helpers.ready_cache import invalidate_ready_snapshots
+from app.helpers.serializers import get_schema_projection
 from app.helpers.ws_events import WebSocketServerEvent
 from app.models.base import APIDocument
 from app.models.channel import Channel
@@ -18,13 +25,26 @@ from app.schemas.servers import (
     AllowlistJoinRuleCreateSchema,
     GuildXYZJoinRuleCreateSchema,
     ServerCreateSchema,
+    ServerMemberSchema,
+    ServerSchema,
     ServerUpdateSchema,
 )
 from app.services.channels import create_server_channel
-from app.services.crud import create_item, get_item, get_item_by_id, get_items, update_item
+from app.services.crud import (
+    count_items_by_field,
+    create_item,
+    get_item,
+    get_item_by_id,
+    get_items,
+    get_raw_items,
+    iter_items,
+    update_item,
+)
 from app.services.messages import create_message
 from app.services.websockets import broadcast_server_event
 
+logger = logging.getLogger(__name__)
+
 
 async def create_server(server_model: ServerCreateSchema, current_user: User) -> Union[Server, APIDocument]:
     created_server = await create_item(server_model, result_obj=Server, current_user=current_user, user_field="owner")
@@ -47,7 +67,7 @@ async def is_eligible_to_join_server(server_id: str, current_user: User):
 
     user_is_allowed_in = False
 
-    joining_rules = [await role.fetch() for role in server.join_rules]
+    joining_rules = await fetch_references(server.join_rules)
     for rule in joining_rules:  # type: ServerJoinRule
         if user_is_allowed_in:
             break
@@ -80,11 +100,16 @@ async def join_server(server_id: str, current_user: User, ignore_joining_rules:
 
     member = ServerMember(server=server, user=current_user)
     await member.commit()
+    await invalidate_ready_snapshots(server_ids=[server.pk], user_ids=[current_user.pk])
+    try:
+        await add_server_user(server.pk, current_user.pk)
+    except RedisError:
+        logger.exception("Problem adding user presence. [server_id=%s, user_id=%s]", server_id, str(current_user.pk))
 
     await queue_bg_task(
         broadcast_server_event,
-        str(server.id),
-        str(current_user.id),
+        server,
+        current_user,
         WebSocketServerEvent.SERVER_USER_JOINED,
         {"user": current_user.dump(), "member": member.dump()},
     )
@@ -105,33 +130,86 @@ async def get_user_servers(current_user: User) -> List[Server]:
         sort_by_field="joined_at",
         sort_by_direction=1,
     )
-    return [await member.server.fetch() for member in server_members]
+    return await fetch_references([member.server for member in server_members])
+
+
+async def iter_server_members(server_id: str, current_user: User) -> AsyncIterator[List[ServerMember]]:
+    if not await user_belongs_to_server(user=current_user, server_id=server_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Missing permissions")
+
+    async for server_members in iter_items(
+        {"server": ObjectId(server_id)}, result_obj=ServerMember, current_user=current_user
+    ):
+        yield server_members
 
 
 async def get_server_members(server_id: str, current_user: User):
+    server_members = []
+    async for members in iter_server_members(server_id=server_id, current_user=current_user):
+        server_members.extend(members)
+    return server_members
+
+
+async def get_server_members_page(
+    server_id: str, current_user: User, limit: int, cursor: Optional[PageCursor] = None
+) -> List[dict]:
     if not await user_belongs_to_server(user=current_user, server_id=server_id):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Missing permissions")
 
-    server_members = await get_items(
-        {"server": ObjectId(server_id)}, result_obj=ServerMember, current_user=current_user, limit=None
+    return await get_raw_items(
+        {"server": ObjectId(server_id)},
+        result_obj=ServerMember,
+        current_user=current_user,
+        sort_by_field="_id",
+        sort_by_direction=1,
+        limit=limit,
+        projection=get_schema_projection(ServerMemberSchema, ServerMember),
+        cursor=cursor,
     )
-    return server_members
 
 
 async def get_servers(current_user: User):
     # TODO: add flag to filter out private/non-exposed servers
     servers = await get_items(filters={}, result_obj=Server, current_user=current_user)
 
+    member_counts = await count_items_by_field(
+        filters={"server": {"$in": [server.pk for server in servers]}},
+        result_obj=ServerMember,
+        group_by_field="server",
+        current_user=current_user,
+    )
+
     resp_servers = []
     for server in servers:
-        server_members = await get_items(
-            {"server": server.pk}, result_obj=ServerMember, current_user=current_user, limit=None
-        )
-        resp_servers.append({**server.dump(), "member_count": len(server_members)})
+        resp_servers.append({**server.dump(), "member_count": member_counts.get(server.pk, 0)})
 
     return resp_servers
 
 
+async def get_servers_page(current_user: User, limit: int, cursor: Optional[PageCursor] = None) -> List[dict]:
+    servers = await get_raw_items(
+        filters={},
+        result_obj=Server,
+        current_user=current_user,
+        sort_by_field="_id",
+        sort_by_direction=1,
+        limit=limit,
+        projection=get_schema_projection(ServerSchema, Server),
+        cursor=cursor,
+    )
+
+    member_counts = await count_items_by_field(
+        filters={"server": {"$in": [server["_id"] for server in servers]}},
+        result_obj=ServerMember,
+        group_by_field="server",
+        current_user=current_user,
+    )
+    for server in servers:
+        server["member_count"] = member_counts.get(server["_id"], 0)
+
+    return servers
+
+
 async def update_server(server_id: str, update_data: ServerUpdateSchema, current_user: User):
     server = await get_item_by_id(id_=server_id, result_obj=Server, current_user=current_user)
     if server.owner != current_user:
@@ -170,11 +248,12 @@ async def update_server(server_id: str, update_data: ServerUpdateSchema, current
             )
 
     updated_item = await update_item(item=server, data=data)
+    await invalidate_ready_snapshots(server_ids=[server.pk])
 
     await queue_bg_task(
         broadcast_server_event,
-        server_id,
-        str(current_user.id),
+        server,
+        current_user,
         WebSocketServerEvent.SERVER_UPDATE,
         {"server": server_id},
     )
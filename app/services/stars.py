@@ -4,11 +4,13 @@ from typing import List, Optional, Union
 from bson import ObjectId
 from fastapi import HTTPException
 
+from app.helpers.pagination import PageCursor
+from app.helpers.serializers import get_schema_projection
 from app.models.base import APIDocument
 from app.models.star import Star
 from app.models.user import User
-from app.schemas.stars import StarCreateSchema
-from app.services.crud import create_item, delete_item, get_item_by_id, get_items
+from app.schemas.stars import StarCreateSchema, StarSchema
+from app.services.crud import create_item, delete_item, get_item_by_id, get_items, get_raw_items
 
 
 async def create_star(star_model: StarCreateSchema, current_user: User) -> Union[Star, APIDocument]:
@@ -44,6 +46,24 @@ async def get_stars(current_user: User, stars_type: Optional[str] = None) -> Lis
     return await get_items(filters=filters, result_obj=Star, current_user=current_user)
 
 
+async def get_stars_page(
+    current_user: User, limit: int, cursor: Optional[PageCursor] = None, stars_type: Optional[str] = None
+) -> List[dict]:
+    filters = {"user": current_user.pk}
+    if stars_type:
+        filters["type"] = stars_type
+    return await get_raw_items(
+        filters=filters,
+        result_obj=Star,
+        current_user=current_user,
+        sort_by_field="_id",
+        sort_by_direction=1,
+        limit=limit,
+        projection=get_schema_projection(StarSchema, Star),
+        cursor=cursor,
+    )
+
+
 async def delete_star(star_id: str, current_user: User):
     star = await get_item_by_id(id_=star_id, result_obj=Star, current_user=current_user)
     if not star:
@@ -7,6 +7,7 @@ from fastapi import HTTPException
 
 from app.helpers.pfp import extract_contract_and_token_from_string, upload_pfp_url_and_update_profile
 from app.helpers.queue_utils import queue_bg_task
+from app.helpers.ready_cache import invalidate_profile_ready_snapshots
 from app.helpers.w3 import get_nft, get_nft_image_url, get_wallet_short_name, verify_token_ownership
 from app.helpers.ws_events import WebSocketServerEvent
 from app.models.base import APIDocument
@@ -130,18 +131,19 @@ async def update_user_profile(
     updated_item = await update_item(item=profile, data=data)
 
     if data:
+        await invalidate_profile_ready_snapshots(profile)
         if server_id:
             await queue_bg_task(
                 broadcast_server_event,
                 server_id,
-                str(current_user.id),
+                current_user,
                 WebSocketServerEvent.SERVER_PROFILE_UPDATE,
                 {**data, "user": str(current_user.id), "member": str(profile.id)},
             )
         else:
             await queue_bg_task(
                 broadcast_user_servers_event,
-                str(current_user.id),
+                current_user,
                 WebSocketServerEvent.USER_PROFILE_UPDATE,
                 {**data, "user": str(current_user.id)},
             )
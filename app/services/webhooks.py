@@ -1,12 +1,30 @@
 import json
 import logging
-
-from app.helpers.queue_utils import queue_bg_task
+from typing import List
+
+from bson import ObjectId
+from pymongo.errors import ConnectionFailure
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import RedisError
+
+from app.config import get_settings
+from app.helpers.cache_utils import cache
+from app.helpers.presence import add_user_channel, remove_user_channel
+from app.helpers.queue_utils import queue_bg_task, schedule_bg_task
+from app.helpers.task_queue import register_bg_task
+from app.helpers.throttle import (
+    PRESENCE_PENDING_STATUS_KEY,
+    PRESENCE_SENT_STATUS_KEY,
+    PRESENCE_SENT_STATUS_TTL_SECONDS,
+    PRESENCE_THROTTLE_KEY,
+    acquire_throttle,
+)
 from app.helpers.ws_events import WebSocketServerEvent
+from app.models.server import ServerMember
 from app.models.user import User
 from app.schemas.ws_events import CreateMarkChannelReadEvent
 from app.services.channels import update_channels_read_state
-from app.services.crud import update_item
+from app.services.crud import find_and_update_item, get_items
 from app.services.users import get_user_by_id
 from app.services.websockets import broadcast_connection_ready, broadcast_user_servers_event
 
@@ -22,6 +40,7 @@ async def _get_user_from_event(event: dict) -> User:
     return user
 
 
+@register_bg_task(max_concurrency=20, max_attempts=3, retry_on=(ConnectionFailure, RedisConnectionError))
 async def handle_pusher_event(event: dict):
     event_name = event["name"]
     if event_name == "client_event":
@@ -60,29 +79,80 @@ async def handle_pusher_client_event(event: dict):
     logger.info("client event handled successfully. [client_event=%s, channel=%s]", client_event, channel_name)
 
 
+async def _get_user_server_ids(current_user: User) -> List[ObjectId]:
+    server_memberships = await get_items(
+        {"user": current_user.pk}, result_obj=ServerMember, current_user=current_user, limit=None, projection=["server"]
+    )
+    return [member.server.pk for member in server_memberships]
+
+
+@register_bg_task
+async def broadcast_presence_updates(user_id: str):
+    # runs when the window closes and only broadcasts the latest status, so a flap that ends where it started within
+    # the window isn't broadcast at all. the window is released before reading, a change after that opens a new one
+    pending_key = PRESENCE_PENDING_STATUS_KEY.format(user_id=user_id)
+    sent_key = PRESENCE_SENT_STATUS_KEY.format(user_id=user_id)
+    await cache.client.delete(PRESENCE_THROTTLE_KEY.format(user_id=user_id))
+    pending_status, sent_status = await cache.client.mget(pending_key, sent_key)
+    if not pending_status or pending_status == sent_status:
+        return
+
+    # only marked as sent once it went out, a failed broadcast is tried again on the next change
+    await broadcast_user_servers_event(user_id, WebSocketServerEvent.USER_PRESENCE_UPDATE, {"status": pending_status})
+    await cache.client.set(sent_key, pending_status, ex=PRESENCE_SENT_STATUS_TTL_SECONDS)
+
+
+async def _queue_presence_update(current_user: User, status: str):
+    user_id = str(current_user.pk)
+    try:
+        await cache.client.set(
+            PRESENCE_PENDING_STATUS_KEY.format(user_id=user_id), status, ex=PRESENCE_SENT_STATUS_TTL_SECONDS
+        )
+    except RedisError:
+        logger.exception("Problem queueing presence update, broadcasting it now. [user_id=%s]", user_id)
+        await queue_bg_task(
+            broadcast_user_servers_event, user_id, WebSocketServerEvent.USER_PRESENCE_UPDATE, {"status": status}
+        )
+        return
+
+    # the first change opens the window and schedules its flush. the flush releases the key, the longer ttl only
+    # matters if the process that scheduled it dies
+    window_ms = get_settings().presence_throttle_ms
+    if await acquire_throttle(PRESENCE_THROTTLE_KEY.format(user_id=user_id), window_ms * 2):
+        schedule_bg_task(window_ms / 1000, broadcast_presence_updates, user_id)
+
+
 async def process_channel_occupied_event(channel_name: str, current_user: User):
     update_data = {"$addToSet": {"online_channels": channel_name}, "$set": {"status": "online"}}
-    await User.collection.update_one(filter={"_id": current_user.pk}, update=update_data)
-    await queue_bg_task(
-        broadcast_user_servers_event,
-        str(current_user.id),
-        WebSocketServerEvent.USER_PRESENCE_UPDATE,
-        {"status": "online"},
-    )
+    await find_and_update_item(filters={"_id": current_user.pk}, data=update_data, result_obj=User, touch=False)
+    try:
+        server_ids = await _get_user_server_ids(current_user)
+        await add_user_channel(current_user.pk, channel_name=channel_name, server_ids=server_ids)
+    except RedisError:
+        logger.exception("Problem adding user presence. [user_id=%s, channel=%s]", str(current_user.pk), channel_name)
+
+    await _queue_presence_update(current_user, status="online")
 
 
 async def process_channel_vacated_event(channel_name: str, current_user: User):
     update_data = {"$pull": {"online_channels": channel_name}}
-    await User.collection.update_one(filter={"_id": current_user.pk}, update=update_data)
+    await find_and_update_item(filters={"_id": current_user.pk}, data=update_data, result_obj=User, touch=False)
+    try:
+        server_ids = await _get_user_server_ids(current_user)
+        await remove_user_channel(current_user.pk, channel_name=channel_name, server_ids=server_ids)
+    except RedisError:
+        logger.exception("Problem removing user presence. [user_id=%s, channel=%s]", str(current_user.pk), channel_name)
+
+    # only goes offline if no channel was added back in the meantime
+    offline_user = await find_and_update_item(
+        filters={"_id": current_user.pk, "online_channels": {"$size": 0}},
+        data={"$set": {"status": "offline"}},
+        result_obj=User,
+        touch=False,
+    )
     await current_user.reload()
-    if len(current_user.online_channels) == 0:
-        await update_item(item=current_user, data={"status": "offline"})
-        await queue_bg_task(
-            broadcast_user_servers_event,
-            str(current_user.id),
-            WebSocketServerEvent.USER_PRESENCE_UPDATE,
-            {"status": "offline"},
-        )
+    if offline_user:
+        await _queue_presence_update(current_user, status="offline")
 
 
 async def process_channel_mark_read_event(event_model: CreateMarkChannelReadEvent, current_user: User):
@@ -1,76 +1,197 @@
+import asyncio
 import logging
-from typing import List, Optional
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
 
+import aiohttp
+from bson import ObjectId
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import RedisError
 from sentry_sdk import capture_exception
 
-from app.helpers.websockets import pusher_client
+from app.config import get_settings
+from app.helpers.metrics import record_pusher_call
+from app.helpers.presence import (
+    get_online_channels_by_user,
+    get_servers_online_user_channels,
+    get_users_online_channels,
+)
+from app.helpers.task_queue import PartialTaskError, register_bg_task
+from app.helpers.websockets import PusherServerError, get_broadcast_transport, pusher_session_pool
 from app.helpers.ws_events import WebSocketServerEvent
+from app.models.base import APIDocument
 from app.models.channel import Channel
 from app.models.message import Message
 from app.models.server import Server, ServerMember
 from app.models.user import User
-from app.services.crud import get_item_by_id, get_items
+from app.services.crud import get_item_by_id, get_items, iter_items
 
 logger = logging.getLogger(__name__)
 
+PUSHER_MAX_CHANNELS_PER_TRIGGER = 90
+# pusher's default limit for the batch events endpoint
+PUSHER_MAX_EVENTS_PER_BATCH = 10
+PUSHER_RETRY_BACKOFF_SECONDS = 0.2
+PUSHER_RATE_LIMIT_BACKOFF_SECONDS = 1
+# 5xx/429 responses and connection errors. other 4xx responses won't succeed on a retry
+RETRYABLE_PUSHER_ERRORS = (PusherServerError, aiohttp.ClientError, asyncio.TimeoutError, RedisConnectionError)
+
+
+class BroadcastError(PartialTaskError):
+    # raised once a trigger's own retries are exhausted. only the batches that failed on a transient error go to the
+    # dead letter collection, so a replay doesn't send the event twice to everyone else
+    pass
+
 
 async def _get_users_online_channels(users: List[User]):
+    try:
+        return list(await get_users_online_channels([user.pk for user in users]))
+    except RedisError:
+        logger.exception("Problem reading presence, falling back to user documents.")
+
     channels = []
     for user in users:  # type: User
         channels.extend(user.online_channels)
     return list(set(channels))
 
 
-async def get_server_online_channels(server: Server, current_user: Optional[User]):
-    user_ids = set()
-    members = await get_items(
-        filters={"server": server.pk}, result_obj=ServerMember, current_user=current_user, limit=None
-    )
-    for member in members:
-        user_ids.add(member.user.pk)
-
+async def _get_mongo_user_ids_online_channels(user_ids: List[ObjectId], current_user: Optional[User]) -> Set[str]:
     users = await get_items(
-        filters={"_id": {"$in": list(user_ids)}}, result_obj=User, current_user=current_user, limit=None
+        filters={"_id": {"$in": user_ids}},
+        result_obj=User,
+        current_user=current_user,
+        limit=None,
+        projection=["online_channels"],
     )
+    channels = []
+    for user in users:  # type: User
+        channels.extend(user.online_channels)
+    return set(channels)
+
+
+async def _get_user_ids_online_channels(user_ids: List[ObjectId], current_user: Optional[User]) -> Set[str]:
+    try:
+        return await get_users_online_channels(user_ids)
+    except RedisError:
+        logger.exception("Problem reading presence, falling back to mongo.")
+
+    return await _get_mongo_user_ids_online_channels(user_ids, current_user=current_user)
+
 
-    return await _get_users_online_channels(users)
+async def _get_members_online_channels(server_ids: List[ObjectId], current_user: Optional[User]) -> List[str]:
+    try:
+        return list(await get_servers_online_user_channels(server_ids))
+    except RedisError:
+        logger.exception("Problem reading presence, falling back to mongo. [server_ids=%s]", server_ids)
+
+    channels: Set[str] = set()
+    async for members in iter_items(
+        filters={"server": {"$in": server_ids}},
+        result_obj=ServerMember,
+        current_user=current_user,
+        projection=["user"],
+    ):
+        user_ids = list({member.user.pk for member in members})
+        channels.update(await _get_mongo_user_ids_online_channels(user_ids, current_user=current_user))
+
+    return list(channels)
+
+
+async def get_server_online_channels(server: Server, current_user: Optional[User]):
+    return await _get_members_online_channels([server.pk], current_user=current_user)
 
 
 async def get_channel_online_channels(channel: Channel, current_user: Optional[User]):
-    user_ids = set()
     if channel.kind == "dm":
-        for member in channel.members:
-            user_ids.add(member.pk)
+        user_ids = list({member.pk for member in channel.members})
+        return list(await _get_user_ids_online_channels(user_ids, current_user=current_user))
     elif channel.kind == "server":
-        members = await get_items(
-            filters={"server": channel.server.pk}, result_obj=ServerMember, current_user=current_user, limit=None
-        )
-        for member in members:
-            user_ids.add(member.user.pk)
-
-    users = await get_items(
-        filters={"_id": {"$in": list(user_ids)}}, result_obj=User, current_user=current_user, limit=None
-    )
+        return await _get_members_online_channels([channel.server.pk], current_user=current_user)
 
-    return await _get_users_online_channels(users)
+    return []
 
 
 async def get_servers_online_channels(servers: List[Server], current_user: Optional[User]):
-    user_ids = set()
-    members = []
-    for server in servers:
-        server_members = await get_items(
-            filters={"server": server.pk}, result_obj=ServerMember, current_user=current_user, limit=None
-        )
-        members.extend(server_members)
-        for member in server_members:
-            user_ids.add(member.user.pk)
+    return await _get_members_online_channels([server.pk for server in servers], current_user=current_user)
 
-    users = await get_items(
-        filters={"_id": {"$in": list(user_ids)}}, result_obj=User, current_user=current_user, limit=None
+
+async def _send_pusher_request(
+    send: Callable[[], Awaitable[Any]], event_name: str, semaphore: asyncio.Semaphore
+) -> Optional[Exception]:
+    # returns the error the request finally failed with, if any
+    retries = get_settings().pusher_trigger_retries
+    for attempt in range(retries + 1):
+        backoff_seconds = PUSHER_RETRY_BACKOFF_SECONDS
+        try:
+            async with semaphore:
+                record_pusher_call()
+                await send()
+            return None
+        except RETRYABLE_PUSHER_ERRORS as e:
+            if attempt == retries:
+                logger.exception("Problem broadcasting event to Pusher channel. [event_name=%s]", event_name)
+                capture_exception(e)
+                return e
+            logger.warning("Retrying Pusher trigger. [event_name=%s, attempt=%d]", event_name, attempt + 1)
+            if isinstance(e, PusherServerError) and e.status == 429:
+                backoff_seconds = PUSHER_RATE_LIMIT_BACKOFF_SECONDS
+        except Exception as e:
+            logger.exception("Problem broadcasting event to Pusher channel. [event_name=%s]", event_name)
+            capture_exception(e)
+            return e
+
+        await asyncio.sleep(backoff_seconds * 2**attempt)
+
+    return None
+
+
+async def _send_pusher_requests(
+    event_name: str, sends: List[Callable[[], Awaitable[Any]]], resend_tasks: List[Tuple[Callable, tuple, dict]]
+):
+    semaphore = pusher_session_pool.get_semaphore()
+    errors = await asyncio.gather(*[_send_pusher_request(send, event_name, semaphore) for send in sends])
+    failed_count = len([error for error in errors if error])
+    if failed_count:
+        # other 4xx responses, e.g. a 413 for an oversized payload, would fail the same way on a replay
+        remaining = [f for f, error in zip(resend_tasks, errors) if isinstance(error, RETRYABLE_PUSHER_ERRORS)]
+        raise BroadcastError(f"{failed_count} of {len(sends)} batches failed. [event_name={event_name}]", remaining)
+    logger.info("Event broadcast successful. [event_name=%s]", event_name)
+
+
+async def _trigger_channels(event_name: str, pusher_channels: List[str], data: dict):
+    transport = get_broadcast_transport()
+    chunks = [
+        pusher_channels[index : index + PUSHER_MAX_CHANNELS_PER_TRIGGER]
+        for index in range(0, len(pusher_channels), PUSHER_MAX_CHANNELS_PER_TRIGGER)
+    ]
+    await _send_pusher_requests(
+        event_name,
+        [partial(transport.trigger, chunk, event_name, data) for chunk in chunks],
+        [(resend_broadcast_event, (event_name, chunk, data), {}) for chunk in chunks],
     )
 
-    return await _get_users_online_channels(users)
+
+async def _trigger_events(event_name: str, events: List[dict]):
+    transport = get_broadcast_transport()
+    chunks = [
+        events[index : index + PUSHER_MAX_EVENTS_PER_BATCH]
+        for index in range(0, len(events), PUSHER_MAX_EVENTS_PER_BATCH)
+    ]
+    await _send_pusher_requests(
+        event_name,
+        [partial(transport.trigger_batch, chunk) for chunk in chunks],
+        [(resend_broadcast_events, (event_name, chunk), {}) for chunk in chunks],
+    )
+
+
+@register_bg_task
+async def resend_broadcast_event(event_name: str, pusher_channels: List[str], data: dict):
+    await _trigger_channels(event_name, pusher_channels, data)
+
+
+@register_bg_task
+async def resend_broadcast_events(event_name: str, events: List[dict]):
+    await _trigger_events(event_name, events)
 
 
 async def pusher_broadcast_messages(
@@ -111,33 +232,67 @@ async def pusher_broadcast_messages(
     if not pusher_channels:
         logger.debug("no online pusher channels. [scope=%s, event=%s]", scope, event)
 
-    event_name: str = event.value
-    has_errors = False
+    await _trigger_channels(event.value, pusher_channels, data)
+
+
+async def _get_current_user(current_user: Union[str, User]) -> User:
+    if isinstance(current_user, User):
+        return current_user
+    return await get_item_by_id(id_=current_user, result_obj=User)
+
+
+async def _get_document(item: Union[str, APIDocument], result_obj, current_user: User):
+    # callers that already hold the document pass it as is, deferred tasks pass the id
+    if isinstance(item, result_obj):
+        return item
+    return await get_item_by_id(id_=item, result_obj=result_obj, current_user=current_user)
+
+
+async def _get_online_channels_by_user(users: List[User]) -> Dict[str, Set[str]]:
+    try:
+        return await get_online_channels_by_user([user.pk for user in users])
+    except RedisError:
+        logger.exception("Problem reading presence, falling back to user documents.")
+
+    return {str(user.pk): set(user.online_channels) for user in users}
 
-    while len(pusher_channels) > 0:
-        push_channels = pusher_channels[:90]
-        try:
-            await pusher_client.trigger(push_channels, event_name, data)
-        except Exception as e:
-            logger.exception("Problem broadcasting event to Pusher channel. [event_name=%s]", event_name)
-            capture_exception(e)
-            has_errors = True
-        pusher_channels = pusher_channels[90:]
 
-    if not has_errors:
-        logger.info("Event broadcast successful. [event_name=%s]", event_name)
+async def pusher_broadcast_user_messages(event: WebSocketServerEvent, users_data: List[Tuple[User, dict]]):
+    # one event per recipient channel, so each user can get a different payload for the same number of requests
+    channels_by_user = await _get_online_channels_by_user([user for user, _ in users_data])
+    events = [
+        {"channel": pusher_channel, "name": event.value, "data": data}
+        for user, data in users_data
+        for pusher_channel in sorted(channels_by_user.get(str(user.pk), set()))
+    ]
 
+    if not events:
+        logger.debug("no online pusher channels. [event=%s]", event)
 
+    await _trigger_events(event.value, events)
+
+
+@register_bg_task
 async def broadcast_message_event(
-    message_id: str, current_user_id: str, event: WebSocketServerEvent, custom_data: Optional[dict] = None
+    message_id: Union[str, Message],
+    current_user_id: Union[str, User],
+    event: WebSocketServerEvent,
+    custom_data: Optional[dict] = None,
+    channel: Optional[Channel] = None,
 ):
-    current_user = await get_item_by_id(id_=current_user_id, result_obj=User)
-    message = await get_item_by_id(id_=message_id, result_obj=Message, current_user=current_user)
+    current_user = await _get_current_user(current_user_id)
+    message = await _get_document(message_id, result_obj=Message, current_user=current_user)
 
     event_data = {"message": message.dump()}
     if custom_data:
         event_data.update(custom_data)
 
+    if channel:
+        await pusher_broadcast_messages(
+            event=event, data=event_data, current_user=current_user, scope="channel", channel=channel
+        )
+        return
+
     await pusher_broadcast_messages(
         event=event, data=event_data, current_user=current_user, scope="message", message=message
     )
@@ -147,11 +302,15 @@ async def broadcast_connection_ready(current_user: User, channel: str):
     raise NotImplementedError("no longer in use!")
 
 
+@register_bg_task
 async def broadcast_channel_event(
-    channel_id: str, current_user_id: str, event: WebSocketServerEvent, custom_data: Optional[dict] = None
+    channel_id: Union[str, Channel],
+    current_user_id: Union[str, User],
+    event: WebSocketServerEvent,
+    custom_data: Optional[dict] = None,
 ):
-    current_user = await get_item_by_id(id_=current_user_id, result_obj=User)
-    channel = await get_item_by_id(id_=channel_id, result_obj=Channel, current_user=current_user)
+    current_user = await _get_current_user(current_user_id)
+    channel = await _get_document(channel_id, result_obj=Channel, current_user=current_user)
 
     event_data = {"channel": channel.dump()}
     if custom_data:
@@ -162,11 +321,22 @@ async def broadcast_channel_event(
     )
 
 
+@register_bg_task(sheddable=True, dead_letter=False)
+async def broadcast_user_typing_event(
+    channel_id: Union[str, Channel], current_user_id: Union[str, User], custom_data: Optional[dict] = None
+):
+    await broadcast_channel_event(channel_id, current_user_id, WebSocketServerEvent.USER_TYPING, custom_data)
+
+
+@register_bg_task
 async def broadcast_server_event(
-    server_id: str, current_user_id: str, event: WebSocketServerEvent, custom_data: Optional[dict] = None
+    server_id: Union[str, Server],
+    current_user_id: Union[str, User],
+    event: WebSocketServerEvent,
+    custom_data: Optional[dict] = None,
 ):
-    current_user = await get_item_by_id(id_=current_user_id, result_obj=User)
-    server = await get_item_by_id(id_=server_id, result_obj=Server, current_user=current_user)
+    current_user = await _get_current_user(current_user_id)
+    server = await _get_document(server_id, result_obj=Server, current_user=current_user)
 
     event_data = {}
     if custom_data:
@@ -177,12 +347,13 @@ async def broadcast_server_event(
     )
 
 
+@register_bg_task
 async def broadcast_current_user_event(
-    current_user_id,
+    current_user_id: Union[str, User],
     event: WebSocketServerEvent,
     custom_data: Optional[dict] = None,
 ):
-    current_user = await get_item_by_id(id_=current_user_id, result_obj=User)
+    current_user = await _get_current_user(current_user_id)
 
     event_data = {}
     if custom_data:
@@ -191,17 +362,21 @@ async def broadcast_current_user_event(
     await pusher_broadcast_messages(event=event, data=event_data, current_user=current_user, scope="current_user")
 
 
-async def broadcast_user_servers_event(current_user_id: str, event: WebSocketServerEvent, custom_data: dict) -> None:
-    current_user = await get_item_by_id(id_=current_user_id, result_obj=User)
+@register_bg_task
+async def broadcast_user_servers_event(
+    current_user_id: Union[str, User], event: WebSocketServerEvent, custom_data: dict
+) -> None:
+    current_user = await _get_current_user(current_user_id)
 
     event_data = {"user": await current_user.to_dict(exclude_fields=["pfp"])}
     if custom_data:
         event_data.update(custom_data)
 
-    server_members = await get_items(
-        {"user": current_user}, result_obj=ServerMember, current_user=current_user, limit=None
-    )
-    servers = [member.server for member in server_members]
+    servers = []
+    async for server_members in iter_items(
+        {"user": current_user.pk}, result_obj=ServerMember, current_user=current_user, projection=["server"]
+    ):
+        servers.extend([member.server for member in server_members])
 
     await pusher_broadcast_messages(
         event=event, data=event_data, current_user=current_user, scope="user_servers", servers=servers
@@ -214,3 +389,7 @@ async def broadcast_users_event(users: List[User], event: WebSocketServerEvent,
         event_data.update(custom_data)
 
     await pusher_broadcast_messages(event=event, data=event_data, users=users, scope="users", current_user=None)
+
+
+async def broadcast_per_user_event(event: WebSocketServerEvent, users_data: List[Tuple[User, dict]]) -> None:
+    await pusher_broadcast_user_messages(event=event, users_data=users_data)
@@ -1,7 +1,11 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
 import pytest
 from pymongo.database import Database
 
-from app.helpers.channels import is_user_in_channel
+from app.config import get_settings
+from app.helpers.channels import ChannelLastMessageWriter, is_user_in_channel
 from app.models.channel import Channel
 from app.models.user import User
 
@@ -26,3 +30,46 @@ class TestChannelHelper:
         self, db: Database, current_user: User, dm_channel: Channel, guest_user: User
     ):
         assert await is_user_in_channel(guest_user, dm_channel) is False
+
+
+class TestChannelLastMessageWriter:
+    @pytest.mark.asyncio
+    async def test_coalesces_last_message_dates(self, db: Database, server_channel: Channel, dm_channel: Channel):
+        writer = ChannelLastMessageWriter()
+        first_at = datetime.now(timezone.utc).replace(microsecond=0)
+        latest_at = first_at + timedelta(seconds=2)
+        for created_at in [first_at, latest_at, first_at + timedelta(seconds=1)]:
+            await writer.record(server_channel.pk, created_at)
+        await writer.record(dm_channel.pk, first_at)
+
+        await server_channel.reload()
+        assert server_channel.last_message_at is None
+
+        await writer.flush()
+        await server_channel.reload()
+        await dm_channel.reload()
+        assert server_channel.last_message_at == latest_at
+        assert dm_channel.last_message_at == first_at
+
+    @pytest.mark.asyncio
+    async def test_flush_keeps_newer_date(self, db: Database, server_channel: Channel):
+        writer = ChannelLastMessageWriter()
+        latest_at = datetime.now(timezone.utc).replace(microsecond=0)
+        await writer.record(server_channel.pk, latest_at)
+        await writer.flush()
+
+        await writer.record(server_channel.pk, latest_at - timedelta(minutes=1))
+        await writer.flush()
+        await server_channel.reload()
+        assert server_channel.last_message_at == latest_at
+
+    @pytest.mark.asyncio
+    async def test_flushes_on_interval(self, db: Database, server_channel: Channel, monkeypatch):
+        monkeypatch.setattr(get_settings(), "channel_last_message_flush_ms", 10)
+        writer = ChannelLastMessageWriter()
+        created_at = datetime.now(timezone.utc).replace(microsecond=0)
+        await writer.record(server_channel.pk, created_at)
+
+        await asyncio.sleep(0.1)
+        await server_channel.reload()
+        assert server_channel.last_message_at == created_at
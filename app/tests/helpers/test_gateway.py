@@ -0,0 +1,135 @@
+import asyncio
+from typing import List, Optional, cast
+
+import orjson
+import pytest
+from pymongo.database import Database
+from redis.asyncio.client import Redis
+from starlette.websockets import WebSocket
+
+from app.config import get_settings
+from app.helpers.gateway import WebSocketGateway, get_gateway_channel_name
+from app.helpers.presence import add_user_channel
+from app.helpers.websockets import RedisPubSubTransport
+from app.helpers.ws_events import WebSocketServerEvent
+from app.models.server import Server
+from app.models.user import User
+from app.services.websockets import pusher_broadcast_messages
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.messages: List[str] = []
+        self.close_code: Optional[int] = None
+
+    async def send_text(self, data: str):
+        self.messages.append(data)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+class StalledWebSocket(FakeWebSocket):
+    async def send_text(self, data: str):
+        await asyncio.Event().wait()
+
+
+async def _wait_for_messages(websocket: FakeWebSocket, count: int):
+    for _ in range(100):
+        if len(websocket.messages) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+
+class TestWebSocketGateway:
+    @pytest.mark.asyncio
+    async def test_published_events_reach_user_connections(self, redis: Redis):
+        gateway = WebSocketGateway()
+        first_socket, second_socket, other_socket = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await gateway.connect("user1", cast(WebSocket, first_socket))
+        await gateway.connect("user1", cast(WebSocket, second_socket))
+        await gateway.connect("user2", cast(WebSocket, other_socket))
+
+        transport = RedisPubSubTransport()
+        channels = [get_gateway_channel_name("user1", "a"), get_gateway_channel_name("user1", "b")]
+        await transport.trigger(channels, "MESSAGE_CREATE", {"message": {"id": "1"}})
+        await _wait_for_messages(first_socket, 1)
+        await _wait_for_messages(second_socket, 1)
+
+        expected = {"event": "MESSAGE_CREATE", "data": {"message": {"id": "1"}}}
+        assert [orjson.loads(message) for message in first_socket.messages] == [expected]
+        assert [orjson.loads(message) for message in second_socket.messages] == [expected]
+        assert other_socket.messages == []
+
+        await gateway.disconnect("user1", cast(WebSocket, first_socket))
+        await gateway.disconnect("user1", cast(WebSocket, second_socket))
+        await transport.trigger(channels, "MESSAGE_CREATE", {"message": {"id": "2"}})
+        await transport.trigger([get_gateway_channel_name("user2", "c")], "MESSAGE_CREATE", {})
+        await _wait_for_messages(other_socket, 1)
+        assert len(first_socket.messages) == 1
+        assert len(other_socket.messages) == 1
+
+        await gateway.close()
+
+    @pytest.mark.asyncio
+    async def test_broadcast_through_redis_transport(
+        self, db: Database, redis: Redis, current_user: User, server: Server, monkeypatch
+    ):
+        monkeypatch.setattr(get_settings(), "websocket_transport", "redis")
+        gateway = WebSocketGateway()
+        websocket = FakeWebSocket()
+        user_id = str(current_user.pk)
+        await gateway.connect(user_id, cast(WebSocket, websocket))
+        await add_user_channel(user_id, channel_name=get_gateway_channel_name(user_id, "a"), server_ids=[server.pk])
+
+        await pusher_broadcast_messages(
+            event=WebSocketServerEvent.SERVER_UPDATE,
+            current_user=current_user,
+            data={"server": {"id": str(server.pk)}},
+            scope="server",
+            server=server,
+        )
+        await _wait_for_messages(websocket, 1)
+
+        events = [orjson.loads(message) for message in websocket.messages]
+        assert {"event": "SERVER_UPDATE", "data": {"server": {"id": str(server.pk)}}} in events
+
+        await gateway.close()
+
+    @pytest.mark.asyncio
+    async def test_stalled_client_dropped_without_blocking_others(self, redis: Redis, monkeypatch):
+        monkeypatch.setattr("app.helpers.gateway.GATEWAY_SEND_TIMEOUT_SECONDS", 0.1)
+        gateway = WebSocketGateway()
+        stalled_socket, other_socket = StalledWebSocket(), FakeWebSocket()
+        await gateway.connect("user1", cast(WebSocket, stalled_socket))
+        await gateway.connect("user2", cast(WebSocket, other_socket))
+
+        await gateway.send_to_user("user1", "first")
+        await gateway.send_to_user("user2", "first")
+        await _wait_for_messages(other_socket, 1)
+        assert other_socket.messages == ["first"]
+
+        for _ in range(50):
+            if stalled_socket.close_code:
+                break
+            await asyncio.sleep(0.01)
+        assert stalled_socket.close_code == 1011
+        assert "user1" not in gateway._connections
+
+        await gateway.close()
+
+    @pytest.mark.asyncio
+    async def test_backed_up_client_dropped(self, redis: Redis, monkeypatch):
+        monkeypatch.setattr("app.helpers.gateway.GATEWAY_SEND_QUEUE_SIZE", 2)
+        gateway = WebSocketGateway()
+        stalled_socket = StalledWebSocket()
+        await gateway.connect("user1", cast(WebSocket, stalled_socket))
+
+        for index in range(4):
+            await gateway.send_to_user("user1", str(index))
+        await asyncio.sleep(0.01)
+
+        assert stalled_socket.close_code == 1011
+        assert "user1" not in gateway._connections
+
+        await gateway.close()
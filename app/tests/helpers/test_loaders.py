@@ -0,0 +1,95 @@
+import asyncio
+import gc
+
+import marshmallow
+import pytest
+from bson import ObjectId
+from pymongo.database import Database
+
+from app.helpers.loaders import (
+    ReferenceLoader,
+    fetch_reference,
+    fetch_references,
+    init_reference_loader,
+    reset_reference_loader,
+)
+from app.models.server import Server, ServerMember
+from app.models.user import User
+from app.schemas.servers import ServerCreateSchema
+from app.services.crud import create_item, get_items
+
+
+class TestReferenceLoader:
+    @pytest.mark.asyncio
+    async def test_fetch_references_ok(self, db: Database, current_user: User, server: Server):
+        new_server = await create_item(
+            ServerCreateSchema(name="Verbs"), result_obj=Server, current_user=current_user, user_field="owner"
+        )
+        members = [ServerMember(server=server, user=current_user), ServerMember(server=new_server, user=current_user)]
+
+        token = init_reference_loader()
+        try:
+            servers = await fetch_references([member.server for member in members])
+        finally:
+            reset_reference_loader(token)
+
+        assert [s.pk for s in servers] == [server.pk, new_server.pk]
+        assert servers[0].name == server.name
+
+    @pytest.mark.asyncio
+    async def test_dispatch_held_while_in_flight(self, db: Database, server: Server):
+        loader = ReferenceLoader()
+        future = loader.load(Server, server.pk)
+        await asyncio.sleep(0)
+        assert len(loader._dispatch_tasks) == 1
+
+        gc.collect()
+        await asyncio.gather(*loader._dispatch_tasks)
+        assert (await future).pk == server.pk
+        assert not loader._dispatch_tasks
+
+    @pytest.mark.asyncio
+    async def test_fetch_references_dedupes_ids(self, db: Database, current_user: User, server: Server):
+        members = await get_items(filters={"server": server.pk}, result_obj=ServerMember, current_user=current_user)
+        references = [members[0].server, ServerMember(server=server, user=current_user).server]
+
+        token = init_reference_loader()
+        try:
+            first, second = await fetch_references(references)
+            third = await fetch_reference(ServerMember(server=server, user=current_user).server)
+        finally:
+            reset_reference_loader(token)
+
+        assert first is second
+        assert first is third
+
+    @pytest.mark.asyncio
+    async def test_fetch_references_not_found(self, db: Database, current_user: User):
+        member = ServerMember(server=ObjectId(), user=current_user)
+
+        token = init_reference_loader()
+        try:
+            with pytest.raises(marshmallow.ValidationError):
+                await fetch_reference(member.server)
+        finally:
+            reset_reference_loader(token)
+
+    @pytest.mark.asyncio
+    async def test_fetch_references_without_loader(self, db: Database, current_user: User, server: Server):
+        members = await get_items(filters={"server": server.pk}, result_obj=ServerMember, current_user=current_user)
+        servers = await fetch_references([member.server for member in members])
+        assert [s.pk for s in servers] == [server.pk]
+
+    @pytest.mark.asyncio
+    async def test_build_error_fails_whole_batch(self, db: Database, server: Server, monkeypatch):
+        def build_from_mongo(*args, **kwargs):
+            raise ValueError("corrupt document")
+
+        loader = ReferenceLoader()
+        with monkeypatch.context() as patch:
+            patch.setattr(Server, "build_from_mongo", build_from_mongo)
+            futures = [loader.load(Server, server.pk), loader.load(Server, ObjectId())]
+            results = await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), timeout=1)
+
+        assert all(isinstance(result, ValueError) for result in results)
+        assert (await loader.load(Server, server.pk)).pk == server.pk
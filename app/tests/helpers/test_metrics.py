@@ -0,0 +1,160 @@
+import asyncio
+import datetime
+import logging
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from httpx import AsyncClient
+from pymongo import monitoring
+from redis.asyncio.client import Redis
+
+from app.config import get_settings
+from app.helpers.metrics import (
+    CommandStatsListener,
+    get_command_filter,
+    get_filter_shape,
+    get_request_stats,
+    init_request_stats,
+    reset_request_stats,
+)
+from app.helpers.queue_utils import start_bg_task_stats_reporter, stop_background_tasks
+
+
+def _run_command(listener: CommandStatsListener, command: dict, duration_ms: float, request_id: int = 1):
+    command_name = next(iter(command))
+    listener.started(
+        monitoring.CommandStartedEvent(
+            command,
+            database_name="newshades",
+            request_id=request_id,
+            connection_id=("localhost", 27017),
+            operation_id=1,
+        )
+    )
+    listener.succeeded(
+        monitoring.CommandSucceededEvent(
+            datetime.timedelta(milliseconds=duration_ms),
+            reply={"ok": 1},
+            command_name=command_name,
+            request_id=request_id,
+            connection_id=("localhost", 27017),
+            operation_id=1,
+        )
+    )
+
+
+@pytest.fixture
+def app_caplog(caplog, monkeypatch):
+    # app loggers don't propagate to the root logger caplog listens on
+    monkeypatch.setattr(logging.getLogger("app"), "propagate", True)
+    return caplog
+
+
+class TestMetrics:
+    @pytest.mark.asyncio
+    async def test_filter_shape(self):
+        filters = {
+            "channel": ObjectId(),
+            "deleted": False,
+            "_id": {"$in": [ObjectId(), ObjectId()]},
+            "$or": [{"created_at": {"$lt": datetime.datetime.now()}}, {"_id": {"$lt": ObjectId()}}],
+        }
+        assert get_filter_shape(filters) == {
+            "channel": 1,
+            "deleted": 1,
+            "_id": {"$in": 1},
+            "$or": [{"created_at": {"$lt": 1}}, {"_id": {"$lt": 1}}],
+        }
+
+    @pytest.mark.asyncio
+    async def test_command_filter(self):
+        assert get_command_filter("find", {"find": "messages", "filter": {"a": 1}}) == {"a": 1}
+        assert get_command_filter("update", {"update": "users", "updates": [{"q": {"a": 1}, "u": {}}]}) == {"a": 1}
+        pipeline = [{"$match": {"server": 1}}, {"$group": {"_id": "$server"}}]
+        assert get_command_filter("aggregate", {"aggregate": "server_members", "pipeline": pipeline}) == {"server": 1}
+        assert get_command_filter("insert", {"insert": "messages", "documents": []}) is None
+
+    @pytest.mark.asyncio
+    async def test_listener_records_request_commands(self, app_caplog):
+        listener = CommandStatsListener()
+        _run_command(listener, {"find": "messages", "filter": {"channel": ObjectId()}}, duration_ms=5)
+
+        token = init_request_stats()
+        try:
+            _run_command(listener, {"find": "messages", "filter": {"channel": ObjectId()}}, duration_ms=5)
+            with app_caplog.at_level(logging.WARNING):
+                _run_command(listener, {"find": "users", "filter": {"wallet_address": "0x"}}, 250, request_id=2)
+
+            stats = get_request_stats()
+            assert stats
+            assert stats.db_calls == 2
+            assert stats.db_ms == pytest.approx(255)
+        finally:
+            reset_request_stats(token)
+
+        assert "Slow mongo command. [command=find, collection=users" in app_caplog.text
+        assert "filter={'wallet_address': 1}" in app_caplog.text
+
+    @pytest.mark.asyncio
+    async def test_redis_commands_recorded(self, redis: Redis):
+        token = init_request_stats()
+        try:
+            await redis.set("key", "value")
+            await redis.get("key")
+            stats = get_request_stats()
+            assert stats
+            assert stats.redis_calls == 2
+            assert stats.redis_ms > 0
+        finally:
+            reset_request_stats(token)
+
+    @pytest.mark.asyncio
+    async def test_canonical_log_line_stats(self, app: FastAPI, authorized_client: AsyncClient, app_caplog):
+        with app_caplog.at_level(logging.INFO):
+            response = await authorized_client.get("/users/me")
+        assert response.status_code == 200
+
+        log_lines = [record.getMessage() for record in app_caplog.records if "canonical-log" in record.getMessage()]
+        assert len(log_lines) == 1
+        assert "db_calls=" in log_lines[0]
+        assert "db_ms=" in log_lines[0]
+        assert "redis_calls=" in log_lines[0]
+        assert "redis_ms=" in log_lines[0]
+        assert "pusher_calls=0" in log_lines[0]
+        assert "bg_queue_depth" not in log_lines[0]
+
+    @pytest.mark.asyncio
+    async def test_canonical_log_line_counts_streamed_body(
+        self, app: FastAPI, authorized_client: AsyncClient, redis: Redis, app_caplog, monkeypatch
+    ):
+        redis_calls_in_body = 0
+
+        async def get_connection_ready_stream(current_user):
+            nonlocal redis_calls_in_body
+            yield b"{}\n"
+            await redis.get("key")
+            stats = get_request_stats()
+            redis_calls_in_body = stats.redis_calls if stats else 0
+            yield b"{}\n"
+
+        monkeypatch.setattr("app.routers.base.get_connection_ready_stream", get_connection_ready_stream)
+        with app_caplog.at_level(logging.INFO):
+            response = await authorized_client.get("/ready", params={"stream": True})
+        assert response.status_code == 200
+
+        [log_line] = [record.getMessage() for record in app_caplog.records if "canonical-log" in record.getMessage()]
+        assert redis_calls_in_body > 0
+        assert f"redis_calls={redis_calls_in_body}" in log_line
+
+    @pytest.mark.asyncio
+    async def test_bg_task_stats_reported_on_interval(self, app_caplog, monkeypatch):
+        monkeypatch.setattr(get_settings(), "bg_task_stats_log_interval_seconds", 0.01)
+        with app_caplog.at_level(logging.INFO):
+            await start_bg_task_stats_reporter()
+            await asyncio.sleep(0.05)
+            await stop_background_tasks()
+
+        log_lines = [record.getMessage() for record in app_caplog.records if "bg-task-stats" in record.getMessage()]
+        assert log_lines
+        assert "bg_wait_ms_avg=" in log_lines[0]
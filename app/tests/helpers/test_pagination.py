@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.helpers.pagination import (
+    NEXT_CURSOR_HEADER,
+    PREV_CURSOR_HEADER,
+    PageCursor,
+    decode_cursor,
+    encode_cursor,
+    get_cursor_filter,
+    get_cursor_sort,
+    get_page_cursors,
+)
+
+
+class TestPagination:
+    @pytest.mark.asyncio
+    async def test_encode_decode_cursor(self):
+        cursor = PageCursor("created_at", -1, datetime(2022, 5, 1, 12, 30, 15, 123000), ObjectId(), reverse=True)
+        token = encode_cursor(cursor)
+        assert "=" not in token
+        assert decode_cursor(token) == cursor
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "token",
+        [
+            "",
+            "not-a-cursor",
+            encode_cursor(PageCursor("created_at", 2, 1, ObjectId())),
+            encode_cursor(PageCursor("$where", 1, 1, ObjectId())),
+            encode_cursor(PageCursor("created_at", 1, 1, "61e17018c3ee162141baf5c9")),  # type: ignore
+        ],
+    )
+    async def test_decode_invalid_cursor(self, token: str):
+        with pytest.raises(ValueError):
+            decode_cursor(token)
+
+    @pytest.mark.asyncio
+    async def test_cursor_filter_and_sort(self):
+        id_ = ObjectId()
+        created_at = datetime(2022, 5, 1)
+
+        cursor = PageCursor("created_at", -1, created_at, id_)
+        assert get_cursor_sort(cursor) == [("created_at", -1), ("_id", -1)]
+        assert get_cursor_filter(cursor) == {
+            "created_at": {"$lte": created_at},
+            "$or": [{"created_at": {"$lt": created_at}}, {"_id": {"$lt": id_}}],
+        }
+
+        reverse_cursor = cursor._replace(reverse=True)
+        assert get_cursor_sort(reverse_cursor) == [("created_at", 1), ("_id", 1)]
+        assert get_cursor_filter(reverse_cursor) == {
+            "created_at": {"$gte": created_at},
+            "$or": [{"created_at": {"$gt": created_at}}, {"_id": {"$gt": id_}}],
+        }
+
+        id_cursor = PageCursor("_id", 1, id_, id_)
+        assert get_cursor_sort(id_cursor) == [("_id", 1)]
+        assert get_cursor_filter(id_cursor) == {"_id": {"$gt": id_}}
+
+    @pytest.mark.asyncio
+    async def test_get_page_cursors(self):
+        items = [{"_id": ObjectId(), "position": position} for position in range(3)]
+
+        assert get_page_cursors([], "position", 1, limit=3) == {}
+        assert get_page_cursors(items, "position", 1, limit=5) == {}
+
+        cursors = get_page_cursors(items, "position", 1, limit=3)
+        assert list(cursors.keys()) == [NEXT_CURSOR_HEADER]
+        assert decode_cursor(cursors[NEXT_CURSOR_HEADER]) == PageCursor("position", 1, 2, items[-1]["_id"])
+
+        cursors = get_page_cursors(items, "position", 1, limit=5, paginated=True)
+        assert list(cursors.keys()) == [PREV_CURSOR_HEADER]
+        assert decode_cursor(cursors[PREV_CURSOR_HEADER]) == PageCursor("position", 1, 0, items[0]["_id"], True)
+
+        reverse_cursor = PageCursor("position", 1, 5, ObjectId(), reverse=True)
+        cursors = get_page_cursors(items, "position", 1, limit=5, cursor=reverse_cursor)
+        assert list(cursors.keys()) == [NEXT_CURSOR_HEADER]
@@ -0,0 +1,117 @@
+from typing import Callable
+
+import pytest
+from bson import ObjectId
+from pymongo.database import Database
+from redis.asyncio.client import Redis
+
+from app.commands.reconcile_presence import reconcile_presence
+from app.helpers.presence import (
+    add_server_user,
+    add_user_channel,
+    get_online_channels_by_user,
+    get_servers_online_user_channels,
+    get_servers_online_user_ids,
+    get_users_online_channels,
+    remove_offline_server_users,
+    remove_user_channel,
+)
+from app.helpers.websockets import pusher_client
+from app.models.channel import Channel
+from app.models.server import Server
+from app.models.user import User
+from app.services.servers import join_server
+from app.services.websockets import get_channel_online_channels, get_server_online_channels
+
+
+class TestPresenceHelper:
+    @pytest.mark.asyncio
+    async def test_add_remove_user_channels(self, redis: Redis, current_user: User, server: Server):
+        await add_user_channel(current_user.pk, channel_name="private-1", server_ids=[server.pk])
+        await add_user_channel(current_user.pk, channel_name="private-2", server_ids=[server.pk])
+        assert await get_users_online_channels([current_user.pk]) == {"private-1", "private-2"}
+        assert await get_servers_online_user_ids([server.pk]) == {current_user.pk}
+
+        assert await remove_user_channel(current_user.pk, channel_name="private-1", server_ids=[server.pk]) is True
+        assert await get_servers_online_user_channels([server.pk]) == {"private-2"}
+
+        offline_user_id = ObjectId()
+        assert await get_online_channels_by_user([current_user.pk, offline_user_id]) == {
+            str(current_user.pk): {"private-2"},
+            str(offline_user_id): set(),
+        }
+
+        assert await remove_user_channel(current_user.pk, channel_name="private-2", server_ids=[server.pk]) is False
+        assert await get_users_online_channels([current_user.pk]) == set()
+        assert await get_servers_online_user_ids([server.pk]) == set()
+
+    @pytest.mark.asyncio
+    async def test_add_server_user_only_when_online(self, redis: Redis, current_user: User, server: Server):
+        await add_server_user(server.pk, current_user.pk)
+        assert await get_servers_online_user_ids([server.pk]) == set()
+
+        await add_user_channel(current_user.pk, channel_name="private-1", server_ids=[])
+        await add_server_user(server.pk, current_user.pk)
+        assert await get_servers_online_user_ids([server.pk]) == {current_user.pk}
+
+    @pytest.mark.asyncio
+    async def test_fan_out_targets_from_presence(
+        self,
+        db: Database,
+        redis: Redis,
+        current_user: User,
+        server: Server,
+        server_channel: Channel,
+        dm_channel: Channel,
+        create_new_user: Callable,
+    ):
+        guest = await create_new_user()
+        offline_guest = await create_new_user()
+        await add_user_channel(current_user.pk, channel_name="private-owner", server_ids=[server.pk])
+        await add_user_channel(guest.pk, channel_name="private-guest", server_ids=[])
+        await join_server(str(server.pk), current_user=guest)
+        await join_server(str(server.pk), current_user=offline_guest)
+
+        assert set(await get_server_online_channels(server, current_user=current_user)) == {
+            "private-owner",
+            "private-guest",
+        }
+        assert set(await get_channel_online_channels(server_channel, current_user=current_user)) == {
+            "private-owner",
+            "private-guest",
+        }
+        assert set(await get_channel_online_channels(dm_channel, current_user=current_user)) == {"private-owner"}
+
+    @pytest.mark.asyncio
+    async def test_remove_offline_server_users(self, redis: Redis, current_user: User, server: Server):
+        await add_user_channel(current_user.pk, channel_name="private-1", server_ids=[server.pk])
+        phantom_user_id = ObjectId()
+        await redis.sadd(f"presence:servers:{str(server.pk)}", str(phantom_user_id))
+        assert await get_servers_online_user_ids([server.pk]) == {current_user.pk, phantom_user_id}
+
+        assert await remove_offline_server_users() == 1
+        assert await get_servers_online_user_ids([server.pk]) == {current_user.pk}
+
+    @pytest.mark.asyncio
+    async def test_reconcile_presence(
+        self, monkeypatch, db: Database, redis: Redis, current_user: User, server: Server
+    ):
+        for channel_name in ["private-live", "private-lost", "private-reconnected", "ws-gateway"]:
+            await add_user_channel(current_user.pk, channel_name=channel_name, server_ids=[server.pk])
+
+        async def channels_info(prefix_filter=None, attributes=[]):
+            return {"channels": {"private-live": {}}}
+
+        async def channel_info(channel, attributes=[]):
+            return {"occupied": channel == "private-reconnected"}
+
+        monkeypatch.setattr(pusher_client, "channels_info", channels_info)
+        monkeypatch.setattr(pusher_client, "channel_info", channel_info)
+
+        assert await reconcile_presence() == 1
+        assert await get_users_online_channels([current_user.pk]) == {
+            "private-live",
+            "private-reconnected",
+            "ws-gateway",
+        }
+        assert await get_servers_online_user_ids([server.pk]) == {current_user.pk}
@@ -0,0 +1,212 @@
+import asyncio
+
+import pytest
+from pymongo.database import Database
+from pymongo.errors import ConnectionFailure
+
+from app.commands.replay_dead_letters import replay_dead_letter_tasks
+from app.config import get_settings
+from app.helpers.metrics import bg_task_stats
+from app.helpers.queue_utils import (
+    _running_bg_tasks,
+    bg_task_executor,
+    get_running_bg_tasks_count,
+    queue_bg_task,
+    stop_background_tasks,
+)
+from app.helpers.task_queue import get_task_name, register_bg_task
+from app.models.task import DeadLetterTask
+
+task_events: list = []
+
+
+@register_bg_task(max_concurrency=2)
+async def limited_task(release: asyncio.Event, running: list):
+    running.append(1)
+    task_events.append(len(running))
+    await release.wait()
+    running.pop()
+
+
+@register_bg_task
+async def blocking_task(name: str, release: asyncio.Event):
+    await release.wait()
+    task_events.append(name)
+
+
+@register_bg_task(sheddable=True)
+async def sheddable_task(name: str):
+    task_events.append(name)
+
+
+flaky_failures = {"remaining": 0, "attempts": 0}
+
+
+@register_bg_task(max_attempts=3, retry_on=(ConnectionFailure,), retry_backoff_seconds=0)
+async def flaky_task(name: str):
+    flaky_failures["attempts"] += 1
+    if flaky_failures["remaining"]:
+        flaky_failures["remaining"] -= 1
+        raise ConnectionFailure("connection blip")
+    task_events.append(name)
+
+
+@register_bg_task
+async def broken_task(name: str):
+    raise KeyError(name)
+
+
+def _set_executor_settings(monkeypatch, **settings):
+    for key, value in settings.items():
+        monkeypatch.setattr(get_settings(), f"bg_tasks_{key}", value)
+
+
+class TestBackgroundTaskExecutor:
+    @pytest.fixture(autouse=True)
+    async def reset_executor(self):
+        task_events.clear()
+        flaky_failures.update(remaining=0, attempts=0)
+        await bg_task_executor.drain(timeout=1)
+        yield
+        await bg_task_executor.drain(timeout=1)
+
+    @pytest.mark.asyncio
+    async def test_per_task_concurrency_limit(self):
+        release = asyncio.Event()
+        running: list = []
+        for _ in range(5):
+            await queue_bg_task(limited_task, release, running)
+
+        await asyncio.sleep(0.05)
+        assert task_events == [1, 2]
+        release.set()
+        await asyncio.sleep(0.05)
+        assert max(task_events) == 2
+        assert len(task_events) == 5
+
+    @pytest.mark.asyncio
+    async def test_saturated_task_type_does_not_block_others(self, monkeypatch):
+        _set_executor_settings(monkeypatch, max_concurrency=3)
+        release = asyncio.Event()
+        running: list = []
+        for _ in range(10):
+            await queue_bg_task(limited_task, release, running)
+        await queue_bg_task(sheddable_task, "unrelated")
+
+        await asyncio.sleep(0.05)
+        assert task_events == [1, 2, "unrelated"]
+        release.set()
+        await asyncio.sleep(0.05)
+        assert len(task_events) == 11
+
+    @pytest.mark.asyncio
+    async def test_overflow_drops_oldest(self, monkeypatch):
+        _set_executor_settings(monkeypatch, max_concurrency=1, max_queue_size=2, overflow_policy="drop_oldest")
+        dropped = bg_task_stats.dropped
+        release = asyncio.Event()
+        await queue_bg_task(blocking_task, "running", release)
+        await asyncio.sleep(0.01)
+        for name in ["first", "second", "third"]:
+            await queue_bg_task(blocking_task, name, release)
+
+        release.set()
+        await asyncio.sleep(0.05)
+        assert task_events == ["running", "second", "third"]
+        assert bg_task_stats.dropped == dropped + 1
+
+    @pytest.mark.asyncio
+    async def test_overflow_blocks_caller(self, monkeypatch):
+        _set_executor_settings(monkeypatch, max_concurrency=1, max_queue_size=1, overflow_policy="block")
+        release = asyncio.Event()
+        await queue_bg_task(blocking_task, "running", release)
+        await asyncio.sleep(0.01)
+        await queue_bg_task(blocking_task, "queued", release)
+
+        blocked = asyncio.create_task(queue_bg_task(blocking_task, "blocked", release))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+
+        release.set()
+        await blocked
+        await asyncio.sleep(0.05)
+        assert task_events == ["running", "queued", "blocked"]
+
+    @pytest.mark.asyncio
+    async def test_sheddable_tasks_dropped_when_backed_up(self, monkeypatch):
+        _set_executor_settings(monkeypatch, max_concurrency=1, shed_queue_size=1)
+        shed = bg_task_stats.shed
+        release = asyncio.Event()
+        await queue_bg_task(blocking_task, "running", release)
+        await asyncio.sleep(0.01)
+        await queue_bg_task(sheddable_task, "kept")
+        await queue_bg_task(sheddable_task, "shed")
+
+        release.set()
+        await asyncio.sleep(0.05)
+        assert task_events == ["running", "kept"]
+        assert bg_task_stats.shed == shed + 1
+
+    @pytest.mark.asyncio
+    async def test_running_tasks_registry(self):
+        release = asyncio.Event()
+        await queue_bg_task(blocking_task, "first", release)
+        await queue_bg_task(blocking_task, "second", release)
+        await asyncio.sleep(0.01)
+
+        running_tasks = [task for task in _running_bg_tasks if task.get_loop() is asyncio.get_running_loop()]
+        assert get_running_bg_tasks_count() == len(running_tasks) == 2
+        task_numbers = [int(task.get_name().split("-")[1]) for task in running_tasks]
+        assert len(set(task_numbers)) == 2
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert get_running_bg_tasks_count() == 0
+        runtimes = {runtime["task"]: runtime for runtime in bg_task_stats.get_task_runtimes()}
+        assert runtimes[get_task_name(blocking_task)]["runs"] >= 2
+
+    @pytest.mark.asyncio
+    async def test_stop_background_tasks_deadline(self, monkeypatch):
+        monkeypatch.setattr("app.helpers.queue_utils.MAX_SHUTDOWN_WAIT_SECONDS", 0.1)
+        release = asyncio.Event()
+        await queue_bg_task(sheddable_task, "finished")
+        await queue_bg_task(blocking_task, "cancelled", release)
+        await asyncio.sleep(0.01)
+
+        await stop_background_tasks()
+        assert get_running_bg_tasks_count() == 0
+        assert task_events == ["finished"]
+
+    @pytest.mark.asyncio
+    async def test_retries_with_backoff(self, db: Database):
+        flaky_failures["remaining"] = 2
+        await queue_bg_task(flaky_task, "retried")
+        await asyncio.sleep(0.05)
+
+        assert task_events == ["retried"]
+        assert flaky_failures["attempts"] == 3
+        assert await DeadLetterTask.count_documents({}) == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_tasks_dead_lettered_and_replayed(self, db: Database):
+        flaky_failures["remaining"] = 3
+        await queue_bg_task(flaky_task, "exhausted")
+        await asyncio.sleep(0.05)
+
+        assert task_events == []
+        [dead_letter] = [dead_letter async for dead_letter in DeadLetterTask.find({})]
+        assert dead_letter.task == get_task_name(flaky_task)
+        assert dead_letter.attempts == 3
+        assert "ConnectionFailure" in dead_letter.error
+
+        assert await replay_dead_letter_tasks(dry_run=True) == 0
+        assert await replay_dead_letter_tasks() == 1
+        await dead_letter.reload()
+        assert dead_letter.replayed_at is not None
+        assert task_events == ["exhausted"]
+        assert await replay_dead_letter_tasks() == 0
+
+    @pytest.mark.asyncio
+    async def test_non_transient_errors_not_dead_lettered(self, db: Database):
+        await queue_bg_task(broken_task, "bug")
+        await asyncio.sleep(0.05)
+        assert await DeadLetterTask.count_documents({}) == 0
@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+from typing import List
+
+import pytest
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pymongo.database import Database
+
+from app.helpers.serializers import get_schema_projection, serialize_raw_documents
+from app.models.channel import Channel
+from app.models.message import Message, MessageReaction
+from app.models.server import Server
+from app.models.user import User
+from app.schemas.messages import MessageSchema
+
+
+async def _get_response_model_body(raw_messages: List[dict]) -> bytes:
+    messages = [Message.build_from_mongo(raw_message, use_cls=True) for raw_message in raw_messages]
+    field = create_response_field(name="Response", type_=List[MessageSchema])
+    content = await serialize_response(field=field, response_content=messages)
+    return ORJSONResponse(content).body
+
+
+def _get_fast_path_body(raw_messages: List[dict]) -> bytes:
+    return ORJSONResponse(serialize_raw_documents(raw_messages, schema=MessageSchema, document_cls=Message)).body
+
+
+class TestSerializers:
+    @pytest.mark.asyncio
+    async def test_serialize_raw_messages_matches_response_model(
+        self,
+        db: Database,
+        current_user: User,
+        guest_user: User,
+        server: Server,
+        server_channel: Channel,
+        dm_channel: Channel,
+        channel_message: Message,
+        direct_message: Message,
+    ):
+        reply = Message(
+            server=server.pk,
+            channel=server_channel.pk,
+            author=guest_user.pk,
+            content="wagmi",
+            blocks=[{"type": "paragraph", "children": [{"text": "wagmi", "bold": True}]}],
+            embeds=[{"url": "https://newshades.xyz", "metadata": {"width": 10}}],
+            reply_to=channel_message.pk,
+            edited_at=datetime(2022, 5, 1, 12, 30, 15, 123000, tzinfo=timezone.utc),
+            reactions=[
+                MessageReaction(emoji="🙌", count=2, users=[current_user.pk, guest_user.pk]),
+                MessageReaction(emoji="🔥", users=[guest_user.pk]),
+            ],
+            type=1,
+        )
+        await reply.commit()
+
+        legacy_message_id = (
+            await Message.collection.insert_one(
+                {
+                    "channel": dm_channel.pk,
+                    "author": current_user.pk,
+                    "created_at": datetime(2022, 1, 1),
+                    "reactions": [{"emoji": "😍", "users": [current_user.pk]}],
+                }
+            )
+        ).inserted_id
+
+        message_ids = [channel_message.pk, direct_message.pk, reply.pk, legacy_message_id]
+        raw_messages = await Message.collection.find({"_id": {"$in": message_ids}}).to_list(length=None)
+        assert len(raw_messages) == 4
+
+        assert _get_fast_path_body(raw_messages) == await _get_response_model_body(raw_messages)
+
+    @pytest.mark.asyncio
+    async def test_schema_projection(self):
+        projection = get_schema_projection(MessageSchema, Message)
+        assert projection[0] == "_id"
+        assert "id" not in projection
+        assert set(projection[1:]) == set(MessageSchema.__fields__.keys()) - {"id"}
+
+    @pytest.mark.asyncio
+    async def test_serialize_raw_messages_page(
+        self, db: Database, current_user: User, server: Server, server_channel: Channel
+    ):
+        messages = [
+            Message(
+                server=server.pk,
+                channel=server_channel.pk,
+                author=current_user.pk,
+                content=f"gm {index}",
+                blocks=[{"type": "paragraph", "children": [{"text": f"gm {index}"}]}],
+                reactions=[MessageReaction(emoji="🙌", users=[current_user.pk])],
+            )
+            for index in range(100)
+        ]
+        await Message.collection.insert_many([message.to_mongo() for message in messages])
+        raw_messages = await Message.collection.find({"channel": server_channel.pk}).to_list(length=None)
+        assert len(raw_messages) == 100
+
+        assert _get_fast_path_body(raw_messages) == await _get_response_model_body(raw_messages)
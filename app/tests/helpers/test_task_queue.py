@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo.database import Database
+from redis.asyncio.client import Redis
+
+from app.config import get_settings
+from app.helpers.channels import channel_last_message_writer
+from app.helpers.queue_utils import queue_bg_task
+from app.helpers.task_queue import TASK_STREAM_KEY, decode_tasks, encode_tasks, register_bg_task
+from app.helpers.ws_events import WebSocketServerEvent
+from app.models.channel import Channel
+from app.models.message import Message
+from app.models.server import Server
+from app.models.user import User
+from app.schemas.messages import MessageCreateSchema
+from app.services.messages import create_message
+from app.worker import run_worker
+
+task_calls: list = []
+
+
+@register_bg_task
+async def record_task_call(*args, **kwargs):
+    task_calls.append((args, kwargs))
+
+
+async def unregistered_task(*args, **kwargs):
+    task_calls.append((args, kwargs))
+
+
+class TestTaskQueue:
+    @pytest.mark.asyncio
+    async def test_encode_decode_tasks(self, db: Database, current_user: User, channel_message: Message):
+        created_at = datetime.now(timezone.utc)
+        data = encode_tasks(
+            [
+                (
+                    record_task_call,
+                    (channel_message, str(current_user.pk), WebSocketServerEvent.MESSAGE_CREATE),
+                    {"channel": channel_message.channel, "custom_data": {"read_at": created_at, "ids": [ObjectId()]}},
+                )
+            ]
+        )
+
+        [(f, args, kwargs)] = await decode_tasks(data.decode())
+        assert f is record_task_call
+        message, user_id, event = args
+        assert isinstance(message, Message)
+        assert message.pk == channel_message.pk
+        assert user_id == str(current_user.pk)
+        assert event == WebSocketServerEvent.MESSAGE_CREATE
+        assert kwargs["channel"] == channel_message.channel.pk
+        assert kwargs["custom_data"]["read_at"] == created_at
+        assert isinstance(kwargs["custom_data"]["ids"][0], ObjectId)
+
+    @pytest.mark.asyncio
+    async def test_encode_unregistered_task(self):
+        with pytest.raises(ValueError):
+            encode_tasks([(unregistered_task, (), {})])
+
+    @pytest.mark.asyncio
+    async def test_worker_runs_queued_tasks(self, redis: Redis, monkeypatch):
+        monkeypatch.setattr(get_settings(), "bg_tasks_backend", "redis")
+        task_calls.clear()
+
+        await queue_bg_task(record_task_call, "stream", count=1)
+        await queue_bg_task(unregistered_task, "local")
+        assert await redis.xlen(TASK_STREAM_KEY) == 1
+        await asyncio.sleep(0.01)
+        assert task_calls == [(("local",), {})]
+
+        stop_event = asyncio.Event()
+        worker = asyncio.create_task(run_worker("test-worker", concurrency=5, stop_event=stop_event))
+        for _ in range(20):
+            if len(task_calls) == 2:
+                break
+            await asyncio.sleep(0.1)
+        stop_event.set()
+        await worker
+
+        assert task_calls == [(("local",), {}), (("stream",), {"count": 1})]
+        assert await redis.xlen(TASK_STREAM_KEY) == 0
+
+    @pytest.mark.asyncio
+    async def test_worker_runs_message_tasks(
+        self, db: Database, redis: Redis, current_user: User, server: Server, server_channel: Channel, monkeypatch
+    ):
+        monkeypatch.setattr(get_settings(), "bg_tasks_backend", "redis")
+        message_model = MessageCreateSchema(server=str(server.pk), channel=str(server_channel.pk), content="hey")
+        message = await create_message(message_model, current_user=current_user)
+        assert await redis.xlen(TASK_STREAM_KEY) == 1
+
+        stop_event = asyncio.Event()
+        worker = asyncio.create_task(run_worker("test-worker", concurrency=5, stop_event=stop_event))
+        for _ in range(20):
+            if await redis.xlen(TASK_STREAM_KEY) == 0:
+                break
+            await asyncio.sleep(0.1)
+        stop_event.set()
+        await worker
+
+        assert await redis.xlen(TASK_STREAM_KEY) == 0
+        await channel_last_message_writer.stop()
+        await server_channel.reload()
+        assert server_channel.last_message_at == message.created_at
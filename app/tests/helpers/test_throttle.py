@@ -0,0 +1,152 @@
+import asyncio
+from typing import Callable, List, Optional
+
+import pytest
+from fastapi import HTTPException
+from pymongo.database import Database
+from redis.asyncio.client import Redis
+
+from app.config import get_settings
+from app.helpers.throttle import PRESENCE_THROTTLE_KEY, acquire_throttle
+from app.models.channel import Channel
+from app.models.user import User
+from app.schemas.channels import ServerChannelCreateSchema
+from app.schemas.servers import ServerCreateSchema
+from app.services.channels import create_server_channel, create_typing_indicator
+from app.services.servers import create_server
+from app.services.webhooks import process_channel_occupied_event, process_channel_vacated_event
+
+
+class TestThrottleHelper:
+    @pytest.mark.asyncio
+    async def test_acquire_throttle(self, redis: Redis):
+        assert await acquire_throttle("throttle:test", 100) is True
+        assert await acquire_throttle("throttle:test", 100) is False
+        await asyncio.sleep(0.15)
+        assert await acquire_throttle("throttle:test", 100) is True
+
+    @pytest.mark.asyncio
+    async def test_acquire_throttle_disabled(self, redis: Redis):
+        assert await acquire_throttle("throttle:test", 0) is True
+        assert await acquire_throttle("throttle:test", 0) is True
+
+    @pytest.mark.asyncio
+    async def test_typing_indicator_throttled(self, redis: Redis, current_user: User, dm_channel: Channel, monkeypatch):
+        queued = []
+
+        async def queue_bg_task(f, *args, **kwargs):
+            queued.append(args)
+
+        monkeypatch.setattr("app.services.channels.queue_bg_task", queue_bg_task)
+
+        for _ in range(10):
+            await create_typing_indicator(str(dm_channel.pk), current_user=current_user)
+        assert len(queued) == 1
+
+    @pytest.mark.asyncio
+    async def test_typing_indicator_non_member_forbidden(
+        self, db: Database, redis: Redis, current_user: User, create_new_user: Callable, monkeypatch
+    ):
+        queued = []
+
+        async def queue_bg_task(f, *args, **kwargs):
+            queued.append(args)
+
+        monkeypatch.setattr("app.services.channels.queue_bg_task", queue_bg_task)
+        guest = await create_new_user()
+        guest_server = await create_server(ServerCreateSchema(name="Guest DAO"), current_user=guest)
+        guest_channel = await create_server_channel(
+            ServerChannelCreateSchema(server=str(guest_server.pk), name="lounge"), current_user=guest
+        )
+
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc_info:
+                await create_typing_indicator(str(guest_channel.pk), current_user=current_user)
+            assert exc_info.value.status_code == 403
+        assert queued == []
+
+    @pytest.mark.asyncio
+    async def test_presence_flaps_coalesced(self, redis: Redis, current_user: User, monkeypatch):
+        monkeypatch.setattr(get_settings(), "presence_throttle_ms", 100)
+        statuses = []
+
+        async def broadcast_user_servers_event(current_user_id, event, custom_data):
+            statuses.append(custom_data["status"])
+
+        monkeypatch.setattr("app.services.webhooks.broadcast_user_servers_event", broadcast_user_servers_event)
+        channel_name = f"private-{str(current_user.pk)}"
+        await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+        for _ in range(5):
+            await process_channel_vacated_event(channel_name=channel_name, current_user=current_user)
+            await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+        await asyncio.sleep(0.3)
+        assert statuses == ["online"]
+
+        await process_channel_vacated_event(channel_name=channel_name, current_user=current_user)
+        await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+        await process_channel_vacated_event(channel_name=channel_name, current_user=current_user)
+        await asyncio.sleep(0.3)
+        assert statuses == ["online", "offline"]
+
+    @pytest.mark.asyncio
+    async def test_presence_flap_back_to_sent_status_not_broadcast(self, redis: Redis, current_user: User, monkeypatch):
+        monkeypatch.setattr(get_settings(), "presence_throttle_ms", 50)
+        statuses = []
+
+        async def broadcast_user_servers_event(current_user_id, event, custom_data):
+            statuses.append(custom_data["status"])
+
+        monkeypatch.setattr("app.services.webhooks.broadcast_user_servers_event", broadcast_user_servers_event)
+        channel_name = f"private-{str(current_user.pk)}"
+        await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+        await asyncio.sleep(0.15)
+        assert statuses == ["online"]
+
+        await process_channel_vacated_event(channel_name=channel_name, current_user=current_user)
+        await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+        await asyncio.sleep(0.15)
+        assert statuses == ["online"]
+
+    @pytest.mark.asyncio
+    async def test_presence_change_after_flush_broadcast(self, redis: Redis, current_user: User, monkeypatch):
+        monkeypatch.setattr(get_settings(), "presence_throttle_ms", 50)
+        statuses = []
+
+        async def broadcast_user_servers_event(current_user_id, event, custom_data):
+            statuses.append(custom_data["status"])
+
+        monkeypatch.setattr("app.services.webhooks.broadcast_user_servers_event", broadcast_user_servers_event)
+        channel_name = f"private-{str(current_user.pk)}"
+        await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+        assert statuses == []
+        await asyncio.sleep(0.15)
+        assert statuses == ["online"]
+
+        # the flush released the window, so the next change gets its own trailing broadcast
+        assert await redis.exists(PRESENCE_THROTTLE_KEY.format(user_id=str(current_user.pk))) == 0
+        await process_channel_vacated_event(channel_name=channel_name, current_user=current_user)
+        await asyncio.sleep(0.15)
+        assert statuses == ["online", "offline"]
+
+    @pytest.mark.asyncio
+    async def test_presence_resent_after_failed_broadcast(self, redis: Redis, current_user: User, monkeypatch):
+        monkeypatch.setattr(get_settings(), "presence_throttle_ms", 50)
+        statuses: List[Optional[str]] = []
+
+        async def broadcast_user_servers_event(current_user_id, event, custom_data):
+            if not statuses:
+                statuses.append(None)
+                raise RuntimeError("pusher is down")
+            statuses.append(custom_data["status"])
+
+        monkeypatch.setattr("app.services.webhooks.broadcast_user_servers_event", broadcast_user_servers_event)
+        channel_name = f"private-{str(current_user.pk)}"
+        await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+        await asyncio.sleep(0.15)
+        assert statuses == [None]
+
+        # the failed status wasn't marked as sent, so the same status goes out with the next change
+        await process_channel_vacated_event(channel_name=channel_name, current_user=current_user)
+        await process_channel_occupied_event(channel_name=channel_name, current_user=current_user)
+        await asyncio.sleep(0.15)
+        assert statuses == [None, "online"]
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 from pymongo.database import Database
 
@@ -55,3 +57,15 @@ class TestBaseModel:
     async def test_to_dict_ok(self, db: Database, server: Server, server_channel: Channel, channel_message: Message):
         to_dict_message = await channel_message.to_dict()
         assert to_dict_message == channel_message.dump()
+
+    @pytest.mark.asyncio
+    async def test_updated_at_maintained(self, db: Database, current_user: User):
+        assert current_user.updated_at == current_user.created_at
+
+        await asyncio.sleep(0.01)
+        current_user.display_name = "renamed"
+        await current_user.commit()
+        assert current_user.updated_at > current_user.created_at
+
+        stored_user = await User.collection.find_one({"_id": current_user.pk})
+        assert stored_user["updated_at"] == current_user.updated_at.replace(tzinfo=None)
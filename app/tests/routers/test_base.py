@@ -1,8 +1,30 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Callable
+
 import arrow
+import orjson
 import pytest
 from fastapi import FastAPI
 from httpx import AsyncClient
 from pymongo.database import Database
+from redis.asyncio.client import Redis
+
+from app.config import get_settings
+from app.helpers.channels import channel_last_message_writer, set_channels_last_message_at
+from app.helpers.presence import add_user_channel
+from app.models.channel import Channel
+from app.models.server import Server
+from app.models.user import User
+from app.schemas.channels import ServerChannelCreateSchema
+from app.schemas.sections import SectionCreateSchema
+from app.schemas.servers import ServerCreateSchema
+from app.schemas.users import UserUpdateSchema
+from app.services.channels import create_server_channel, delete_channel
+from app.services.sections import create_section
+from app.services.servers import create_server, join_server
+from app.services.users import update_user_profile
+from app.services.webhooks import process_channel_occupied_event, process_channel_vacated_event
 
 
 class TestBaseRouting:
@@ -27,3 +49,306 @@ class TestBaseRouting:
         created_date = arrow.get(json_response.get("created_at"))
         assert created_date is not None
         assert (arrow.utcnow() - created_date).seconds <= 2
+
+    @pytest.mark.asyncio
+    async def test_get_ready_data_multiple_servers(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        dm_channel: Channel,
+        create_new_user: Callable,
+    ):
+        guest = await create_new_user()
+        other_server = await create_server(ServerCreateSchema(name="Other DAO"), current_user=guest)
+        await join_server(server_id=str(other_server.pk), current_user=current_user)
+        await create_server_channel(
+            ServerChannelCreateSchema(server=str(other_server.pk), name="random"), current_user=guest
+        )
+        await create_section(str(other_server.pk), SectionCreateSchema(name="second", position=1), current_user=guest)
+        await create_section(str(other_server.pk), SectionCreateSchema(name="first", position=0), current_user=guest)
+        await create_server(ServerCreateSchema(name="Not a member DAO"), current_user=guest)
+
+        response = await authorized_client.get("/ready")
+        assert response.status_code == 200
+        data = response.json()
+
+        assert data["user"]["id"] == str(current_user.pk)
+        assert [resp_server["id"] for resp_server in data["servers"]] == [str(server.pk), str(other_server.pk)]
+
+        own_server_data, other_server_data = data["servers"]
+        assert [channel["name"] for channel in own_server_data["channels"]] == ["lounge"]
+        assert [channel["name"] for channel in other_server_data["channels"]] == ["random", "lounge"]
+        assert [section["name"] for section in other_server_data["sections"]] == ["first", "second"]
+        assert own_server_data["sections"] == []
+        assert [member["user"] for member in own_server_data["members"]] == [str(current_user.pk)]
+        assert [member["user"] for member in other_server_data["members"]] == [str(guest.pk), str(current_user.pk)]
+
+        assert [dm["id"] for dm in data["dms"]] == [str(dm_channel.pk)]
+        assert {user["id"] for user in data["users"]} == {str(current_user.pk), str(guest.pk)}
+
+    @pytest.mark.asyncio
+    async def test_get_ready_served_from_snapshot(
+        self,
+        app: FastAPI,
+        db: Database,
+        redis: Redis,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+    ):
+        response = await authorized_client.get("/ready")
+        assert response.status_code == 200
+        assert await redis.exists(f"ready:{str(current_user.pk)}")
+
+        # writes that skip the service layer don't invalidate the snapshot
+        await Server.collection.update_one({"_id": server.pk}, {"$set": {"name": "Renamed DAO"}})
+        cached_response = await authorized_client.get("/ready")
+        assert cached_response.status_code == 200
+        assert cached_response.content == response.content
+        assert cached_response.json()["servers"][0]["name"] == server.name
+
+    @pytest.mark.asyncio
+    async def test_get_ready_snapshot_live_presence_and_last_message(
+        self,
+        app: FastAPI,
+        db: Database,
+        redis: Redis,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        server_channel: Channel,
+        dm_channel: Channel,
+    ):
+        data = (await authorized_client.get("/ready")).json()
+        assert {user["status"] for user in data["users"]} == {"offline"}
+
+        await Server.collection.update_one({"_id": server.pk}, {"$set": {"name": "Renamed DAO"}})
+        await add_user_channel(current_user.pk, channel_name=f"private-{str(current_user.pk)}", server_ids=[server.pk])
+        last_message_at = datetime.now(timezone.utc).replace(microsecond=0)
+        await set_channels_last_message_at({server_channel.pk: last_message_at, dm_channel.pk: last_message_at})
+
+        data = (await authorized_client.get("/ready")).json()
+        # still the snapshot, with presence and last message dates read live
+        assert data["servers"][0]["name"] == server.name
+        statuses = {user["id"]: user["status"] for user in data["users"]}
+        assert statuses[str(current_user.pk)] == "online"
+        channels = {channel["id"]: channel for channel in data["servers"][0]["channels"]}
+        assert arrow.get(channels[str(server_channel.pk)]["last_message_at"]) == last_message_at
+        assert arrow.get(data["dms"][0]["last_message_at"]) == last_message_at
+
+    @pytest.mark.asyncio
+    async def test_get_ready_snapshot_invalidated_by_writes(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        server_channel: Channel,
+        create_new_user: Callable,
+    ):
+        response = await authorized_client.get("/ready")
+        assert response.status_code == 200
+
+        response = await authorized_client.patch(f"/channels/{str(server_channel.pk)}", json={"name": "renamed"})
+        assert response.status_code == 200
+        data = (await authorized_client.get("/ready")).json()
+        assert "renamed" in [channel["name"] for channel in data["servers"][0]["channels"]]
+
+        response = await authorized_client.post(f"/channels/{str(server_channel.pk)}/ack")
+        assert response.status_code == 204
+        data = (await authorized_client.get("/ready")).json()
+        assert [read_state["channel"] for read_state in data["read_states"]] == [str(server_channel.pk)]
+
+        guest = await create_new_user()
+        await join_server(server_id=str(server.pk), current_user=guest)
+        data = (await authorized_client.get("/ready")).json()
+        assert str(guest.pk) in [member["user"] for member in data["servers"][0]["members"]]
+
+        await update_user_profile(None, UserUpdateSchema(display_name="guesty"), current_user=guest)
+        data = (await authorized_client.get("/ready")).json()
+        assert {"guesty"} == {user["display_name"] for user in data["users"] if user["id"] == str(guest.pk)}
+
+    @pytest.mark.asyncio
+    async def test_get_ready_snapshot_disabled(
+        self,
+        app: FastAPI,
+        db: Database,
+        redis: Redis,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        monkeypatch,
+    ):
+        monkeypatch.setattr(get_settings(), "ready_cache_enabled", False)
+        response = await authorized_client.get("/ready")
+        assert response.status_code == 200
+        assert not await redis.exists(f"ready:{str(current_user.pk)}")
+
+    @pytest.mark.asyncio
+    async def test_get_ready_since_version(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        server_channel: Channel,
+        dm_channel: Channel,
+        create_new_user: Callable,
+        monkeypatch,
+    ):
+        monkeypatch.setattr("app.services.base.READY_VERSION_CLOCK_SKEW_SECONDS", 0)
+        guest = await create_new_user()
+        stranger = await create_new_user()
+        other_server = await create_server(ServerCreateSchema(name="Other DAO"), current_user=guest)
+        stale_channel = await create_server_channel(
+            ServerChannelCreateSchema(server=str(server.pk), name="stale"), current_user=current_user
+        )
+
+        response = await authorized_client.get("/ready")
+        assert response.status_code == 200
+        version = response.json()["version"]
+        await asyncio.sleep(0.01)
+
+        # presence alone doesn't count as a user change
+        await process_channel_occupied_event(channel_name=f"private-{str(current_user.pk)}", current_user=current_user)
+        await process_channel_vacated_event(channel_name=f"private-{str(current_user.pk)}", current_user=current_user)
+        assert current_user.status == "offline"
+
+        response = await authorized_client.get("/ready", params={"since": version})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["version"]
+        assert data["servers"] == []
+        assert data["channels"] == []
+        assert data["members"] == []
+        assert data["users"] == []
+
+        response = await authorized_client.patch(f"/channels/{str(server_channel.pk)}", json={"name": "renamed"})
+        assert response.status_code == 200
+        await delete_channel(str(stale_channel.pk), current_user=current_user)
+        await join_server(server_id=str(server.pk), current_user=guest)
+        await join_server(server_id=str(other_server.pk), current_user=current_user)
+        await update_user_profile(None, UserUpdateSchema(display_name="guesty"), current_user=guest)
+        await update_user_profile(None, UserUpdateSchema(display_name="stranger"), current_user=stranger)
+        await channel_last_message_writer.stop()
+
+        response = await authorized_client.get("/ready", params={"since": version})
+        assert response.status_code == 200
+        data = response.json()
+
+        assert [resp_server["id"] for resp_server in data["servers"]] == [str(other_server.pk)]
+        assert data["server_updates"] == []
+        changed_channels = {channel["id"]: channel for channel in data["channels"]}
+        assert changed_channels[str(server_channel.pk)]["name"] == "renamed"
+        assert changed_channels[str(stale_channel.pk)]["deleted"] is True
+        # the join message bumps the default channel
+        assert len(changed_channels) == 3
+        assert [member["user"] for member in data["members"]] == [str(guest.pk)]
+        changed_users = {user["id"]: user for user in data["users"]}
+        assert changed_users.keys() == {str(guest.pk), str(current_user.pk)}
+        assert str(stranger.pk) not in changed_users
+        assert changed_users[str(guest.pk)]["display_name"] == "guesty"
+        assert data["dms"] == []
+        assert data["read_states"] == []
+
+    @pytest.mark.asyncio
+    async def test_get_ready_since_invalid_version(
+        self, app: FastAPI, db: Database, current_user: User, authorized_client: AsyncClient
+    ):
+        response = await authorized_client.get("/ready", params={"since": "not-a-version"})
+        assert response.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_get_ready_stream(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        dm_channel: Channel,
+        create_new_user: Callable,
+        monkeypatch,
+    ):
+        monkeypatch.setattr("app.services.base.READY_STREAM_SERVER_BATCH_SIZE", 1)
+        guest = await create_new_user()
+        other_server = await create_server(ServerCreateSchema(name="Other DAO"), current_user=guest)
+        await join_server(server_id=str(other_server.pk), current_user=current_user)
+        # let the join message's background updates land before comparing payloads
+        await asyncio.sleep(0.1)
+
+        response = await authorized_client.get("/ready")
+        assert response.status_code == 200
+        ready_data = response.json()
+
+        response = await authorized_client.get("/ready", params={"stream": True})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        chunks = [orjson.loads(line) for line in response.content.splitlines()]
+
+        assert [chunk["type"] for chunk in chunks] == [
+            "version",
+            "user",
+            "server",
+            "server",
+            "dms",
+            "users",
+            "read_states",
+        ]
+        assert chunks[1]["data"] == ready_data["user"]
+        assert [chunk["data"] for chunk in chunks if chunk["type"] == "server"] == ready_data["servers"]
+        assert chunks[4]["data"] == ready_data["dms"]
+        assert sorted(chunks[5]["data"], key=lambda user: user["id"]) == sorted(
+            ready_data["users"], key=lambda user: user["id"]
+        )
+        assert chunks[6]["data"] == ready_data["read_states"]
+
+    @pytest.mark.asyncio
+    async def test_get_ready_stream_since_not_allowed(
+        self, app: FastAPI, db: Database, current_user: User, authorized_client: AsyncClient
+    ):
+        response = await authorized_client.get("/ready", params={"stream": True, "since": "MA"})
+        assert response.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_get_ready_lazy_members(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        create_new_user: Callable,
+        monkeypatch,
+    ):
+        monkeypatch.setattr(get_settings(), "ready_cache_enabled", False)
+        monkeypatch.setattr(get_settings(), "ready_lazy_members_threshold", 3)
+        monkeypatch.setattr("app.services.base.READY_LAZY_MEMBERS_RECENT_MESSAGES", 1)
+        offline_guest = await create_new_user()
+        online_guest = await create_new_user()
+        recent_guest = await create_new_user()
+        for guest in [offline_guest, online_guest, recent_guest]:
+            await join_server(server_id=str(server.pk), current_user=guest)
+        await add_user_channel(online_guest.pk, channel_name=f"private-{str(online_guest.pk)}", server_ids=[server.pk])
+
+        response = await authorized_client.get("/ready")
+        assert response.status_code == 200
+        server_data = response.json()["servers"][0]
+        assert server_data["member_count"] == 4
+        assert server_data["lazy_members"] is True
+        assert {member["user"] for member in server_data["members"]} == {
+            str(current_user.pk),
+            str(online_guest.pk),
+            str(recent_guest.pk),
+        }
+        assert str(offline_guest.pk) not in [user["id"] for user in response.json()["users"]]
+
+        monkeypatch.setattr(get_settings(), "ready_lazy_members_threshold", 4)
+        server_data = (await authorized_client.get("/ready")).json()["servers"][0]
+        assert server_data["lazy_members"] is False
+        assert len(server_data["members"]) == 4
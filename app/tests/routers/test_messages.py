@@ -1,22 +1,28 @@
 import asyncio
 import random
-from typing import Callable
+from datetime import datetime, timezone
+from typing import Callable, List
 
 import arrow
 import pytest
 from bson import ObjectId
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
 from httpx import AsyncClient
 from pymongo.database import Database
 
+from app.helpers.channels import channel_last_message_writer
 from app.helpers.message_utils import blockify_content, get_message_mentions
-from app.models.channel import Channel
+from app.models.channel import Channel, ChannelReadState
 from app.models.message import Message, MessageReaction
 from app.models.server import Server
 from app.models.user import User
-from app.schemas.messages import MessageCreateSchema
-from app.services.crud import create_item, get_item_by_id
-from app.services.messages import get_messages
+from app.schemas.messages import MessageCreateSchema, MessageSchema
+from app.services.channels import mark_channel_as_read
+from app.services.crud import create_item, get_item, get_item_by_id
+from app.services.messages import get_messages, process_message_mentions
 
 
 class TestMessagesRoutes:
@@ -246,7 +252,7 @@ class TestMessagesRoutes:
         assert json_response["server"] == data["server"] == str(server.id)
         assert json_response["channel"] == data["channel"] == str(server_channel.id)
 
-        await asyncio.sleep(random.random())
+        await channel_last_message_writer.stop()
         channel = await get_item_by_id(id_=server_channel.id, result_obj=Channel)
         assert channel.last_message_at is not None
         created_at = arrow.get(json_response["created_at"])
@@ -971,6 +977,40 @@ class TestMessagesRoutes:
         assert "mention_count" in json_response[0]
         assert json_response[0]["mention_count"] == 1
 
+    @pytest.mark.asyncio
+    async def test_retried_mention_task_counts_once(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        server: Server,
+        server_channel: Channel,
+        guest_user: User,
+    ):
+        blocks = [{"type": "paragraph", "children": [{"text": "hey "}, {"type": "user", "ref": str(current_user.pk)}]}]
+        message_model = MessageCreateSchema(server=str(server.pk), channel=str(server_channel.pk), blocks=blocks)
+        message = await create_item(message_model, result_obj=Message, current_user=guest_user, user_field="author")
+
+        for _ in range(3):
+            await process_message_mentions(message, guest_user, server_channel)
+
+        filters = {"user": current_user.pk, "channel": server_channel.pk}
+        read_state = await get_item(filters=dict(filters), result_obj=ChannelReadState)
+        assert read_state.mention_count == 1
+
+        await mark_channel_as_read(str(server_channel.pk), last_read_at=None, current_user=current_user)
+        read_state = await get_item(filters=dict(filters), result_obj=ChannelReadState)
+        assert read_state.mention_count == 0
+        assert read_state.counted_mentions == []
+
+        second_message = await create_item(
+            message_model, result_obj=Message, current_user=guest_user, user_field="author"
+        )
+        await process_message_mentions(second_message, guest_user, server_channel)
+        await process_message_mentions(second_message, guest_user, server_channel)
+        read_state = await get_item(filters=dict(filters), result_obj=ChannelReadState)
+        assert read_state.mention_count == 1
+
     @pytest.mark.asyncio
     async def test_get_specific_message(
         self,
@@ -1241,3 +1281,102 @@ class TestMessagesRoutes:
         expected_message_ids = [str(message.pk) for message in expected_messages]
         result_message_ids = [message["id"] for message in json_resp]
         assert expected_message_ids[::-1] == result_message_ids
+
+    @pytest.mark.asyncio
+    async def test_get_messages_matches_response_model(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        server_channel: Channel,
+        channel_message: Message,
+    ):
+        channel_message.reactions = [MessageReaction(emoji="😍", count=1, users=[current_user.pk])]
+        await channel_message.commit()
+
+        for i in range(5):
+            await create_item(
+                item=MessageCreateSchema(
+                    server=str(server.id),
+                    channel=str(server_channel.id),
+                    blocks=[{"type": "paragraph", "children": [{"text": f"message {i}"}]}],
+                    reply_to=str(channel_message.pk),
+                ),
+                result_obj=Message,
+                current_user=current_user,
+                user_field="author",
+            )
+
+        params_list: List[dict] = [
+            {},
+            {"limit": 3, "before": str(channel_message.pk)},
+            {"limit": 4, "around": str(channel_message.pk)},
+        ]
+        for params in params_list:
+            messages = await get_messages(channel_id=str(server_channel.id), current_user=current_user, **params)
+            field = create_response_field(name="Response", type_=List[MessageSchema])
+            expected_body = ORJSONResponse(await serialize_response(field=field, response_content=messages)).body
+
+            response = await authorized_client.get(f"channels/{str(server_channel.pk)}/messages", params=params)
+            assert response.status_code == 200
+            assert response.content == expected_body
+
+    @pytest.mark.asyncio
+    async def test_get_messages_with_cursors(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        server_channel: Channel,
+    ):
+        # half of the messages share the same created_at so paging has to break ties on _id
+        created_at = datetime.now(timezone.utc)
+        for i in range(10):
+            message = Message(server=server.pk, channel=server_channel.pk, author=current_user.pk, content=f"{i}")
+            if i % 2 == 0:
+                message.created_at = created_at
+            await message.commit()
+
+        expected_ids = [
+            str(message.pk)
+            for message in await get_messages(
+                channel_id=str(server_channel.id), current_user=current_user, sort_by_field="created_at", limit=100
+            )
+        ]
+        assert len(expected_ids) == 10
+
+        pages = []
+        params = {"limit": 3}
+        while True:
+            response = await authorized_client.get(f"channels/{str(server_channel.pk)}/messages", params=params)
+            assert response.status_code == 200
+            pages.append([message["id"] for message in response.json()])
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                break
+            params = {"limit": 3, "cursor": next_cursor}
+
+        assert [len(page) for page in pages] == [3, 3, 3, 1]
+        assert [message_id for page in pages for message_id in page] == expected_ids
+
+        prev_cursor = response.headers["X-Prev-Cursor"]
+        response = await authorized_client.get(
+            f"channels/{str(server_channel.pk)}/messages", params={"limit": 3, "cursor": prev_cursor}
+        )
+        assert response.status_code == 200
+        assert [message["id"] for message in response.json()] == pages[2]
+        assert "X-Next-Cursor" in response.headers
+        assert "X-Prev-Cursor" in response.headers
+
+    @pytest.mark.asyncio
+    async def test_get_messages_with_invalid_cursor(
+        self, app: FastAPI, db: Database, authorized_client: AsyncClient, server_channel: Channel
+    ):
+        response = await authorized_client.get(
+            f"channels/{str(server_channel.pk)}/messages", params={"cursor": "not-a-cursor"}
+        )
+        assert response.status_code == 400
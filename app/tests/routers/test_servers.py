@@ -7,6 +7,7 @@ from fastapi import FastAPI
 from httpx import AsyncClient
 from pymongo.database import Database
 
+from app.helpers.pagination import NEXT_CURSOR_HEADER
 from app.models.server import Server, ServerJoinRule, ServerMember
 from app.models.user import User
 from app.schemas.channels import DMChannelCreateSchema, ServerChannelCreateSchema
@@ -14,7 +15,7 @@ from app.schemas.servers import ServerCreateSchema
 from app.schemas.users import UserCreateSchema
 from app.services.channels import create_dm_channel, create_server_channel
 from app.services.crud import get_item, get_items, update_item
-from app.services.servers import create_server
+from app.services.servers import create_server, join_server
 from app.services.users import create_user
 
 
@@ -119,6 +120,56 @@ class TestServerRoutes:
         assert resp_server["id"] == str(server.id)
         assert resp_server["member_count"] == 1
 
+    @pytest.mark.asyncio
+    async def test_list_servers_member_counts(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        create_new_user: Callable,
+    ):
+        server_model = ServerCreateSchema(name="Empty DAO")
+        empty_server = await create_server(server_model, current_user=current_user)
+        await ServerMember.collection.update_many({"server": empty_server.pk}, {"$set": {"deleted": True}})
+
+        for _ in range(3):
+            new_user = await create_new_user()
+            await join_server(server_id=str(server.pk), current_user=new_user)
+
+        response = await authorized_client.get("/servers")
+        assert response.status_code == 200
+        member_counts = {resp_server["id"]: resp_server["member_count"] for resp_server in response.json()}
+        assert member_counts == {str(server.pk): 4, str(empty_server.pk): 0}
+
+    @pytest.mark.asyncio
+    async def test_list_servers_paginated(
+        self, app: FastAPI, db: Database, current_user: User, authorized_client: AsyncClient, server: Server
+    ):
+        for name in ["Nouns", "Lil Nouns", "Gnars"]:
+            await create_server(ServerCreateSchema(name=name), current_user=current_user)
+
+        response = await authorized_client.get("/servers")
+        assert response.status_code == 200
+        all_servers = sorted(response.json(), key=lambda resp_server: resp_server["id"])
+        assert len(all_servers) == 4
+
+        paged_servers = []
+        response = await authorized_client.get("/servers", params={"limit": 3})
+        while True:
+            assert response.status_code == 200
+            paged_servers.extend(response.json())
+            next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if not next_cursor:
+                break
+            response = await authorized_client.get("/servers", params={"limit": 3, "cursor": next_cursor})
+
+        assert paged_servers == all_servers
+
+        response = await authorized_client.get("/servers", params={"cursor": "nope"})
+        assert response.status_code == 400
+
     @pytest.mark.asyncio
     async def test_join_server_no_rules(
         self,
@@ -346,6 +397,8 @@ class TestServerRoutes:
         for field, value in json_response.items():
             if field in final_data:
                 assert json_response[field] == final_data[field]
+            elif field == "updated_at":
+                assert json_response[field] >= original_response[field]
             else:
                 assert json_response[field] == original_response[field]
 
@@ -541,3 +594,39 @@ class TestServerRoutes:
                 if section_position == update["position"]:
                     assert section["name"] == update["name"]
                     assert section["channels"] == update["channels"]
+
+    @pytest.mark.asyncio
+    async def test_list_server_members_paginated(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        create_new_user: Callable,
+    ):
+        for _ in range(4):
+            guest = await create_new_user()
+            await join_server(server_id=str(server.pk), current_user=guest)
+
+        response = await authorized_client.get(f"/servers/{str(server.pk)}/members")
+        assert response.status_code == 200
+        all_members = response.json()
+        assert len(all_members) == 5
+
+        paged_members = []
+        response = await authorized_client.get(f"/servers/{str(server.pk)}/members", params={"limit": 2})
+        while True:
+            assert response.status_code == 200
+            paged_members.extend(response.json())
+            next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if not next_cursor:
+                break
+            response = await authorized_client.get(
+                f"/servers/{str(server.pk)}/members", params={"limit": 2, "cursor": next_cursor}
+            )
+
+        assert paged_members == all_members
+
+        response = await authorized_client.get(f"/servers/{str(server.pk)}/members", params={"cursor": "nope"})
+        assert response.status_code == 400
@@ -5,6 +5,7 @@ from fastapi import FastAPI
 from httpx import AsyncClient
 from pymongo.database import Database
 
+from app.helpers.pagination import NEXT_CURSOR_HEADER
 from app.models.channel import Channel
 from app.models.message import Message
 from app.models.server import Server
@@ -259,3 +260,43 @@ class TestStarsRoutes:
         assert len(stars) == 1
         assert stars[0]["type"] == "server"
         assert stars[0]["server"] == data["server"]
+
+    @pytest.mark.asyncio
+    async def test_list_stars_paginated(
+        self,
+        app: FastAPI,
+        db: Database,
+        current_user: User,
+        authorized_client: AsyncClient,
+        server: Server,
+        server_channel: Channel,
+        channel_message: Message,
+    ):
+        for data in [
+            {"server": str(server.pk)},
+            {"channel": str(server_channel.pk)},
+            {"message": str(channel_message.pk)},
+        ]:
+            response = await authorized_client.post("/stars", json=data)
+            assert response.status_code == 201
+
+        response = await authorized_client.get("/stars")
+        assert response.status_code == 200
+        all_stars = sorted(response.json(), key=lambda star: star["id"])
+        assert len(all_stars) == 3
+
+        paged_stars = []
+        response = await authorized_client.get("/stars", params={"limit": 2})
+        while True:
+            assert response.status_code == 200
+            paged_stars.extend(response.json())
+            next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if not next_cursor:
+                break
+            response = await authorized_client.get("/stars", params={"limit": 2, "cursor": next_cursor})
+
+        assert paged_stars == all_stars
+
+        response = await authorized_client.get("/stars", params={"type": "channel", "limit": 2})
+        assert [star["channel"] for star in response.json()] == [str(server_channel.pk)]
+        assert NEXT_CURSOR_HEADER not in response.headers
@@ -1,17 +1,39 @@
+import asyncio
+import json
+from typing import Optional, cast
+
 import pytest
-from fastapi import FastAPI
+from fastapi import FastAPI, WebSocket
 from httpx import AsyncClient
 from pymongo.database import Database
+from redis.asyncio.client import Redis
 
+from app.helpers.jwt import generate_jwt_token
+from app.helpers.presence import add_user_channel
 from app.models.channel import Channel
 from app.models.message import Message
 from app.models.server import Server, ServerMember
 from app.models.user import User
+from app.routers.websockets import authenticate_gateway_websocket
 from app.schemas.messages import MessageCreateSchema
 from app.services.crud import create_item, get_items
 from app.services.websockets import get_channel_online_channels
 
 
+class _FakeWebSocket:
+    def __init__(self, message: Optional[str]):
+        self.message = message
+
+    async def receive_text(self) -> str:
+        if self.message is None:
+            await asyncio.sleep(1)
+        return self.message or ""
+
+
+def _fake_websocket(message: Optional[str]) -> WebSocket:
+    return cast(WebSocket, _FakeWebSocket(message))
+
+
 class TestWebsocketRoutes:
     @pytest.mark.asyncio
     async def test_websocket_auth_no_provider_nok(
@@ -90,8 +112,7 @@ class TestWebsocketRoutes:
         assert member.server == server
         assert member.user == current_user
 
-        current_user.online_channels = [f"private-{str(current_user.id)}"]
-        await current_user.commit()
+        await add_user_channel(current_user.pk, channel_name=f"private-{str(current_user.id)}", server_ids=[server.pk])
 
         message_channel = await message.channel.fetch()
         channels = await get_channel_online_channels(channel=message_channel, current_user=current_user)
@@ -100,3 +121,21 @@ class TestWebsocketRoutes:
         assert len(channels) == 1
         channels = await get_channel_online_channels(channel=message_channel, current_user=current_user)
         assert len(channels) == 1
+
+    @pytest.mark.asyncio
+    async def test_gateway_authenticates_with_first_frame(self, db: Database, redis: Redis, current_user: User):
+        access_token = generate_jwt_token(data={"sub": str(current_user.pk)})
+        await redis.sadd(f"refresh_tokens:{str(current_user.pk)}", "refresh-token")
+        websocket = _fake_websocket(json.dumps({"event": "authenticate", "data": {"token": access_token}}))
+        user = await authenticate_gateway_websocket(websocket)
+        assert user and user.pk == current_user.pk
+
+    @pytest.mark.asyncio
+    async def test_gateway_rejects_bad_first_frame(self, db: Database, redis: Redis, current_user: User):
+        for message in ["not json", json.dumps({"event": "authenticate", "data": {"token": "bad"}}), "{}"]:
+            assert await authenticate_gateway_websocket(_fake_websocket(message)) is None
+
+    @pytest.mark.asyncio
+    async def test_gateway_auth_times_out(self, monkeypatch):
+        monkeypatch.setattr("app.routers.websockets.GATEWAY_AUTH_TIMEOUT_SECONDS", 0.01)
+        assert await authenticate_gateway_websocket(_fake_websocket(None)) is None
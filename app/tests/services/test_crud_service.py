@@ -5,14 +5,27 @@ from datetime import datetime
 import arrow
 import pytest
 from pymongo.database import Database
+from redis.asyncio.client import Redis
 
+from app.helpers.cache_utils import local_cache
 from app.models.channel import Channel
 from app.models.server import Server, ServerMember
 from app.models.user import User
 from app.schemas.channels import ServerChannelCreateSchema
 from app.schemas.servers import ServerCreateSchema
 from app.schemas.users import UserCreateSchema
-from app.services.crud import create_item, create_items, get_item_by_id, get_items
+from app.services.crud import (
+    count_items_by_field,
+    create_item,
+    create_items,
+    delete_items,
+    find_and_update_item,
+    get_item,
+    get_item_by_id,
+    get_items,
+    iter_items,
+    update_item,
+)
 
 
 class TestCRUDService:
@@ -82,3 +95,109 @@ class TestCRUDService:
             await get_item_by_id(id_="0", result_obj=Server, current_user=current_user)
 
         assert "must be ObjectId" in e_info.value.args[0]
+
+    @pytest.mark.asyncio
+    async def test_get_item_by_id_cached(self, db: Database, redis: Redis, current_user: User):
+        local_cache.clear()
+        user = await get_item_by_id(id_=str(current_user.pk), result_obj=User)
+        assert user.wallet_address == current_user.wallet_address
+        assert await redis.exists(f"documents:users:{str(current_user.pk)}")
+
+        await User.collection.update_one({"_id": current_user.pk}, {"$set": {"display_name": "not-cached"}})
+        cached_user = await get_item_by_id(id_=str(current_user.pk), result_obj=User)
+        assert cached_user.display_name == current_user.display_name
+
+        cached_user = await get_item(filters={"_id": current_user.pk}, result_obj=User)
+        assert cached_user.display_name == current_user.display_name
+
+    @pytest.mark.asyncio
+    async def test_get_item_by_id_not_cached_model(self, db: Database, redis: Redis, server: Server):
+        member = await get_item(filters={"server": server.pk}, result_obj=ServerMember)
+        await get_item_by_id(id_=str(member.pk), result_obj=ServerMember)
+        assert not await redis.exists(f"documents:server_members:{str(member.pk)}")
+
+    @pytest.mark.asyncio
+    async def test_update_item_invalidates_cache(self, db: Database, redis: Redis, current_user: User):
+        user = await get_item_by_id(id_=str(current_user.pk), result_obj=User)
+        await update_item(item=user, data={"display_name": "updated"})
+        assert not await redis.exists(f"documents:users:{str(current_user.pk)}")
+
+        cached_user = await get_item_by_id(id_=str(current_user.pk), result_obj=User)
+        assert cached_user.display_name == "updated"
+
+    @pytest.mark.asyncio
+    async def test_find_and_update_item_invalidates_cache(self, db: Database, redis: Redis, current_user: User):
+        await get_item_by_id(id_=str(current_user.pk), result_obj=User)
+        await find_and_update_item(
+            filters={"_id": current_user.pk}, data={"$set": {"status": "online"}}, result_obj=User
+        )
+        cached_user = await get_item_by_id(id_=str(current_user.pk), result_obj=User)
+        assert cached_user.status == "online"
+
+    @pytest.mark.asyncio
+    async def test_delete_items_invalidates_cache(self, db: Database, redis: Redis, current_user: User, server: Server):
+        channels = await get_items(filters={"server": server.pk}, result_obj=Channel, current_user=current_user)
+        channel = await get_item_by_id(id_=str(channels[0].pk), result_obj=Channel)
+        assert channel.deleted is False
+
+        await delete_items(filters={"server": server.pk}, result_obj=Channel, current_user=current_user)
+        cached_channel = await get_item_by_id(id_=str(channel.pk), result_obj=Channel)
+        assert cached_channel.deleted is True
+        assert await get_item(filters={"_id": channel.pk}, result_obj=Channel) is None
+
+    @pytest.mark.asyncio
+    async def test_get_items_with_projection(self, db: Database, current_user: User, server: Server):
+        members = await get_items(
+            filters={"server": server.pk}, result_obj=ServerMember, current_user=current_user, projection=["user"]
+        )
+        assert len(members) == 1
+        assert members[0].user.pk == current_user.pk
+        assert members[0].server is None
+
+    @pytest.mark.asyncio
+    async def test_get_item_by_id_with_projection(self, db: Database, redis: Redis, current_user: User):
+        user = await get_item_by_id(id_=str(current_user.pk), result_obj=User, projection=["wallet_address"])
+        assert user.pk == current_user.pk
+        assert user.wallet_address == current_user.wallet_address
+        assert user.display_name is None
+        assert not await redis.exists(f"documents:users:{str(current_user.pk)}")
+
+    @pytest.mark.asyncio
+    async def test_iter_items_batches(self, db: Database, current_user: User, server: Server):
+        to_create_channels = [ServerChannelCreateSchema(server=str(server.pk), name=f"channel-{i}") for i in range(99)]
+        await create_items(to_create_channels, result_obj=Channel, current_user=current_user, user_field="owner")
+
+        batches = [
+            batch
+            async for batch in iter_items(
+                filters={"server": server.pk}, result_obj=Channel, current_user=current_user, batch_size=40
+            )
+        ]
+        assert [len(batch) for batch in batches] == [40, 40, 20]
+
+        channel_ids = [channel.pk for batch in batches for channel in batch]
+        assert channel_ids == sorted(channel_ids)
+
+    @pytest.mark.asyncio
+    async def test_iter_items_skips_deleted(self, db: Database, current_user: User, server: Server):
+        await delete_items(filters={"server": server.pk}, result_obj=Channel, current_user=current_user)
+        batches = [
+            batch async for batch in iter_items(filters={"server": server.pk}, result_obj=Channel, current_user=None)
+        ]
+        assert batches == []
+
+    @pytest.mark.asyncio
+    async def test_count_items_by_field(self, db: Database, current_user: User, server: Server):
+        other_server = await create_item(
+            ServerCreateSchema(name="Other DAO"), result_obj=Server, current_user=current_user, user_field="owner"
+        )
+        members = [ServerMember(server=other_server.pk, user=current_user.pk) for _ in range(3)]
+        await ServerMember.collection.insert_many([member.to_mongo() for member in members])
+        await ServerMember.collection.update_one({"server": other_server.pk}, {"$set": {"deleted": True}})
+
+        counts = await count_items_by_field(
+            filters={"server": {"$in": [server.pk, other_server.pk]}},
+            result_obj=ServerMember,
+            group_by_field="server",
+        )
+        assert counts == {server.pk: 1, other_server.pk: 2}
@@ -0,0 +1,103 @@
+from typing import List
+
+import pytest
+from pymongo.database import Database
+
+from app.helpers.db_utils import create_all_indexes
+from app.helpers.pagination import PageCursor
+from app.models.channel import Channel
+from app.models.message import Message
+from app.models.server import Server, ServerMember
+from app.models.user import User
+from app.services.crud import find_items
+
+
+def _get_plan_stages(plan: dict) -> List[str]:
+    stages = []
+    if "stage" in plan:
+        stages.append(plan["stage"])
+    for key in ["inputStage", "queryPlan"]:
+        if key in plan:
+            stages.extend(_get_plan_stages(plan[key]))
+    for input_stage in plan.get("inputStages", []):
+        stages.extend(_get_plan_stages(input_stage))
+    return stages
+
+
+async def _get_winning_plan_stages(cursor) -> List[str]:
+    explain = await cursor.explain()
+    return _get_plan_stages(explain["queryPlanner"]["winningPlan"])
+
+
+class TestQueryPlans:
+    @pytest.fixture(autouse=True)
+    async def indexes(self, db: Database):
+        await create_all_indexes()
+
+    @pytest.mark.asyncio
+    async def test_list_messages_uses_index(self, db: Database, server: Server, server_channel: Channel):
+        cursor = find_items(filters={"channel": server_channel.pk, "server": server.pk}, result_obj=Message, limit=50)
+        stages = await _get_winning_plan_stages(cursor)
+        assert "IXSCAN" in stages
+        assert "COLLSCAN" not in stages
+        assert "SORT" not in stages
+
+    @pytest.mark.asyncio
+    async def test_list_messages_before_uses_index(
+        self, db: Database, server: Server, server_channel: Channel, channel_message: Message
+    ):
+        cursor = find_items(
+            filters={"channel": server_channel.pk, "server": server.pk},
+            result_obj=Message,
+            before=str(channel_message.pk),
+            limit=50,
+        )
+        stages = await _get_winning_plan_stages(cursor)
+        assert "IXSCAN" in stages
+        assert "COLLSCAN" not in stages
+        assert "SORT" not in stages
+
+    @pytest.mark.asyncio
+    async def test_list_server_members_uses_index(self, db: Database, server: Server):
+        cursor = find_items(
+            filters={"server": server.pk}, result_obj=ServerMember, sort_by_field="_id", sort_by_direction=1
+        )
+        stages = await _get_winning_plan_stages(cursor)
+        assert "IXSCAN" in stages
+        assert "COLLSCAN" not in stages
+        assert "SORT" not in stages
+
+    @pytest.mark.asyncio
+    async def test_list_user_memberships_uses_index(self, db: Database, current_user: User, server: Server):
+        cursor = find_items(
+            filters={"user": current_user.pk}, result_obj=ServerMember, sort_by_field="joined_at", sort_by_direction=1
+        )
+        stages = await _get_winning_plan_stages(cursor)
+        assert "IXSCAN" in stages
+        assert "COLLSCAN" not in stages
+        assert "SORT" not in stages
+
+    @pytest.mark.asyncio
+    async def test_list_server_channels_uses_index(self, db: Database, server: Server):
+        cursor = find_items(filters={"server": server.pk}, result_obj=Channel)
+        stages = await _get_winning_plan_stages(cursor)
+        assert "IXSCAN" in stages
+        assert "COLLSCAN" not in stages
+        assert "SORT" not in stages
+
+    @pytest.mark.asyncio
+    async def test_list_messages_cursor_uses_index(
+        self, db: Database, server: Server, server_channel: Channel, channel_message: Message
+    ):
+        for reverse in [False, True]:
+            cursor = PageCursor("created_at", -1, channel_message.created_at, channel_message.pk, reverse=reverse)
+            item_query = find_items(
+                filters={"channel": server_channel.pk, "server": server.pk},
+                result_obj=Message,
+                cursor=cursor,
+                limit=50,
+            )
+            stages = await _get_winning_plan_stages(item_query)
+            assert "IXSCAN" in stages
+            assert "COLLSCAN" not in stages
+            assert "SORT" not in stages
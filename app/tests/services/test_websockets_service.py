@@ -0,0 +1,251 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List, Optional
+
+import pytest
+from bson import ObjectId
+from pusher.errors import PusherBadRequest, PusherBadStatus
+from pymongo.database import Database
+from redis.asyncio.client import Redis
+
+from app.commands.replay_dead_letters import replay_dead_letter_tasks
+from app.config import get_settings
+from app.helpers.presence import add_user_channel
+from app.helpers.queue_utils import queue_bg_task
+from app.helpers.task_queue import get_task_name
+from app.helpers.websockets import PooledAsyncIOBackend, PusherServerError, pusher_client
+from app.helpers.ws_events import WebSocketServerEvent
+from app.models.channel import Channel
+from app.models.message import Message
+from app.models.server import Server
+from app.models.task import DeadLetterTask
+from app.models.user import User
+from app.services.websockets import (
+    BroadcastError,
+    broadcast_message_event,
+    broadcast_server_event,
+    pusher_broadcast_messages,
+    pusher_broadcast_user_messages,
+    resend_broadcast_event,
+)
+
+
+def _mock_server_online_channels(monkeypatch, pusher_channels: List[str]):
+    async def get_server_online_channels(server: Server, current_user: Optional[User]):
+        return pusher_channels
+
+    monkeypatch.setattr("app.services.websockets.get_server_online_channels", get_server_online_channels)
+
+
+class TestWebsocketsService:
+    @pytest.mark.asyncio
+    async def test_broadcast_triggers_batches_concurrently(self, monkeypatch):
+        monkeypatch.setattr(get_settings(), "pusher_max_concurrent_requests", 3)
+        in_flight = 0
+        max_in_flight = 0
+        triggered_channels = []
+
+        async def trigger(channels, event_name, data):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            triggered_channels.extend(channels)
+            in_flight -= 1
+
+        monkeypatch.setattr(pusher_client, "trigger", trigger)
+        pusher_channels = [f"private-{index}" for index in range(900)]
+        _mock_server_online_channels(monkeypatch, pusher_channels)
+        await pusher_broadcast_messages(
+            event=WebSocketServerEvent.MESSAGE_CREATE,
+            current_user=None,
+            data={},
+            scope="server",
+            server=Server(name="test"),
+        )
+
+        assert sorted(triggered_channels) == sorted(pusher_channels)
+        assert max_in_flight == 3
+
+    @pytest.mark.asyncio
+    async def test_concurrent_broadcasts_share_request_limit(self, monkeypatch):
+        monkeypatch.setattr(get_settings(), "pusher_max_concurrent_requests", 3)
+        in_flight = 0
+        max_in_flight = 0
+
+        async def trigger(channels, event_name, data):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        monkeypatch.setattr(pusher_client, "trigger", trigger)
+        _mock_server_online_channels(monkeypatch, [f"private-{index}" for index in range(270)])
+        await asyncio.gather(
+            *[
+                pusher_broadcast_messages(
+                    event=WebSocketServerEvent.MESSAGE_CREATE,
+                    current_user=None,
+                    data={},
+                    scope="server",
+                    server=Server(name="test"),
+                )
+                for _ in range(3)
+            ]
+        )
+        assert max_in_flight == 3
+
+    @pytest.mark.asyncio
+    async def test_broadcast_retries_failed_batches(self, monkeypatch):
+        monkeypatch.setattr("app.services.websockets.PUSHER_RETRY_BACKOFF_SECONDS", 0)
+        monkeypatch.setattr(get_settings(), "pusher_trigger_retries", 2)
+        attempts = {}
+        triggered_channels = []
+
+        async def trigger(channels, event_name, data):
+            attempts[channels[0]] = attempts.get(channels[0], 0) + 1
+            if channels[0] == "private-90" and attempts[channels[0]] < 3:
+                raise PusherServerError(503, "unavailable")
+            if channels[0] == "private-180":
+                raise PusherBadRequest("invalid channel")
+            if channels[0] == "private-270":
+                raise PusherServerError(503, "unavailable")
+            if channels[0] == "private-360":
+                raise PusherBadStatus("413: payload too large")
+            triggered_channels.extend(channels)
+
+        monkeypatch.setattr(pusher_client, "trigger", trigger)
+        pusher_channels = [f"private-{index}" for index in range(450)]
+        _mock_server_online_channels(monkeypatch, pusher_channels)
+        with pytest.raises(BroadcastError) as exc_info:
+            await pusher_broadcast_messages(
+                event=WebSocketServerEvent.MESSAGE_CREATE,
+                current_user=None,
+                data={},
+                scope="server",
+                server=Server(name="test"),
+            )
+
+        assert attempts == {"private-0": 1, "private-90": 3, "private-180": 1, "private-270": 3, "private-360": 1}
+        assert sorted(triggered_channels) == sorted(pusher_channels[:180])
+        # only the batch that failed on a transient error is left to replay
+        assert exc_info.value.remaining == [
+            (resend_broadcast_event, (WebSocketServerEvent.MESSAGE_CREATE.value, pusher_channels[270:360], {}), {})
+        ]
+
+    @pytest.mark.asyncio
+    async def test_backend_only_flags_retryable_statuses(self):
+        class Response:
+            def __init__(self, status: int):
+                self.status = status
+
+            async def text(self, encoding):
+                return "error"
+
+            def release(self):
+                pass
+
+        class Session:
+            status = 200
+
+            async def request(self, *args, **kwargs):
+                return Response(self.status)
+
+        class SessionPool:
+            session = Session()
+
+            def get_session(self):
+                return self.session
+
+        backend = PooledAsyncIOBackend(SimpleNamespace(timeout=5), SessionPool())
+        request = SimpleNamespace(
+            method="GET",
+            base_url="https://api.pusherapp.com",
+            path="/apps/1/channels",
+            query_params={},
+            body=None,
+            headers={},
+        )
+        for status, error in [(503, PusherServerError), (429, PusherServerError), (413, PusherBadStatus)]:
+            SessionPool.session.status = status
+            with pytest.raises(error) as exc_info:
+                await backend.send_request(request)
+            assert isinstance(exc_info.value, PusherServerError) == (error is PusherServerError)
+
+    @pytest.mark.asyncio
+    async def test_failed_broadcast_batches_dead_lettered(
+        self, db: Database, current_user: User, server: Server, monkeypatch
+    ):
+        monkeypatch.setattr(get_settings(), "pusher_trigger_retries", 0)
+        failing = {"private-90": True}
+        triggered_channels = []
+
+        async def trigger(channels, event_name, data):
+            if failing.get(channels[0]):
+                raise PusherServerError(503, "unavailable")
+            triggered_channels.extend(channels)
+
+        monkeypatch.setattr(pusher_client, "trigger", trigger)
+        pusher_channels = [f"private-{index}" for index in range(180)]
+        _mock_server_online_channels(monkeypatch, pusher_channels)
+        await queue_bg_task(broadcast_server_event, server, current_user, WebSocketServerEvent.SERVER_UPDATE)
+        await asyncio.sleep(0.05)
+
+        [dead_letter] = [dead_letter async for dead_letter in DeadLetterTask.find({})]
+        assert dead_letter.task == get_task_name(resend_broadcast_event)
+        assert sorted(triggered_channels) == sorted(pusher_channels[:90])
+
+        failing.clear()
+        assert await replay_dead_letter_tasks() == 1
+        assert sorted(triggered_channels) == sorted(pusher_channels)
+
+    @pytest.mark.asyncio
+    async def test_broadcast_loaded_documents_skips_refetch(
+        self, current_user: User, server_channel: Channel, channel_message: Message, monkeypatch
+    ):
+        async def get_item_by_id(*args, **kwargs):
+            raise AssertionError("documents shouldn't be refetched")
+
+        monkeypatch.setattr("app.services.websockets.get_item_by_id", get_item_by_id)
+        triggered = []
+
+        async def trigger(channels, event_name, data):
+            if event_name == WebSocketServerEvent.MESSAGE_CREATE.value:
+                triggered.append(data)
+
+        monkeypatch.setattr(pusher_client, "trigger", trigger)
+
+        async def get_channel_online_channels(channel: Channel, current_user: Optional[User]):
+            return ["private-1"]
+
+        monkeypatch.setattr("app.services.websockets.get_channel_online_channels", get_channel_online_channels)
+        await broadcast_message_event(
+            channel_message, current_user, WebSocketServerEvent.MESSAGE_CREATE, channel=server_channel
+        )
+        assert triggered == [{"message": channel_message.dump()}]
+
+    @pytest.mark.asyncio
+    async def test_broadcast_per_user_payloads_batched(self, redis: Redis, monkeypatch):
+        batches = []
+
+        async def trigger_batch(batch):
+            batches.append(batch)
+
+        monkeypatch.setattr(pusher_client, "trigger_batch", trigger_batch)
+        users = [User(wallet_address=f"0x{index}") for index in range(25)]
+        for user in users:
+            user.id = ObjectId()
+            await add_user_channel(user.pk, channel_name=f"private-{str(user.pk)}", server_ids=[])
+
+        await pusher_broadcast_user_messages(
+            event=WebSocketServerEvent.NOTIFY_USER_MENTION,
+            users_data=[(user, {"mention_count": index}) for index, user in enumerate(users)],
+        )
+
+        assert [len(batch) for batch in batches] == [10, 10, 5]
+        events = [event for batch in batches for event in batch]
+        assert events == [
+            {"channel": f"private-{str(user.pk)}", "name": "NOTIFY_USER_MENTION", "data": {"mention_count": index}}
+            for index, user in enumerate(users)
+        ]
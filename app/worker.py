@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import logging.config
+import os
+import signal
+import socket
+import time
+from typing import Set
+
+import sentry_sdk
+from redis.exceptions import RedisError
+from sentry_sdk import capture_exception
+
+from app.config import get_settings
+from app.helpers.cache_utils import close_redis_connection, connect_to_redis
+from app.helpers.channels import stop_channel_last_message_writer
+from app.helpers.db_utils import close_mongo_connection, connect_to_mongo
+from app.helpers.logconf import log_configuration
+from app.helpers.queue_utils import dispatch_concurrent_fs, dispatch_serial_fs
+from app.helpers.task_queue import ack_task, claim_stale_tasks, create_consumer_group, decode_tasks, read_tasks
+from app.helpers.websockets import close_pusher_connection
+
+logger = logging.getLogger(__name__)
+
+# runs the background tasks queued by the web workers when BG_TASKS_BACKEND=redis:
+#   python -m app.worker --concurrency 50
+
+READ_BLOCK_MS = 1000
+# entries delivered to a worker that hasn't acked them in this long are assumed lost and run again
+STALE_TASK_IDLE_MS = 5 * 60 * 1000
+CLAIM_INTERVAL_SECONDS = 30
+WORKER_SHUTDOWN_TIMEOUT_SECONDS = 30
+
+
+async def process_task_entry(entry_id: str, fields: dict):
+    try:
+        fs = await decode_tasks(fields["tasks"])
+    except Exception as e:
+        logger.exception("Problem decoding task, dropping it. [entry_id=%s]", entry_id)
+        capture_exception(e)
+        await ack_task(entry_id)
+        return
+
+    if fields.get("concurrent") == "0":
+        await dispatch_serial_fs(fs)
+    else:
+        await dispatch_concurrent_fs(fs)
+
+    await ack_task(entry_id)
+
+
+async def run_worker(consumer_name: str, concurrency: int, stop_event: asyncio.Event):
+    await create_consumer_group()
+    in_flight: Set[asyncio.Task] = set()
+    last_claimed_at = 0.0
+
+    while not stop_event.is_set():
+        free_slots = concurrency - len(in_flight)
+        if free_slots <= 0:
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            continue
+
+        try:
+            entries = []
+            if time.monotonic() - last_claimed_at >= CLAIM_INTERVAL_SECONDS:
+                last_claimed_at = time.monotonic()
+                entries = await claim_stale_tasks(consumer_name, min_idle_ms=STALE_TASK_IDLE_MS, count=free_slots)
+            if not entries:
+                entries = await read_tasks(consumer_name, count=free_slots, block_ms=READ_BLOCK_MS)
+        except RedisError:
+            logger.exception("Problem reading tasks. [consumer=%s]", consumer_name)
+            await asyncio.sleep(1)
+            continue
+
+        for entry_id, fields in entries:
+            task = asyncio.create_task(process_task_entry(entry_id, fields))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        logger.info("Waiting for running tasks. [count=%d]", len(in_flight))
+        await asyncio.wait(in_flight, timeout=WORKER_SHUTDOWN_TIMEOUT_SECONDS)
+
+
+async def main():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Run queued background tasks.")
+    parser.add_argument("--concurrency", type=int, default=settings.bg_worker_concurrency)
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}")
+    args = parser.parse_args()
+
+    if not settings.testing:
+        sentry_sdk.init(dsn=settings.sentry_dsn, environment=settings.environment)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await connect_to_mongo()
+    await connect_to_redis()
+    logger.info("Worker started. [consumer=%s, concurrency=%d]", args.name, args.concurrency)
+    try:
+        await run_worker(args.name, concurrency=args.concurrency, stop_event=stop_event)
+    finally:
+        await stop_channel_last_message_writer()
+        await close_pusher_connection()
+        await close_redis_connection()
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.config.dictConfig(log_configuration)
+    asyncio.run(main())